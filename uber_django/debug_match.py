@@ -1,9 +1,9 @@
 # debug_match.py
-from rides.models import Ride, DriverProfile
-from rides.views import haversine
+from rides.models import Ride, RideStatus, DriverProfile
+from rides.fares import haversine
 
 ride = Ride.objects.latest('id')
-print(f"\n🎯 Ride #{ride.id} - Status before: {ride.status}")
+print(f"\n🎯 Ride #{ride.id} - Status before: {ride.status_code}")
 print(f"Pickup: {ride.pickup_lat}, {ride.pickup_lng}")
 
 available = DriverProfile.objects.filter(is_available=True, latitude__isnull=False, longitude__isnull=False)
@@ -22,8 +22,8 @@ if nearest_driver:
     ride.driver = nearest_driver
     nearest_driver.is_available = False
     nearest_driver.save()
-    ride.status = "ASSIGNED"   # use uppercase!
+    ride.status = RideStatus.ASSIGNED
     ride.save()
-    print(f"\n✅ Ride assigned to Driver {nearest_driver.id} with status: {ride.status}")
+    print(f"\n✅ Ride assigned to Driver {nearest_driver.id} with status: {ride.status_code}")
 else:
     print("\n⚠️ No available driver found")
@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedRide, Payment, Ride, RideStatus
+
+
+def archivable_rides(older_than_days):
+    """
+    Completed or cancelled rides that finished before the cutoff, except
+    those whose payment the settlement worker has not finished with
+    """
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    return Ride.objects.filter(
+        Q(status=RideStatus.COMPLETED, completed_at__lt=cutoff) |
+        # Cancelled rides carry no finish time; their request time is the best we have
+        Q(status=RideStatus.CANCELLED, requested_at__lt=cutoff)
+    ).exclude(payment__payment_status="pending")
+
+
+def archive_finished_rides(older_than_days=None, batch_size=1000):
+    """Move finished rides and their payments to the archive; return how many moved"""
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'RIDE_ARCHIVE_AFTER_DAYS', 30)
+    candidates = archivable_rides(older_than_days).select_related('payment').order_by('id')
+
+    moved = 0
+    while True:
+        # One transaction per batch keeps write locks short for the live API
+        with transaction.atomic():
+            batch = list(candidates[:batch_size])
+            if not batch:
+                break
+            ArchivedRide.objects.bulk_create([ArchivedRide.from_ride(ride) for ride in batch])
+            # Payments go with their rides (on_delete=CASCADE)
+            Ride.objects.filter(id__in=[ride.id for ride in batch]).delete()
+        moved += len(batch)
+    return moved
+
+
+# Payments not counted in earnings
+UNCOLLECTED_PAYMENT_STATUSES = ("refunded", "failed")
+
+
+def paid_ride_sources():
+    """
+    Completed rides' payments in the hot and archived stores, each as
+    (queryset, driver lookup, amount lookup, completed_at lookup). Pending
+    payments count; refunded ones and those settlement gave up on do not.
+    """
+    return [
+        (
+            Payment.objects.filter(
+                ride__status=RideStatus.COMPLETED, ride__driver__isnull=False
+            ).exclude(payment_status__in=UNCOLLECTED_PAYMENT_STATUSES),
+            'ride__driver', 'amount', 'ride__completed_at',
+        ),
+        (
+            ArchivedRide.objects.filter(
+                status=RideStatus.COMPLETED, driver__isnull=False, payment_id__isnull=False
+            ).exclude(payment_status__in=UNCOLLECTED_PAYMENT_STATUSES),
+            'driver', 'payment_amount', 'completed_at',
+        ),
+    ]
@@ -1,14 +1,40 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
-from rides.models import Ride
-from rides.serializers import RideSerializer
+from rides.models import Ride, ACTIVE_RIDE_STATUSES
+from rides.fast_serializers import serialize_ride
 from rest_framework_simplejwt.tokens import UntypedToken
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from jwt import DecodeError, ExpiredSignatureError
 from channels.db import database_sync_to_async
+from rides.send_queue import OutboundQueue
+from rides import telemetry
 
-class RideConsumer(AsyncWebsocketConsumer):
+
+class QueuedSendMixin:
+    """Route outbound events through a bounded per-connection queue"""
+    outbox = None
+
+    def start_outbox(self):
+        self.outbox = OutboundQueue(self.send, self.close)
+        self.outbox.start()
+        telemetry.WS_CONNECTIONS.inc(consumer=type(self).__name__)
+
+    async def stop_outbox(self):
+        if self.outbox is not None:
+            await self.outbox.stop()
+            telemetry.WS_CONNECTIONS.dec(consumer=type(self).__name__)
+
+    async def queue_send(self, payload, key=None):
+        telemetry.WS_MESSAGES.inc(consumer=type(self).__name__, direction='out')
+        await self.outbox.put(json.dumps(payload), key=key)
+
+    async def websocket_receive(self, message):
+        telemetry.WS_MESSAGES.inc(consumer=type(self).__name__, direction='in')
+        await super().websocket_receive(message)
+
+
+class RideConsumer(QueuedSendMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.ride_id = self.scope['url_route']['kwargs']['ride_id']
         self.room_group_name = f'ride_{self.ride_id}'
@@ -26,18 +52,23 @@ class RideConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         await self.accept()
+        self.start_outbox()
 
     async def disconnect(self, close_code):
+        await self.stop_outbox()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
     async def ride_update(self, event):
-        await self.send(text_data=json.dumps({
+        # A queued event is only replaced by a newer one of the same kind:
+        # 'ride_completed' carries the fare, 'payment_settled' only the payment.
+        # Untyped messages are never coalesced
+        await self.queue_send({
             'type': 'ride_update',
             'ride': event.get('ride', event.get('message', {}))
-        }))
+        }, key=('ride_update', event['event']) if event.get('event') else None)
 
     @database_sync_to_async
     def authenticate_token(self, token):
@@ -50,7 +81,7 @@ class RideConsumer(AsyncWebsocketConsumer):
         except (DecodeError, ExpiredSignatureError):
             return None
 
-class DriverConsumer(AsyncWebsocketConsumer):
+class DriverConsumer(QueuedSendMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.driver_id = self.scope['url_route']['kwargs']['driver_id']
         self.room_group_name = f'driver_{self.driver_id}'
@@ -60,36 +91,41 @@ class DriverConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         await self.accept()
+        self.start_outbox()
 
         try:
             ride = await sync_to_async(self.get_current_ride)()
             if ride:
                 # Serialize in thread-safe way
-                serialized = await sync_to_async(lambda r: RideSerializer(r).data)(ride)
-                await self.send(text_data=json.dumps({
+                serialized = await sync_to_async(serialize_ride)(ride)
+                await self.queue_send({
                     'type': 'current_ride',
                     'ride': serialized
-                }))
+                })
         except Exception as e:
             print("DriverConsumer connect error:", e)
 
     async def ride_update(self, event):
-        await self.send(text_data=json.dumps({
+        ride = event['ride']
+        await self.queue_send({
             'type': 'ride_update',
-            'ride': event['ride']
-        }))
+            'ride': ride
+        }, key=('ride_update', ride.get('id')))
 
     def get_current_ride(self):
-        return Ride.objects.filter(
+        return Ride.objects.select_related(
+            'passenger__user', 'driver__user', 'payment'
+        ).filter(
             driver_id=self.driver_id,
-            status__in=['ASSIGNED', 'PICKED_UP']
+            status__in=ACTIVE_RIDE_STATUSES
         ).first()
 
     async def disconnect(self, close_code):
+        await self.stop_outbox()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
     async def new_ride_request(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.queue_send(event)
@@ -0,0 +1,121 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA_DB_ALIAS = 'replica'
+
+DEFAULTS = {
+    # Cache alias remembering which users wrote recently. Stickiness only
+    # holds across the workers that share it: LocMem keeps it per process,
+    # so a user's next request on another worker may read the replica
+    'CACHE': 'default',
+    # After a write, the user's reads stay on the primary for this long
+    'SECONDS': 5,
+}
+
+
+def get_config():
+    """Merge DB_READ_YOUR_WRITES setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'DB_READ_YOUR_WRITES', {}))
+    return config
+
+# Alias reads go to for the current request; None means the primary
+_read_alias = ContextVar('read_alias', default=None)
+
+
+# ----------------------------
+# Router
+# ----------------------------
+class PrimaryReplicaRouter:
+    """
+    Writes always go to the primary. Reads go to the replica only inside
+    use_replica(), which read-only views opt into per request.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+@contextmanager
+def use_replica():
+    """Route reads in this block to the replica, if one is configured"""
+    token = _read_alias.set(REPLICA_DB_ALIAS if replica_configured() else None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+# ----------------------------
+# Read-your-writes stickiness
+# ----------------------------
+def _write_key(user_id):
+    return f'db:recent_write:{user_id}'
+
+
+def mark_recent_write(user_id):
+    """Pin this user's reads to the primary for SECONDS, in every worker sharing CACHE"""
+    config = get_config()
+    caches[config['CACHE']].set(_write_key(user_id), True, timeout=config['SECONDS'])
+
+
+def has_recent_write(user_id):
+    return caches[get_config()['CACHE']].get(_write_key(user_id), False)
+
+
+# ----------------------------
+# View mixin
+# ----------------------------
+class ReplicaReadMixin:
+    """
+    Serve the listed read-only actions from the replica.
+
+    replica_actions holds viewset action names, or lowercase HTTP methods
+    for plain API views. A successful write pins the user to the primary
+    for a few seconds so they always see their own changes.
+    """
+    replica_actions = ()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._replica = None
+        if self.reads_from_replica(request):
+            self._replica = use_replica()
+            self._replica.__enter__()
+
+    def reads_from_replica(self, request):
+        if not replica_configured() or request.method not in SAFE_METHODS:
+            return False
+        action = getattr(self, 'action', None) or request.method.lower()
+        if action not in self.replica_actions:
+            return False
+        return not (request.user.is_authenticated and has_recent_write(request.user.id))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        replica = getattr(self, '_replica', None)
+        if replica is not None:
+            self._replica = None
+            replica.__exit__(None, None, None)
+        if (request.method not in SAFE_METHODS and response.status_code < 400
+                and getattr(request, 'user', None) is not None and request.user.is_authenticated):
+            mark_recent_write(request.user.id)
+        return super().finalize_response(request, response, *args, **kwargs)
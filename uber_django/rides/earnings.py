@@ -0,0 +1,103 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .archive import UNCOLLECTED_PAYMENT_STATUSES, paid_ride_sources
+from .models import DriverEarnings, DriverProfile, Payment
+from .rollups import record_refund
+
+
+# ----------------------------
+# Incremental updates
+# ----------------------------
+def _apply_delta(driver_id, rides, amount):
+    """Add rides/amount to a driver's summary row, creating it on first use"""
+    delta = {
+        'ride_count': F('ride_count') + rides,
+        'total_amount': F('total_amount') + amount,
+        'updated_at': timezone.now(),
+    }
+    if DriverEarnings.objects.filter(driver_id=driver_id).update(**delta):
+        return
+    DriverEarnings.objects.get_or_create(driver_id=driver_id)
+    DriverEarnings.objects.filter(driver_id=driver_id).update(**delta)
+
+
+def record_completed_ride(payment):
+    """Count a completed ride's payment; call inside the completion transaction"""
+    _apply_delta(payment.ride.driver_id, 1, Decimal(str(payment.amount)))
+
+
+def refund_payment(payment):
+    """Refund a payment and take it back out of the driver's earnings"""
+    with transaction.atomic():
+        updated = Payment.objects.filter(pk=payment.pk).exclude(
+            payment_status__in=UNCOLLECTED_PAYMENT_STATUSES
+        ).update(payment_status="refunded")
+        if updated:
+            reverse_earnings(payment)
+    payment.payment_status = "refunded"
+    return payment
+
+
+def reverse_earnings(payment):
+    """
+    Take a payment that will not be collected back out of the driver's
+    summary and rollups; call in the transaction that marks it refunded
+    or failed.
+    """
+    _apply_delta(payment.ride.driver_id, -1, -Decimal(str(payment.amount)))
+    record_refund(payment)
+
+
+# ----------------------------
+# Reads
+# ----------------------------
+def get_earnings_summary(user):
+    """Earnings totals for a driver user, or None if the user is not a driver"""
+    summary = DriverEarnings.objects.filter(driver__user=user).values(
+        'ride_count', 'total_amount'
+    ).first()
+    if summary is None:
+        if not DriverProfile.objects.filter(user=user).exists():
+            return None
+        summary = {'ride_count': 0, 'total_amount': Decimal('0')}
+    return summary
+
+
+# ----------------------------
+# Rebuild
+# ----------------------------
+def rebuild_driver_earnings():
+    """Recompute every driver's summary from live and archived payments; return rows written"""
+    with transaction.atomic():
+        return _rebuild()
+
+
+def _rebuild():
+    by_driver = {}
+    for queryset, driver, amount, _ in paid_ride_sources():
+        rows = queryset.values(driver).annotate(
+            ride_count=Count('pk'), total_amount=Sum(amount)
+        ).order_by()
+        for row in rows:
+            totals = by_driver.setdefault(row[driver], [0, Decimal('0')])
+            totals[0] += row['ride_count']
+            totals[1] += row['total_amount'] or 0
+
+    now = timezone.now()
+    rows = []
+    for driver_id in DriverProfile.objects.values_list('id', flat=True).iterator():
+        ride_count, total_amount = by_driver.get(driver_id, (0, 0))
+        rows.append(DriverEarnings(
+            driver_id=driver_id,
+            ride_count=ride_count,
+            total_amount=total_amount,
+            updated_at=now,
+        ))
+
+    DriverEarnings.objects.all().delete()
+    DriverEarnings.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
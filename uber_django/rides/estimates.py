@@ -0,0 +1,185 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import fares
+from .fares import haversine
+from .models import DriverProfile
+
+DEFAULTS = {
+    # Cache alias holding estimates and cell supply versions
+    'CACHE': 'default',
+    # Grid cell edge in degrees (0.01 is about 1.1 km of latitude)
+    'CELL_DEGREES': 0.01,
+    # Seconds an estimate is served before it is recomputed anyway
+    'TTL_SECONDS': 5,
+}
+
+
+def get_config():
+    """Merge RIDE_ESTIMATES setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'RIDE_ESTIMATES', {}))
+    return config
+
+
+# ----------------------------
+# Worker-wide metrics
+# ----------------------------
+metrics = {
+    'hits': 0,
+    'misses': 0,
+    'supply_changes': 0,    # cells whose estimates were invalidated
+}
+
+
+def get_metrics():
+    """Snapshot of the estimate cache counters for this worker"""
+    return dict(metrics)
+
+
+# ----------------------------
+# Grid
+# ----------------------------
+def cell_of(lat, lng, size=None):
+    size = size or get_config()['CELL_DEGREES']
+    return math.floor(lat / size), math.floor(lng / size)
+
+
+def cell_center(cell, size=None):
+    size = size or get_config()['CELL_DEGREES']
+    return (cell[0] + 0.5) * size, (cell[1] + 0.5) * size
+
+
+def neighbourhood(cell):
+    """The cell and the eight around it: where a pickup's ETA looks for drivers"""
+    row, col = cell
+    return [(row + dr, col + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]
+
+
+def _version_key(cell):
+    return f'estimate:version:{cell[0]}:{cell[1]}'
+
+
+def _body_key(pickup_cell, dropoff_cell, version):
+    return f'estimate:{pickup_cell[0]}:{pickup_cell[1]}:{dropoff_cell[0]}:{dropoff_cell[1]}:{version}'
+
+
+# ----------------------------
+# Reads
+# ----------------------------
+def fetch(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, render):
+    """
+    Return the cached body for this pickup and dropoff cell pair, or
+    render(estimate(...)) it and cache it for TTL_SECONDS.
+
+    As in profile_cache, the pickup cell's version is read before the
+    estimate touches the database, so one built from supply that changes
+    mid-render lands under a stale key and is never served.
+    """
+    config = get_config()
+    cache = caches[config['CACHE']]
+    pickup_cell = cell_of(pickup_lat, pickup_lng, config['CELL_DEGREES'])
+    dropoff_cell = cell_of(dropoff_lat, dropoff_lng, config['CELL_DEGREES'])
+
+    key = _body_key(pickup_cell, dropoff_cell, cache.get(_version_key(pickup_cell), 0))
+    body = cache.get(key)
+    if body is not None:
+        metrics['hits'] += 1
+        return body
+    metrics['misses'] += 1
+    body = render(estimate(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng))
+    cache.set(key, body, timeout=config['TTL_SECONDS'])
+    return body
+
+
+def estimate(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng):
+    """
+    Uncached: ETA of the nearest available driver around the pickup cell,
+    and the fare between the pickup and dropoff cell centres.
+
+    Everyone browsing from one cell gets the same answer, so it is
+    computed from the centres rather than whichever point came first.
+    Drivers are only looked for in the pickup cell's neighbourhood; none
+    there means no ETA.
+    """
+    size = get_config()['CELL_DEGREES']
+    pickup_cell = cell_of(pickup_lat, pickup_lng, size)
+    dropoff_cell = cell_of(dropoff_lat, dropoff_lng, size)
+    pickup = cell_center(pickup_cell, size)
+    dropoff = cell_center(dropoff_cell, size)
+    tariff = fares.get_tariff()
+
+    rows = DriverProfile.objects.filter(
+        is_available=True,
+        latitude__gte=(pickup_cell[0] - 1) * size,
+        latitude__lt=(pickup_cell[0] + 2) * size,
+        longitude__gte=(pickup_cell[1] - 1) * size,
+        longitude__lt=(pickup_cell[1] + 2) * size,
+    ).values_list('latitude', 'longitude')
+    distances = [haversine(*pickup, lat, lng) for lat, lng in rows]
+
+    quote = tariff.quote(*pickup, *dropoff)
+    nearest = min(distances, default=None)
+    return {
+        'eta_min': None if nearest is None else round(nearest * tariff.minutes_per_km, 1),
+        'nearby_drivers': len(distances),
+        'distance_km': round(quote.distance_km, 2),
+        'duration_min': round(quote.duration_min, 1),
+        'multiplier': round(quote.multiplier, 3),
+        'fare': quote.fare,
+    }
+
+
+# ----------------------------
+# Invalidation
+# ----------------------------
+def supply_of(driver):
+    """What driver_changed() compares: (latitude, longitude, is_available)"""
+    return driver.latitude, driver.longitude, driver.is_available
+
+
+def driver_changed(before, after):
+    """
+    Invalidate estimates around the cells whose available supply changed.
+
+    before and after are supply_of() one driver around a write.
+    Moving within a cell is not material and keeps the cache; becoming
+    available or unavailable, or crossing into another cell, is.
+    """
+    size = get_config()['CELL_DEGREES']
+    old = cell_of(before[0], before[1], size) if before[2] and None not in before[:2] else None
+    new = cell_of(after[0], after[1], size) if after[2] and None not in after[:2] else None
+    if old != new:
+        supply_changed([cell for cell in (old, new) if cell is not None])
+
+
+def supply_changed(cells):
+    """
+    Drop cached estimates that could see drivers in these cells. Every
+    pickup cell within one cell of them gets a new version, so reads stay
+    a single version lookup. Inside a transaction this waits for the
+    commit, as profile_cache.invalidate() does.
+
+    The versions live in CACHE, so with a per-process cache such as
+    LocMem only this worker sees the bump; other workers keep serving
+    their estimates until TTL_SECONDS expires them.
+    """
+    if cells:
+        transaction.on_commit(lambda: _bump(cells))
+
+
+def _bump(cells):
+    config = get_config()
+    affected = {around for cell in cells for around in neighbourhood(cell)}
+    # Any value the cell has not had before works; no read-modify-write needed.
+    # Once every body cached under the old version has expired the version
+    # itself can go, falling back to 0.
+    version = f'{time.time_ns():x}'
+    caches[config['CACHE']].set_many(
+        {_version_key(cell): version for cell in affected}, timeout=2 * config['TTL_SECONDS']
+    )
+    metrics['supply_changes'] += len(cells)
@@ -0,0 +1,126 @@
+import csv
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import ArchivedRide, Ride, RideStatus
+
+# Column name -> lookup in the hot table / in the archive table
+EXPORT_COLUMNS = [
+    ('ride_id', 'id', 'id'),
+    ('passenger_id', 'passenger_id', 'passenger_id'),
+    ('driver_id', 'driver_id', 'driver_id'),
+    ('status', 'status', 'status'),
+    ('pickup_location', 'pickup_location', 'pickup_location'),
+    ('pickup_lat', 'pickup_lat', 'pickup_lat'),
+    ('pickup_lng', 'pickup_lng', 'pickup_lng'),
+    ('dropoff_location', 'dropoff_location', 'dropoff_location'),
+    ('dropoff_lat', 'dropoff_lat', 'dropoff_lat'),
+    ('dropoff_lng', 'dropoff_lng', 'dropoff_lng'),
+    ('requested_at', 'requested_at', 'requested_at'),
+    ('completed_at', 'completed_at', 'completed_at'),
+    ('fare', 'fare', 'fare'),
+    ('payment_id', 'payment__id', 'payment_id'),
+    ('payment_amount', 'payment__amount', 'payment_amount'),
+    ('payment_status', 'payment__payment_status', 'payment_status'),
+    ('payment_created_at', 'payment__created_at', 'payment_created_at'),
+    ('paid_at', 'payment__paid_at', 'payment_paid_at'),
+]
+COLUMN_NAMES = [name for name, _, _ in EXPORT_COLUMNS]
+EXPORT_FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+STATUS_CODES = {status.value: status.code for status in RideStatus}
+
+
+# ----------------------------
+# Rows
+# ----------------------------
+def iter_export_rows(start=None, end=None, chunk_size=2000):
+    """
+    Yield one row per ride (hot, then archived) in COLUMN_NAMES order.
+
+    values_list() skips model instances and iterator() reads in chunks,
+    so memory stays flat however many rides match.
+    """
+    sources = [
+        (Ride.objects.all(), [hot for _, hot, _ in EXPORT_COLUMNS]),
+        (ArchivedRide.objects.all(), [cold for _, _, cold in EXPORT_COLUMNS]),
+    ]
+    status_index = COLUMN_NAMES.index('status')
+    payment_status_index = COLUMN_NAMES.index('payment_status')
+    for queryset, lookups in sources:
+        if start is not None:
+            queryset = queryset.filter(requested_at__gte=start)
+        if end is not None:
+            queryset = queryset.filter(requested_at__lt=end)
+        rows = queryset.order_by('id').values_list(*lookups).iterator(chunk_size=chunk_size)
+        for row in rows:
+            row = list(row)
+            row[status_index] = STATUS_CODES.get(row[status_index], row[status_index])
+            # Archived rides without a payment store '' rather than NULL
+            row[payment_status_index] = row[payment_status_index] or None
+            yield row
+
+
+# ----------------------------
+# Encoders
+# ----------------------------
+class _Echo:
+    """File-like object that hands back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(COLUMN_NAMES, row))) + '\n'
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMN_NAMES)
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in row])
+
+
+def export_lines(export_format, start=None, end=None, chunk_size=2000):
+    rows = iter_export_rows(start, end, chunk_size)
+    if export_format == 'csv':
+        return csv_lines(rows)
+    return ndjson_lines(rows)
+
+
+def buffered(lines, size=64 * 1024):
+    """Join lines into ~size-byte blocks to cut per-chunk overhead"""
+    block = []
+    length = 0
+    for line in lines:
+        block.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(block)
+            block = []
+            length = 0
+    if block:
+        yield ''.join(block)
+
+
+async def async_blocks(blocks):
+    """
+    Drive a sync generator from an ASGI response one block at a time.
+
+    Django would otherwise list() a sync iterator before streaming it
+    under ASGI. thread_sensitive keeps every step on the same thread, and
+    so on the same open database cursor.
+    """
+    step = sync_to_async(next, thread_sensitive=True)
+    while True:
+        block = await step(blocks, None)
+        if block is None:
+            return
+        yield block
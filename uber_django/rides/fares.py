@@ -0,0 +1,141 @@
+from math import asin, cos, radians, sin, sqrt
+from typing import NamedTuple
+
+from django.conf import settings
+from django.utils import timezone
+
+EARTH_RADIUS_KM = 6371
+
+DEFAULTS = {
+    'BASE': 5.0,
+    'PER_KM': 1.5,
+    'PER_MINUTE': 0.0,
+    'MINIMUM': 0.0,
+    # Trip duration estimate for PER_MINUTE, until we have routing
+    'AVERAGE_SPEED_KMH': 25.0,
+    # [{'FROM': 7, 'TO': 10, 'MULTIPLIER': 1.3}, ...]: local hours, TO exclusive,
+    # may wrap past midnight; unlisted hours are 1.0
+    'TIME_OF_DAY': [],
+    # [{'NAME': 'airport', 'LAT': .., 'LNG': .., 'RADIUS_KM': 3, 'MULTIPLIER': 1.25}, ...]:
+    # applies when pickup or dropoff is inside; the highest matching zone wins
+    'ZONES': [],
+}
+
+
+def get_config():
+    """Merge FARE_TARIFF setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'FARE_TARIFF', {}))
+    return config
+
+
+class Quote(NamedTuple):
+    distance_km: float
+    duration_min: float
+    multiplier: float
+    fare: float
+
+
+# ----------------------------
+# Compiled tariff
+# ----------------------------
+class Tariff:
+    """
+    FARE_TARIFF compiled into lookup tables: one multiplier per hour of
+    day and flat zone arrays, so pricing a trip is a few multiplications.
+    """
+
+    def __init__(self, config):
+        self.base = float(config['BASE'])
+        self.per_km = float(config['PER_KM'])
+        self.per_minute = float(config['PER_MINUTE'])
+        self.minimum = float(config['MINIMUM'])
+        self.minutes_per_km = 60.0 / float(config['AVERAGE_SPEED_KMH'])
+
+        hours = [1.0] * 24
+        for band in config['TIME_OF_DAY']:
+            hour = band['FROM'] % 24
+            while True:
+                hours[hour] = float(band['MULTIPLIER'])
+                hour = (hour + 1) % 24
+                if hour == band['TO'] % 24:
+                    break
+        self.hour_multipliers = tuple(hours)
+
+        zones = config['ZONES']
+        self.zone_lats = [float(z['LAT']) for z in zones]
+        self.zone_lngs = [float(z['LNG']) for z in zones]
+        self.zone_radii = [float(z['RADIUS_KM']) for z in zones]
+        self.zone_multipliers = [float(z['MULTIPLIER']) for z in zones]
+
+    def hour_multiplier(self, at=None):
+        return self.hour_multipliers[timezone.localtime(at or timezone.now()).hour]
+
+    def zone_multiplier(self, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng):
+        multiplier = 1.0
+        for lat, lng, radius, zone_multiplier in zip(
+            self.zone_lats, self.zone_lngs, self.zone_radii, self.zone_multipliers
+        ):
+            if zone_multiplier > multiplier and (
+                haversine(pickup_lat, pickup_lng, lat, lng) <= radius
+                or haversine(dropoff_lat, dropoff_lng, lat, lng) <= radius
+            ):
+                multiplier = zone_multiplier
+        return multiplier
+
+    def _price(self, distance, multiplier):
+        minutes = distance * self.minutes_per_km
+        fare = (self.base + self.per_km * distance + self.per_minute * minutes) * multiplier
+        return Quote(distance, minutes, multiplier, round(max(self.minimum, fare), 2))
+
+    def quote(self, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, at=None):
+        """Price one trip"""
+        distance = haversine(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng)
+        multiplier = self.hour_multiplier(at) * self.zone_multiplier(
+            pickup_lat, pickup_lng, dropoff_lat, dropoff_lng
+        )
+        return self._price(distance, multiplier)
+
+    def quote_batch(self, trips, at=None):
+        """
+        Price many (pickup_lat, pickup_lng, dropoff_lat, dropoff_lng) trips
+        at one moment; same results as quote() for each, with the hour
+        multiplier looked up once.
+        """
+        hour = self.hour_multiplier(at) if trips else 1.0
+        return [
+            self._price(haversine(*trip), hour * self.zone_multiplier(*trip))
+            for trip in trips
+        ]
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance (km) between two lat/long points"""
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * (2 * asin(sqrt(a)))
+
+
+# ----------------------------
+# Module-level API
+# ----------------------------
+_compiled = (None, None)
+
+
+def get_tariff():
+    """The compiled tariff for the current FARE_TARIFF, rebuilt only when it changes"""
+    global _compiled
+    config = get_config()
+    key = repr(sorted(config.items()))
+    if _compiled[0] != key:
+        _compiled = (key, Tariff(config))
+    return _compiled[1]
+
+
+def quote(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, at=None):
+    return get_tariff().quote(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, at)
+
+
+def quote_batch(trips, at=None):
+    return get_tariff().quote_batch(trips, at)
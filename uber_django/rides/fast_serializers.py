@@ -0,0 +1,140 @@
+"""
+Read-only fast path for RideSerializer output.
+
+The field plan is compiled once, at import, from RideSerializer's own
+fields: every leaf keeps the DRF field's to_representation(), so values
+are formatted exactly as before, but the per-call cost of building
+serializers, binding fields and walking sources is gone. Rides come in
+as flat rows (values_list() over Ride or ArchivedRide) or as instances.
+"""
+from django.core.exceptions import ObjectDoesNotExist
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.serializers import BaseSerializer
+
+from .models import ArchivedRide
+from .serializers import PaymentSerializer, RideSerializer
+
+# SerializerMethodFields whose output is a nested serializer over an attribute
+METHOD_FIELDS = {'payment': PaymentSerializer}
+
+# ArchivedRide stores the payment flattened on the ride row
+ARCHIVE_PAYMENT_LOOKUPS = {
+    'payment.id': 'payment_id',
+    'payment.ride_id': 'id',
+    'payment.amount': 'payment_amount',
+    'payment.payment_status': 'payment_status',
+    'payment.paid_at': 'payment_paid_at',
+    'payment.created_at': 'payment_created_at',
+}
+
+
+# ----------------------------
+# Plan compilation
+# ----------------------------
+def _column(columns, path):
+    """Row index of a dotted attribute path, adding it on first use"""
+    if path not in columns:
+        columns.append(path)
+    return columns.index(path)
+
+
+def _compile(serializer, prefix, columns):
+    """
+    Turn a serializer into [(key, row index, convert, subplan)].
+
+    A nested object is keyed on its id column (None there means the object
+    is missing, which DRF renders as null) and carries a subplan.
+    """
+    plan = []
+    for field in serializer._readable_fields:
+        if field.field_name in METHOD_FIELDS:
+            path = prefix + field.field_name
+            nested = METHOD_FIELDS[field.field_name]()
+        elif isinstance(field, BaseSerializer):
+            path = prefix + field.source
+            nested = field
+        else:
+            path = prefix + field.source
+            nested = None
+
+        if nested is not None:
+            index = _column(columns, path + '.id')
+            plan.append((field.field_name, index, None, _compile(nested, path + '.', columns)))
+        elif isinstance(field, PrimaryKeyRelatedField):
+            plan.append((field.field_name, _column(columns, path + '_id'), None, None))
+        else:
+            plan.append((field.field_name, _column(columns, path), field.to_representation, None))
+    return plan
+
+
+def _compile_ride_plan():
+    columns = []
+    plan = _compile(RideSerializer(), '', columns)
+    return columns, plan
+
+
+# Dotted attribute paths, one per row position
+COLUMNS, PLAN = _compile_ride_plan()
+HOT_LOOKUPS = [column.replace('.', '__') for column in COLUMNS]
+ARCHIVE_LOOKUPS = [ARCHIVE_PAYMENT_LOOKUPS.get(column, column.replace('.', '__')) for column in COLUMNS]
+COLUMN_PATHS = [tuple(column.split('.')) for column in COLUMNS]
+ID_INDEX = COLUMNS.index('id')
+REQUESTED_AT_INDEX = COLUMNS.index('requested_at')
+
+
+# ----------------------------
+# Rows
+# ----------------------------
+def ride_rows(queryset):
+    """values_list() over a Ride or ArchivedRide queryset in COLUMNS order"""
+    lookups = ARCHIVE_LOOKUPS if queryset.model is ArchivedRide else HOT_LOOKUPS
+    return queryset.values_list(*lookups)
+
+
+def ride_row_position(row):
+    """(requested_at, id) of a row, for keyset pagination"""
+    return row[REQUESTED_AT_INDEX], row[ID_INDEX]
+
+
+def _resolve(obj, path):
+    for name in path:
+        if obj is None:
+            return None
+        try:
+            obj = getattr(obj, name)
+        except ObjectDoesNotExist:
+            return None
+    return obj
+
+
+def ride_row(ride):
+    """The COLUMNS row for a Ride instance (reuses whatever is already loaded)"""
+    return [_resolve(ride, path) for path in COLUMN_PATHS]
+
+
+# ----------------------------
+# Rendering
+# ----------------------------
+def _render(row, plan):
+    data = {}
+    for key, index, convert, subplan in plan:
+        value = row[index]
+        if value is None:
+            data[key] = None
+        elif subplan is not None:
+            data[key] = _render(row, subplan)
+        elif convert is None:
+            data[key] = value
+        else:
+            data[key] = convert(value)
+    return data
+
+
+def serialize_ride_row(row):
+    """Same dict as RideSerializer(ride).data, from a ride_rows() row"""
+    return _render(row, PLAN)
+
+
+def serialize_ride(ride):
+    """Same dict as RideSerializer(ride).data, from a Ride instance"""
+    return _render(ride_row(ride), PLAN)
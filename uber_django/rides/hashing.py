@@ -0,0 +1,161 @@
+import base64
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+DEFAULTS = {
+    # Hashing processes; 0 hashes inline on the request thread
+    'WORKERS': max(1, (os.cpu_count() or 2) // 2),
+    # Hashes queued or running at once; callers beyond this wait
+    'MAX_PENDING': 32,
+    # Seconds a caller waits for a slot before getting a 503
+    'QUEUE_TIMEOUT': 5.0,
+}
+
+
+def get_config():
+    """Merge PASSWORD_HASHING_POOL setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PASSWORD_HASHING_POOL', {}))
+    return config
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Authentication is busy, please retry shortly.'
+    default_code = 'password_hashing_busy'
+
+
+# ----------------------------
+# Worker-wide metrics
+# ----------------------------
+metrics = {
+    'submitted': 0,
+    'completed': 0,
+    'rejected': 0,          # no slot within QUEUE_TIMEOUT
+    'in_flight': 0,         # waiting for a slot, queued or hashing
+    'queue_seconds_total': 0.0,
+    'queue_seconds_max': 0.0,
+    'hash_seconds_total': 0.0,
+}
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Snapshot of the hashing pool counters for this worker"""
+    with _metrics_lock:
+        snapshot = dict(metrics)
+    done = snapshot['completed'] or 1
+    snapshot['queue_seconds_avg'] = snapshot['queue_seconds_total'] / done
+    snapshot['hash_seconds_avg'] = snapshot['hash_seconds_total'] / done
+    return snapshot
+
+
+def _count(**deltas):
+    with _metrics_lock:
+        for name, delta in deltas.items():
+            metrics[name] += delta
+
+
+# ----------------------------
+# Pool
+# ----------------------------
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+def _pbkdf2(password, salt, iterations):
+    """Runs in a pool process: (digest, wall-clock start)"""
+    started = time.time()
+    return hashlib.pbkdf2_hmac('sha256', password, salt, iterations), started
+
+
+def _get_pool(config):
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            # spawn: workers only need hashlib, and forking a threaded server is fragile
+            _pool = ProcessPoolExecutor(
+                max_workers=config['WORKERS'], mp_context=multiprocessing.get_context('spawn')
+            )
+            _slots = threading.BoundedSemaphore(config['MAX_PENDING'])
+        return _pool, _slots
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def pbkdf2_sha256(password, salt, iterations):
+    """
+    PBKDF2-HMAC-SHA256 on the hashing pool.
+
+    At most MAX_PENDING hashes are queued or running per server process;
+    a caller that cannot get a slot within QUEUE_TIMEOUT gets
+    PasswordHashingBusy, so a login storm backs up auth alone instead of
+    taking every core from ride requests.
+    """
+    password, salt = password.encode(), salt.encode()
+    config = get_config()
+    if not config['WORKERS']:
+        return hashlib.pbkdf2_hmac('sha256', password, salt, iterations)
+
+    pool, slots = _get_pool(config)
+    submitted = time.time()
+    _count(submitted=1, in_flight=1)
+    try:
+        if not slots.acquire(timeout=config['QUEUE_TIMEOUT']):
+            _count(rejected=1)
+            raise PasswordHashingBusy()
+        try:
+            digest, started = pool.submit(_pbkdf2, password, salt, iterations).result()
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool next time and hash this one here
+            _reset_pool()
+            digest, started = _pbkdf2(password, salt, iterations)
+        finally:
+            slots.release()
+    finally:
+        _count(in_flight=-1)
+
+    queued = max(0.0, started - submitted)
+    with _metrics_lock:
+        metrics['completed'] += 1
+        metrics['queue_seconds_total'] += queued
+        metrics['queue_seconds_max'] = max(metrics['queue_seconds_max'], queued)
+        metrics['hash_seconds_total'] += time.time() - started
+    return digest
+
+
+# ----------------------------
+# Hasher
+# ----------------------------
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2-SHA256 hasher with the key derivation run on the pool.
+
+    Same algorithm name and encoded format, so existing hashes verify and
+    new ones stay readable by the stock hasher. verify(), must_update()
+    rehashing and harden_runtime() all go through encode().
+    """
+
+    def encode(self, password, salt, iterations=None):
+        self._check_encode_args(password, salt)
+        iterations = iterations or self.iterations
+        hash = pbkdf2_sha256(password, salt, iterations)
+        hash = base64.b64encode(hash).decode("ascii").strip()
+        return "%s$%d$%s$%s" % (self.algorithm, iterations, salt, hash)
@@ -0,0 +1,134 @@
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+DEFAULTS = {
+    # Cache alias holding stored responses; its MAX_ENTRIES bounds the store
+    'CACHE': 'idempotency',
+    # Seconds a stored response can be replayed
+    'TTL': 24 * 60 * 60,
+    # Seconds a key stays locked while its first request runs
+    'LOCK_SECONDS': 30,
+}
+
+
+def get_config():
+    """Merge IDEMPOTENCY setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'IDEMPOTENCY', {}))
+    return config
+
+
+class IdempotencyKeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this Idempotency-Key is still being processed.'
+    default_code = 'idempotency_key_in_use'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This Idempotency-Key was already used with a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+# ----------------------------
+# Worker-wide metrics
+# ----------------------------
+metrics = {
+    'stored': 0,
+    'replayed': 0,
+    'in_use': 0,            # retry arrived while the first request was running
+    'reused': 0,            # same key, different request
+}
+
+
+def get_metrics():
+    """Snapshot of the idempotency counters for this worker"""
+    return dict(metrics)
+
+
+# ----------------------------
+# Keys
+# ----------------------------
+def _store_key(request, key):
+    # Scoped per user and endpoint, so keys only need to be unique per client
+    return f'idem:{request.user.pk}:{request.method}:{request.path}:{key}'
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+# ----------------------------
+# Decorator
+# ----------------------------
+def idempotent(view_method):
+    """
+    Honour an Idempotency-Key header on a viewset action.
+
+    The first request with a key runs normally and its response (status
+    below 500) is stored for TTL seconds; retries with the same key and
+    body get the stored response back, marked with Idempotent-Replayed,
+    without re-running the view, matching or broadcasts. Requests without
+    the header are untouched. Errors raised as exceptions are not stored,
+    so a retry after a rejected request runs again.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError(f"{HEADER} must be at most {MAX_KEY_LENGTH} characters")
+
+        config = get_config()
+        store = caches[config['CACHE']]
+        store_key = _store_key(request, key)
+        fingerprint = _fingerprint(request)
+
+        stored = store.get(store_key)
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        lock_key = store_key + ':lock'
+        if not store.add(lock_key, fingerprint, timeout=config['LOCK_SECONDS']):
+            metrics['in_use'] += 1
+            raise IdempotencyKeyInUse()
+        try:
+            # The first request may have stored its response and released
+            # the lock between our get() and add()
+            stored = store.get(store_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code < 500:
+                store.set(store_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'data': response.data,
+                }, timeout=config['TTL'])
+                metrics['stored'] += 1
+        finally:
+            store.delete(lock_key)
+        return response
+
+    return wrapper
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        metrics['reused'] += 1
+        raise IdempotencyKeyReused()
+    metrics['replayed'] += 1
+    return Response(stored['data'], status=stored['status'], headers={REPLAYED_HEADER: 'true'})
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rides.archive import archive_finished_rides
+
+
+class Command(BaseCommand):
+    help = "Move rides finished more than N days ago (and their payments) to the archive table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'RIDE_ARCHIVE_AFTER_DAYS', 30),
+            help="Archive rides finished more than this many days ago"
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        moved = archive_finished_rides(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} rides"))
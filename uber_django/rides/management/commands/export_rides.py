@@ -0,0 +1,46 @@
+import sys
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+
+from rides.export import EXPORT_FORMATS, export_lines
+
+
+def parse_moment(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid date: {value}")
+        moment = datetime.combine(day, time.min)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=dt_timezone.utc)
+    return moment
+
+
+class Command(BaseCommand):
+    help = "Stream rides joined with payments as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help="ISO date/datetime, inclusive (requested_at)")
+        parser.add_argument('--to', dest='end', help="ISO date/datetime, exclusive (requested_at)")
+        parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--output', '-o', help="File to write (default: stdout)")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        start = parse_moment(options['start']) if options['start'] else None
+        end = parse_moment(options['end']) if options['end'] else None
+        lines = export_lines(options['export_format'], start, end, options['chunk_size'])
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        count = -1 if options['export_format'] == 'csv' else 0  # don't count the CSV header
+        try:
+            for line in lines:
+                output.write(line)
+                count += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} rides"))
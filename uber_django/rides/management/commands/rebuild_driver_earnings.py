@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rides.earnings import rebuild_driver_earnings
+from rides.rollups import rebuild_earnings_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild every driver's earnings summary and time-bucket rollups from Payment"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_driver_earnings()
+            buckets = rebuild_earnings_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt earnings for {count} drivers ({buckets} rollup buckets)"
+        ))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.seeding import seed, seeded_usernames_exist
+
+
+class Command(BaseCommand):
+    help = "Bulk-create synthetic drivers, passengers, rides and payments for load and benchmark runs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drivers', type=int, default=1000)
+        parser.add_argument('--passengers', type=int, default=5000)
+        parser.add_argument('--rides', type=int, default=20000)
+        parser.add_argument('--days', type=int, default=90, help="Spread ride history over this many days")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows per bulk_create batch")
+        parser.add_argument('--password', default='password123', help="Shared password for every seeded user")
+        parser.add_argument('--prefix', default='seed_', help="Username prefix, e.g. seed_driver_0")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed for a reproducible dataset")
+
+    def handle(self, *args, **options):
+        if min(options['drivers'], options['passengers'], options['rides']) < 0:
+            raise CommandError("Counts must not be negative")
+        if seeded_usernames_exist(options['prefix']):
+            raise CommandError(
+                f"Users named {options['prefix']}driver_N / {options['prefix']}passenger_N already exist; "
+                "pass a different --prefix"
+            )
+
+        started = time.perf_counter()
+        drivers, passengers, rides = seed(
+            options['drivers'], options['passengers'], options['rides'],
+            password=options['password'],
+            days=options['days'],
+            chunk_size=options['chunk_size'],
+            random_seed=options['seed'],
+            prefix=options['prefix'],
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {drivers} drivers, {passengers} passengers and {rides} rides "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from rides import settlement
+
+
+class Command(BaseCommand):
+    help = "Charge pending ride payments through the configured gateway, retrying with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Settle what is due now and exit instead of running as a worker"
+        )
+
+    def handle(self, *args, **options):
+        if not options['once']:
+            self.stdout.write("Settling payments; Ctrl-C to stop")
+            try:
+                settlement.run()
+            except KeyboardInterrupt:
+                pass
+            return
+
+        claimed = 0
+        while True:
+            batch = settlement.settle_due()
+            claimed += batch
+            if batch < settlement.get_config()['BATCH_SIZE']:
+                break
+        self.stdout.write(self.style.SUCCESS(f"Attempted {claimed} payments"))
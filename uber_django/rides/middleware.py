@@ -0,0 +1,169 @@
+import gzip
+import math
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from . import ratelimit, telemetry
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript', 'text/')
+
+
+def get_compression_config():
+    config = getattr(settings, 'RESPONSE_COMPRESSION', {})
+    return {
+        'MIN_SIZE': config.get('MIN_SIZE', 1024),
+        'GZIP_LEVEL': config.get('GZIP_LEVEL', 6),
+        'BROTLI_QUALITY': config.get('BROTLI_QUALITY', 5),
+    }
+
+
+def parse_accept_encoding(header):
+    """{coding: q} from an Accept-Encoding header"""
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header):
+    """Best coding we can produce for this Accept-Encoding, or None; brotli wins ties"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+    candidates = (['br'] if brotli is not None else []) + ['gzip']
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(content, coding, config):
+    if coding == 'br':
+        return brotli.compress(content, quality=config['BROTLI_QUALITY'])
+    # mtime=0 keeps the output stable for identical bodies
+    return gzip.compress(content, compresslevel=config['GZIP_LEVEL'], mtime=0)
+
+
+# ----------------------------
+# Middleware
+# ----------------------------
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Negotiated brotli/gzip compression for API responses above MIN_SIZE.
+
+    Small bodies are sent as-is: below roughly a kilobyte the framing
+    overhead and CPU cost outweigh the bytes saved. Streaming responses
+    (exports) are left alone.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '')
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        config = get_compression_config()
+        if len(response.content) < config['MIN_SIZE']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        compressed = compress(response.content, coding, config)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        response.headers['Content-Encoding'] = coding
+        # A strong ETag no longer matches the encoded bytes
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """
+    Per-user token buckets for location updates, ride polling and ride
+    creation (see ratelimit).
+
+    Runs before sessions, authentication and the view, so a runaway client
+    is turned away with a small 429 and Retry-After without any DB work.
+    """
+
+    def process_request(self, request):
+        scope = ratelimit.match_scope(request.method, request.path_info)
+        if scope is None:
+            return None
+        user_id = ratelimit.token_user_id(request)
+        if user_id is None:
+            return None
+
+        wait = ratelimit.take(scope, user_id)
+        if not wait:
+            return None
+        response = JsonResponse({
+            "success": False,
+            "message": "Too many requests, slow down",
+            "data": {},
+            "status_code": 429,
+        }, status=429)
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Per-route latency, DB query count/time and response size (see telemetry).
+
+    Outermost in MIDDLEWARE so latency covers the whole stack and sizes are
+    the compressed bytes. Queries are counted with an execute_wrapper on
+    every alias rather than DEBUG query logging.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = telemetry.QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        route = telemetry.route_name(request)
+        telemetry.HTTP_LATENCY.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        telemetry.DB_QUERIES.observe(timer.count, route=route)
+        telemetry.DB_TIME.observe(timer.seconds, route=route)
+        if not response.streaming:
+            telemetry.HTTP_RESPONSE_SIZE.observe(len(response.content), route=route)
+        return response
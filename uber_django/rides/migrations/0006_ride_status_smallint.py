@@ -0,0 +1,73 @@
+from django.db import migrations, models
+
+
+# Old free-form strings (either case) -> canonical RideStatus value
+STATUS_VALUES = {
+    'REQUESTED': 1,
+    'ASSIGNED': 2,
+    'ACCEPTED': 3,
+    'ON_THE_WAY': 4,
+    'PICKED_UP': 5,
+    'IN_PROGRESS': 5,
+    'COMPLETED': 6,
+    'CANCELLED': 7,
+}
+STATUS_CODES = {
+    1: 'requested',
+    2: 'assigned',
+    3: 'accepted',
+    4: 'on_the_way',
+    5: 'in_progress',
+    6: 'completed',
+    7: 'cancelled',
+}
+
+
+def normalise_status(apps, schema_editor):
+    Ride = apps.get_model('rides', 'Ride')
+    for name, value in STATUS_VALUES.items():
+        Ride.objects.filter(status__iexact=name).update(status_value=value)
+
+
+def restore_status(apps, schema_editor):
+    Ride = apps.get_model('rides', 'Ride')
+    for value, code in STATUS_CODES.items():
+        Ride.objects.filter(status_value=value).update(status=code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0005_ride_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='status_value',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.RunPython(normalise_status, restore_status),
+        migrations.RemoveField(
+            model_name='ride',
+            name='status',
+        ),
+        migrations.RenameField(
+            model_name='ride',
+            old_name='status_value',
+            new_name='status',
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Requested'), (2, 'Assigned'), (3, 'Accepted'), (4, 'On the way'), (5, 'In progress'), (6, 'Completed'), (7, 'Cancelled')], default=1),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['driver', 'status'], name='ride_driver_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='driverprofile',
+            index=models.Index(condition=models.Q(('is_available', True), ('latitude__isnull', False), ('longitude__isnull', False)), fields=['latitude', 'longitude'], name='driver_available_location_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_earnings(apps, schema_editor):
+    Payment = apps.get_model('rides', 'Payment')
+    DriverEarnings = apps.get_model('rides', 'DriverEarnings')
+    totals = Payment.objects.filter(
+        ride__status=6,  # RideStatus.COMPLETED
+        ride__driver__isnull=False,
+    ).values('ride__driver').annotate(ride_count=Count('id'), total_amount=Sum('amount'))
+    DriverEarnings.objects.bulk_create([
+        DriverEarnings(driver_id=row['ride__driver'], ride_count=row['ride_count'],
+                       total_amount=row['total_amount'])
+        for row in totals
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0006_ride_status_smallint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverEarnings',
+            fields=[
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='earnings', serialize=False, to='rides.driverprofile')),
+                ('ride_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('refunded', 'Refunded')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(backfill_earnings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0007_driver_earnings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideStatusRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Requested'), (2, 'Assigned'), (3, 'Accepted'), (4, 'On the way'), (5, 'In progress'), (6, 'Completed'), (7, 'Cancelled')])),
+                ('ride_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('bucket_start', 'status'), name='unique_ride_status_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DriverEarningsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('week', 'Week')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('ride_count', models.IntegerField(default=0)),
+                ('cancelled_count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='earnings_rollups', to='rides.driverprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('driver', 'granularity', 'bucket_start'), name='unique_driver_earnings_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0008_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRide',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('pickup_location', models.CharField(max_length=255)),
+                ('pickup_lat', models.FloatField(blank=True, null=True)),
+                ('pickup_lng', models.FloatField(blank=True, null=True)),
+                ('dropoff_location', models.CharField(max_length=255)),
+                ('dropoff_lat', models.FloatField(blank=True, null=True)),
+                ('dropoff_lng', models.FloatField(blank=True, null=True)),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Requested'), (2, 'Assigned'), (3, 'Accepted'), (4, 'On the way'), (5, 'In progress'), (6, 'Completed'), (7, 'Cancelled')])),
+                ('requested_at', models.DateTimeField()),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('fare', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('payment_id', models.BigIntegerField(blank=True, null=True)),
+                ('payment_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('payment_status', models.CharField(blank=True, max_length=20)),
+                ('payment_created_at', models.DateTimeField(blank=True, null=True)),
+                ('payment_paid_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('driver', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_rides', to='rides.driverprofile')),
+                ('passenger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_rides', to='rides.passengerprofile')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['passenger', 'requested_at', 'id'], name='archive_passenger_history_idx'), models.Index(fields=['driver', 'requested_at', 'id'], name='archive_driver_history_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,97 @@
+from datetime import timezone as dt_timezone
+
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncWeek
+
+COMPLETED, CANCELLED = 6, 7  # RideStatus
+UNCOLLECTED_PAYMENT_STATUSES = ("refunded", "failed")
+TRUNCATE = {'hour': TruncHour, 'day': TruncDay, 'week': TruncWeek}
+
+
+def _count(buckets, queryset, key_fields, moment, trunc, prefix=(), amount=None):
+    """Add queryset's rides (and amount) per (*prefix, *key_fields, bucket of moment) into buckets"""
+    annotations = {'rides': Count('pk')}
+    if amount:
+        annotations['amount'] = Sum(amount)
+    rows = queryset.filter(**{f'{moment}__isnull': False}).annotate(
+        bucket=trunc(moment, tzinfo=dt_timezone.utc)
+    ).values(*key_fields, 'bucket').annotate(**annotations).order_by()
+    for row in rows:
+        key = prefix + tuple(row[field] for field in key_fields) + (row['bucket'],)
+        totals = buckets.setdefault(key, [0, 0])
+        totals[0] += row['rides']
+        totals[1] += row.get('amount') or 0
+
+
+def backfill_rollups(apps, schema_editor):
+    """
+    Fill the rollups for rides that finished before 0008 started keeping
+    them. Completions and earnings are recomputed from live and archived
+    rides, as rollups.rebuild_earnings_rollups() does, so buckets already
+    kept live are overwritten with the same totals. Cancellations have no
+    timestamp of their own; they are bucketed by requested_at (as
+    seed_data does), and only where none were recorded live yet.
+    """
+    Ride = apps.get_model('rides', 'Ride')
+    ArchivedRide = apps.get_model('rides', 'ArchivedRide')
+    Payment = apps.get_model('rides', 'Payment')
+    RideStatusRollup = apps.get_model('rides', 'RideStatusRollup')
+    DriverEarningsRollup = apps.get_model('rides', 'DriverEarningsRollup')
+
+    paid = [
+        (Payment.objects.filter(ride__status=COMPLETED, ride__driver__isnull=False)
+         .exclude(payment_status__in=UNCOLLECTED_PAYMENT_STATUSES),
+         'ride__driver', 'amount', 'ride__completed_at'),
+        (ArchivedRide.objects.filter(status=COMPLETED, driver__isnull=False, payment_id__isnull=False)
+         .exclude(payment_status__in=UNCOLLECTED_PAYMENT_STATUSES),
+         'driver', 'payment_amount', 'completed_at'),
+    ]
+    earned = {}
+    for queryset, driver, amount, completed_at in paid:
+        for granularity, trunc in TRUNCATE.items():
+            _count(earned, queryset, [driver], completed_at, trunc, (granularity,), amount)
+    for (granularity, driver_id, start_at), (ride_count, total_amount) in earned.items():
+        DriverEarningsRollup.objects.update_or_create(
+            driver_id=driver_id, granularity=granularity, bucket_start=start_at,
+            defaults={'ride_count': ride_count, 'total_amount': total_amount},
+        )
+
+    completed = {}
+    for model in (Ride, ArchivedRide):
+        _count(completed, model.objects.filter(status=COMPLETED), [], 'completed_at', TruncHour)
+    for (start_at,), (ride_count, _) in completed.items():
+        RideStatusRollup.objects.update_or_create(
+            bucket_start=start_at, status=COMPLETED, defaults={'ride_count': ride_count},
+        )
+
+    if RideStatusRollup.objects.filter(status=CANCELLED).exists():
+        return
+    cancelled = {}
+    for model in (Ride, ArchivedRide):
+        _count(cancelled, model.objects.filter(status=CANCELLED), [], 'requested_at', TruncHour)
+    RideStatusRollup.objects.bulk_create([
+        RideStatusRollup(bucket_start=start_at, status=CANCELLED, ride_count=ride_count)
+        for (start_at,), (ride_count, _) in cancelled.items()
+    ])
+    by_driver = {}
+    for model in (Ride, ArchivedRide):
+        queryset = model.objects.filter(status=CANCELLED, driver__isnull=False)
+        for granularity, trunc in TRUNCATE.items():
+            _count(by_driver, queryset, ['driver'], 'requested_at', trunc, (granularity,))
+    for (granularity, driver_id, start_at), (cancelled_count, _) in by_driver.items():
+        DriverEarningsRollup.objects.update_or_create(
+            driver_id=driver_id, granularity=granularity, bucket_start=start_at,
+            defaults={'cancelled_count': cancelled_count},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0010_payment_settlement'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -22,6 +22,16 @@ class DriverProfile(models.Model):
     longitude = models.FloatField(null=True, blank=True)
     is_available = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Dispatch scan: only drivers who can take a ride right now
+            models.Index(
+                fields=['latitude', 'longitude'],
+                name='driver_available_location_idx',
+                condition=models.Q(is_available=True, latitude__isnull=False, longitude__isnull=False),
+            ),
+        ]
+
     def __str__(self):
         return f"{self.user.username} ({'Available' if self.is_available else 'Busy'})"
 
@@ -37,20 +47,43 @@ class PassengerProfile(models.Model):
         return self.user.username
 
 
+# ----------------------------
+# Ride status
+# ----------------------------
+class RideStatus(models.IntegerChoices):
+    """Canonical ride status, stored as a small integer"""
+    REQUESTED = 1, 'Requested'
+    ASSIGNED = 2, 'Assigned'
+    ACCEPTED = 3, 'Accepted'
+    ON_THE_WAY = 4, 'On the way'
+    IN_PROGRESS = 5, 'In progress'
+    COMPLETED = 6, 'Completed'
+    CANCELLED = 7, 'Cancelled'
+
+    @property
+    def code(self):
+        """API representation, e.g. 'in_progress'"""
+        return self.name.lower()
+
+    @classmethod
+    def from_code(cls, value):
+        """Parse an API/legacy status string in any case; raise ValueError if unknown"""
+        try:
+            return cls[str(value).upper()]
+        except KeyError:
+            raise ValueError(f"Unknown ride status: {value}")
+
+
+ACTIVE_RIDE_STATUSES = (
+    RideStatus.ASSIGNED, RideStatus.ACCEPTED, RideStatus.ON_THE_WAY, RideStatus.IN_PROGRESS,
+)
+FINISHED_RIDE_STATUSES = (RideStatus.COMPLETED, RideStatus.CANCELLED)
+
+
 # ----------------------------
 # Ride model
 # ----------------------------
 class Ride(models.Model):
-    STATUS_CHOICES = [
-        ('REQUESTED', 'Requested'),
-        ('ASSIGNED', 'Assigned'),
-        ('ACCEPTED', 'Accepted'),
-        ('ON_THE_WAY', 'On the way'),
-        ('IN_PROGRESS', 'In progress'),
-        ('COMPLETED', 'Completed'),
-        ('CANCELLED', 'Cancelled'),
-    ]
-
     passenger = models.ForeignKey(PassengerProfile, on_delete=models.CASCADE, related_name='rides')
     driver = models.ForeignKey(DriverProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='rides')
 
@@ -61,14 +94,27 @@ class Ride(models.Model):
     dropoff_lat = models.FloatField(null=True, blank=True)
     dropoff_lng = models.FloatField(null=True, blank=True)
 
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='REQUESTED')
+    status = models.PositiveSmallIntegerField(choices=RideStatus.choices, default=RideStatus.REQUESTED)
     requested_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
 
     fare = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Ride history cursor: WHERE passenger/driver = ? ORDER BY requested_at DESC, id DESC
+            models.Index(fields=['passenger', 'requested_at', 'id'], name='ride_passenger_history_idx'),
+            models.Index(fields=['driver', 'requested_at', 'id'], name='ride_driver_history_idx'),
+            # Driver's current ride and completed-ride earnings
+            models.Index(fields=['driver', 'status'], name='ride_driver_status_idx'),
+        ]
+
+    @property
+    def status_code(self):
+        return RideStatus(self.status).code
+
     def __str__(self):
-        return f"Ride #{self.id} ({self.status})"
+        return f"Ride #{self.id} ({self.status_code})"
 
 
 # ----------------------------
@@ -81,9 +127,169 @@ class Payment(models.Model):
         ("pending", "Pending"),
         ("completed", "Completed"),
         ("failed", "Failed"),
+        ("refunded", "Refunded"),
     ], default="pending")
     created_at = models.DateTimeField(auto_now_add=True)
     paid_at = models.DateTimeField(null=True, blank=True)
 
+    # Settlement (rides/settlement.py): charge attempts so far, when a pending
+    # payment is next due, and what the gateway last said
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    gateway_reference = models.CharField(max_length=100, blank=True)
+    last_error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            # Settlement worker scan: pending payments in due order
+            models.Index(
+                fields=['next_attempt_at'],
+                name='payment_pending_due_idx',
+                condition=models.Q(payment_status='pending'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Payment for Ride #{self.ride.id} - ${self.amount}"
+
+
+# ----------------------------
+# Driver earnings summary
+# ----------------------------
+class DriverEarnings(models.Model):
+    """Running totals per driver, kept in step with completions and refunds"""
+    driver = models.OneToOneField(
+        DriverProfile, on_delete=models.CASCADE, primary_key=True, related_name='earnings'
+    )
+    ride_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Earnings for {self.driver_id}: {self.ride_count} rides, ${self.total_amount}"
+
+
+# ----------------------------
+# Time-bucketed rollups
+# ----------------------------
+class DriverEarningsRollup(models.Model):
+    """Per-driver completions, cancellations and earnings per hour/day/week"""
+    HOUR = 'hour'
+    DAY = 'day'
+    WEEK = 'week'
+    GRANULARITY_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+        (WEEK, 'Week'),
+    ]
+
+    driver = models.ForeignKey(DriverProfile, on_delete=models.CASCADE, related_name='earnings_rollups')
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    ride_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['driver', 'granularity', 'bucket_start'], name='unique_driver_earnings_bucket'
+            ),
+        ]
+
+
+class RideStatusRollup(models.Model):
+    """Rides reaching a final status per hour, across all drivers"""
+    bucket_start = models.DateTimeField()
+    status = models.PositiveSmallIntegerField(choices=RideStatus.choices)
+    ride_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket_start', 'status'], name='unique_ride_status_bucket'),
+        ]
+
+
+# ----------------------------
+# Archived rides (cold store)
+# ----------------------------
+class ArchivedRide(models.Model):
+    """A finished ride and its payment, moved out of the hot rides table"""
+    ARCHIVED_RIDE_FIELDS = [
+        'id', 'passenger_id', 'driver_id', 'pickup_location', 'pickup_lat', 'pickup_lng',
+        'dropoff_location', 'dropoff_lat', 'dropoff_lng', 'status', 'requested_at',
+        'completed_at', 'fare',
+    ]
+
+    # Same id as the original ride
+    id = models.BigIntegerField(primary_key=True)
+    passenger = models.ForeignKey(PassengerProfile, on_delete=models.CASCADE, related_name='archived_rides')
+    driver = models.ForeignKey(
+        DriverProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_rides'
+    )
+
+    pickup_location = models.CharField(max_length=255)
+    pickup_lat = models.FloatField(null=True, blank=True)
+    pickup_lng = models.FloatField(null=True, blank=True)
+    dropoff_location = models.CharField(max_length=255)
+    dropoff_lat = models.FloatField(null=True, blank=True)
+    dropoff_lng = models.FloatField(null=True, blank=True)
+
+    status = models.PositiveSmallIntegerField(choices=RideStatus.choices)
+    requested_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    fare = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    # Payment, flattened (null if the ride had none)
+    payment_id = models.BigIntegerField(null=True, blank=True)
+    payment_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    payment_status = models.CharField(max_length=20, blank=True)
+    payment_created_at = models.DateTimeField(null=True, blank=True)
+    payment_paid_at = models.DateTimeField(null=True, blank=True)
+
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['passenger', 'requested_at', 'id'], name='archive_passenger_history_idx'),
+            models.Index(fields=['driver', 'requested_at', 'id'], name='archive_driver_history_idx'),
+        ]
+
+    @classmethod
+    def from_ride(cls, ride):
+        """Build an archive row from a ride fetched with select_related('payment')"""
+        archived = cls(**{field: getattr(ride, field) for field in cls.ARCHIVED_RIDE_FIELDS})
+        try:
+            payment = ride.payment
+        except Payment.DoesNotExist:
+            return archived
+        archived.payment_id = payment.id
+        archived.payment_amount = payment.amount
+        archived.payment_status = payment.payment_status
+        archived.payment_created_at = payment.created_at
+        archived.payment_paid_at = payment.paid_at
+        return archived
+
+    def as_ride(self):
+        """Unsaved Ride (with payment) that RideSerializer can render unchanged"""
+        ride = Ride(**{field: getattr(self, field) for field in self.ARCHIVED_RIDE_FIELDS})
+        # Reuse whatever select_related() already loaded
+        ride.passenger = self.passenger
+        ride.driver = self.driver
+        if self.payment_id is not None:
+            # Assigning the ride caches this payment on ride.payment
+            Payment(
+                id=self.payment_id, ride=ride, amount=self.payment_amount,
+                payment_status=self.payment_status, created_at=self.payment_created_at,
+                paid_at=self.payment_paid_at,
+            )
+        else:
+            Ride.payment.related.set_cached_value(ride, None)
+        return ride
+
+    @property
+    def status_code(self):
+        return RideStatus(self.status).code
+
     def __str__(self):
-        return f"Payment for Ride #{self.ride.id} - ${self.amount}"
\ No newline at end of file
+        return f"Archived ride #{self.id} ({self.status_code})"
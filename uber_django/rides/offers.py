@@ -0,0 +1,234 @@
+import asyncio
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from rest_framework.exceptions import APIException
+
+from . import profile_cache
+from .fares import haversine
+from .fast_serializers import serialize_ride
+from .models import DriverProfile, Ride
+from .timer_wheel import TimerWheel
+from .tracing import span
+from .transitions import apply_transition, set_driver_available
+
+DEFAULTS = {
+    # Seconds an assigned driver has to accept before the ride is re-offered;
+    # 0 disables expiry
+    'ACCEPT_SECONDS': 20,
+    # Timer wheel resolution
+    'TICK_SECONDS': 0.25,
+    # Drivers offered one ride before giving up and leaving it requested
+    'MAX_OFFERS': 5,
+}
+
+
+def get_config():
+    """Merge RIDE_OFFERS setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'RIDE_OFFERS', {}))
+    return config
+
+
+# ----------------------------
+# Worker-wide metrics
+# ----------------------------
+metrics = {
+    'offered': 0,
+    'accepted_or_cancelled': 0,   # timer dropped before it fired
+    'expired': 0,
+    'exhausted': 0,               # no driver left to re-offer to
+    'claims_lost': 0,             # nearest driver taken between scan and claim
+}
+
+
+def get_metrics():
+    """Snapshot of the offer counters for this worker"""
+    snapshot = dict(metrics)
+    snapshot['pending'] = len(_wheel) if _wheel is not None else 0
+    return snapshot
+
+
+# ----------------------------
+# Matching
+# ----------------------------
+def find_nearest_driver(pickup_lat, pickup_lng, exclude=()):
+    """Nearest available located driver, skipping the ids in exclude"""
+    available_drivers = DriverProfile.objects.filter(
+        is_available=True,
+        latitude__isnull=False,
+        longitude__isnull=False
+    ).exclude(pk__in=exclude)
+
+    nearest_driver = None
+    min_distance = float('inf')
+    for driver in available_drivers:
+        distance = haversine(pickup_lat, pickup_lng, driver.latitude, driver.longitude)
+        if distance < min_distance:
+            min_distance = distance
+            nearest_driver = driver
+    return nearest_driver
+
+
+def offer_ride(ride, tried=()):
+    """
+    Assign ride to the nearest available driver not in tried and start
+    their accept deadline. Returns the driver, or None if nobody is left
+    (the ride stays requested and its group hears 'No drivers available').
+
+    A driver another request claimed between the scan and our claim joins
+    tried and the next nearest is scanned for, within MAX_OFFERS.
+    """
+    reoffer = bool(tried)
+    tried = tuple(tried)
+    driver = None
+    while driver is None and len(tried) < get_config()['MAX_OFFERS']:
+        with span('driver_scan', tried=len(tried)):
+            driver = find_nearest_driver(ride.pickup_lat, ride.pickup_lng, exclude=tried)
+        if driver is None:
+            break
+        # Claim the driver only if nobody else took them since the scan
+        with span('driver_claim'):
+            if not set_driver_available(driver, False):
+                metrics['claims_lost'] += 1
+                tried += (driver.id,)
+                driver = None
+
+    if driver is None:
+        if tried:
+            metrics['exhausted'] += 1
+        _push(f'ride_{ride.id}', {'status': 'requested', 'message': 'No drivers available'}, 'no_drivers')
+        return None
+
+    profile_cache.invalidate(driver.user_id)
+    try:
+        with span('assign'):
+            apply_transition(ride, 'assign', driver=driver)
+    except APIException:
+        # Cancelled while we were re-offering
+        set_driver_available(driver, True)
+        profile_cache.invalidate(driver.user_id)
+        return None
+
+    schedule_offer(ride.id, driver.id, tried)
+    with span('serialize'):
+        data = serialize_ride(ride)
+    _push(f'driver_{driver.id}', data)
+    if reoffer:
+        _push(f'ride_{ride.id}', data, 'ride_reassigned')
+    return driver
+
+
+def expire_offer(ride_id, driver_id, tried=()):
+    """
+    The driver let the accept deadline pass: put the ride back to
+    requested, free the driver and offer it to the next nearest one.
+
+    The expire transition only matches a ride still assigned to this
+    driver, so an accept or cancel that raced the timer wins.
+    """
+    ride = Ride.objects.select_related('passenger__user', 'driver__user', 'payment').filter(
+        pk=ride_id, driver_id=driver_id
+    ).first()
+    if ride is None:
+        return None
+    driver = ride.driver
+
+    with transaction.atomic():
+        try:
+            apply_transition(ride, 'expire', as_driver=driver, driver=None)
+        except APIException:
+            return None
+        set_driver_available(driver, True)
+        profile_cache.invalidate(driver.user_id)
+
+    metrics['expired'] += 1
+    # Withdraw the offer from the driver's app
+    _push(f'driver_{driver_id}', serialize_ride(ride))
+    return offer_ride(ride, tried=tuple(tried) + (driver_id,))
+
+
+def _push(group, ride_data, event='ride_snapshot'):
+    try:
+        with span('channel_send', group=group):
+            async_to_sync(get_channel_layer().group_send)(
+                group, {'type': 'ride_update', 'event': event, 'ride': ride_data}
+            )
+    except Exception as e:
+        print(f"WebSocket error: {str(e)}")  # Log but don't fail
+
+
+# ----------------------------
+# Deadline scheduler
+# ----------------------------
+_loop = None
+_wheel = None
+_timers = {}    # ride_id -> Timer; only touched on the scheduler loop
+_start_lock = threading.Lock()
+
+
+def _get_loop():
+    """Start the scheduler thread (one asyncio loop driving the wheel) once per process"""
+    global _loop, _wheel
+    with _start_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            wheel = TimerWheel(tick_seconds=get_config()['TICK_SECONDS'])
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(wheel.start)
+                loop.run_forever()
+
+            threading.Thread(target=run, name='ride-offer-timers', daemon=True).start()
+            _loop, _wheel = loop, wheel
+        return _loop
+
+
+def schedule_offer(ride_id, driver_id, tried=()):
+    """Start (or restart) the accept deadline for ride once the assignment commits"""
+    seconds = get_config()['ACCEPT_SECONDS']
+    if not seconds:
+        return
+    metrics['offered'] += 1
+    loop = _get_loop()
+    transaction.on_commit(
+        lambda: loop.call_soon_threadsafe(_schedule, ride_id, driver_id, tuple(tried), seconds)
+    )
+
+
+def cancel_offer(ride_id):
+    """Drop the ride's deadline, e.g. once the driver accepted or it was cancelled"""
+    if _loop is None:
+        return
+    transaction.on_commit(lambda: _loop.call_soon_threadsafe(_cancel, ride_id))
+
+
+def _schedule(ride_id, driver_id, tried, seconds):
+    _cancel(ride_id, count=False)
+    _timers[ride_id] = _wheel.schedule(seconds, _expired, ride_id, driver_id, tried)
+
+
+def _cancel(ride_id, count=True):
+    timer = _timers.pop(ride_id, None)
+    if timer is not None and _wheel.cancel(timer) and count:
+        metrics['accepted_or_cancelled'] += 1
+
+
+def _expired(ride_id, driver_id, tried):
+    _timers.pop(ride_id, None)
+    # DB work runs off the loop so the wheel keeps ticking
+    _loop.run_in_executor(None, _run_expiry, ride_id, driver_id, tried)
+
+
+def _run_expiry(ride_id, driver_id, tried):
+    close_old_connections()
+    try:
+        expire_offer(ride_id, driver_id, tried)
+    except Exception as e:
+        print(f"Offer expiry error for ride {ride_id}: {str(e)}")
+    finally:
+        close_old_connections()
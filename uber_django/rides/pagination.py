@@ -0,0 +1,94 @@
+import base64
+from datetime import datetime
+from operator import attrgetter
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+# ----------------------------
+# Keyset pagination for rides
+# ----------------------------
+class RideCursorPagination(BasePagination):
+    """
+    Newest-first keyset pagination on (requested_at, id).
+
+    The cursor is the (requested_at, id) of the last ride on the previous
+    page, so every page is one index range scan no matter how deep the
+    client has paged.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    # (requested_at, id) of a page item; override for values_list() rows
+    position = staticmethod(attrgetter('requested_at', 'id'))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view)
+
+    def paginate_querysets(self, querysets, request, view=None, position=None):
+        """Page through several ride stores (e.g. hot and archived) as one list"""
+        if position is not None:
+            self.position = position
+        self.request = request
+        self.current_page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        rides = []
+        for queryset in querysets:
+            queryset = queryset.order_by('-requested_at', '-id')
+            if position is not None:
+                requested_at, ride_id = position
+                queryset = queryset.filter(requested_at__lte=requested_at).exclude(
+                    requested_at=requested_at, id__gte=ride_id
+                )
+            # One extra row tells us whether there is a next page
+            rides.extend(queryset[:self.current_page_size + 1])
+
+        rides.sort(key=self.position, reverse=True)
+        self.has_next = len(rides) > self.current_page_size
+        self.page = rides[:self.current_page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            decoded = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            requested_at, ride_id = decoded.rsplit('|', 1)
+            return datetime.fromisoformat(requested_at), int(ride_id)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, ride):
+        requested_at, ride_id = self.position(ride)
+        raw = f"{requested_at.isoformat()}|{ride_id}"
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_pagination_data(self):
+        """Pagination fields merged into the standardized response envelope"""
+        return {
+            'next': self.get_next_link(),
+            'page_size': self.current_page_size,
+        }
+
+    def get_paginated_response(self, data):
+        return Response({'results': data, **self.get_pagination_data()})
@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+DRIVER = 'driver'
+PASSENGER = 'passenger'
+
+DEFAULTS = {
+    # Cache alias holding profile bodies and their versions
+    'CACHE': 'default',
+    # Seconds a body is served before it is rendered again anyway. Driver
+    # profiles carry is_available and location, so they expire sooner
+    'TTL_SECONDS': {DRIVER: 5, PASSENGER: 300},
+}
+
+
+def get_config():
+    """Merge PROFILE_CACHE setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_CACHE', {}))
+    config['TTL_SECONDS'] = {**DEFAULTS['TTL_SECONDS'], **config['TTL_SECONDS']}
+    return config
+
+
+def _cache():
+    return caches[get_config()['CACHE']]
+
+
+# ----------------------------
+# Keys
+# ----------------------------
+def _version_key(user_id):
+    return f'profile:version:{user_id}'
+
+
+def _body_key(kind, user_id, version):
+    return f'profile:{kind}:{user_id}:{version}'
+
+
+def _version(user_id, cache=None):
+    return (cache or _cache()).get(_version_key(user_id), 0)
+
+
+# ----------------------------
+# Reads and writes
+# ----------------------------
+def fetch(kind, user_id, render):
+    """
+    Return the cached body, or render() it and cache it.
+
+    The version is read before render() touches the database, so a body
+    built from data that is invalidated mid-render lands under a stale
+    key and is never served.
+    """
+    config = get_config()
+    cache = caches[config['CACHE']]
+    key = _body_key(kind, user_id, _version(user_id, cache))
+    body = cache.get(key)
+    if body is None:
+        body = render()
+        cache.set(key, body, timeout=config['TTL_SECONDS'][kind])
+    return body
+
+
+def invalidate(user_id):
+    """
+    Drop this user's cached profiles; call after any profile, location or
+    availability write. Inside a transaction this waits for the commit, so
+    a concurrent read cannot re-cache the old row.
+
+    Only CACHE sees the new version: with a per-process cache such as
+    LocMem, other workers keep serving their copy until TTL_SECONDS runs
+    out.
+    """
+    transaction.on_commit(lambda: _invalidate(user_id))
+
+
+def _invalidate(user_id):
+    cache = _cache()
+    version = _version(user_id, cache)
+    cache.delete_many([_body_key(kind, user_id, version) for kind in (DRIVER, PASSENGER)])
+    key = _version_key(user_id)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add() and incr(); the delete above already covers it
+            pass
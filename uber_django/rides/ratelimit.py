@@ -0,0 +1,124 @@
+import math
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+# ----------------------------
+# Endpoint classes
+# ----------------------------
+LOCATION = 'location'
+POLL = 'poll'
+CREATE = 'create'
+
+# (scope, method, path) checked in order; first match wins
+ROUTES = (
+    (LOCATION, 'POST', re.compile(r'^/api/rides/update_location/$')),
+    (CREATE, 'POST', re.compile(r'^/api/rides/$')),
+    (POLL, 'GET', re.compile(r'^/api/rides/(\d+/)?$')),
+)
+
+DEFAULTS = {
+    # Cache alias holding the buckets; LocMem keeps them in-process
+    'CACHE': 'default',
+    # Per user and scope: RATE tokens refill per second, up to BURST
+    'SCOPES': {
+        LOCATION: {'RATE': 1.0, 'BURST': 10},
+        POLL: {'RATE': 2.0, 'BURST': 20},
+        CREATE: {'RATE': 0.2, 'BURST': 5},
+    },
+}
+
+
+def get_config():
+    """Merge RATE_LIMITS setting over the defaults, scope by scope"""
+    overrides = getattr(settings, 'RATE_LIMITS', {})
+    config = {'CACHE': overrides.get('CACHE', DEFAULTS['CACHE']), 'SCOPES': {}}
+    for scope, limits in DEFAULTS['SCOPES'].items():
+        config['SCOPES'][scope] = {**limits, **overrides.get('SCOPES', {}).get(scope, {})}
+    return config
+
+
+# ----------------------------
+# Worker-wide metrics
+# ----------------------------
+metrics = {
+    'allowed': 0,
+    'rejected': 0,
+    'rejected_by_scope': {},
+}
+
+
+def get_metrics():
+    """Snapshot of the rate limit counters for this worker"""
+    snapshot = dict(metrics)
+    snapshot['rejected_by_scope'] = dict(metrics['rejected_by_scope'])
+    return snapshot
+
+
+# ----------------------------
+# Request classification
+# ----------------------------
+def match_scope(method, path):
+    for scope, route_method, pattern in ROUTES:
+        if method == route_method and pattern.match(path):
+            return scope
+    return None
+
+
+def token_user_id(request):
+    """
+    User id from a valid bearer access token, without touching the database.
+
+    Requests without one are left to authentication, which rejects them
+    before any DB work anyway.
+    """
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    kind, _, raw = header.partition(' ')
+    if kind not in jwt_settings.AUTH_HEADER_TYPES or not raw:
+        return None
+    try:
+        return AccessToken(raw.strip())[jwt_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+
+
+# ----------------------------
+# Token bucket
+# ----------------------------
+def take(scope, user_id, config=None):
+    """
+    Spend one token from this user's bucket for scope.
+
+    Returns 0 if allowed, else the seconds until a token is available.
+    The bucket is (tokens, timestamp) in the cache, refilled lazily on
+    read. Read-modify-write is not atomic across workers sharing a cache,
+    so concurrent requests may occasionally both pass; fine for shedding
+    runaway clients.
+    """
+    config = config or get_config()
+    limits = config['SCOPES'][scope]
+    rate, burst = limits['RATE'], limits['BURST']
+    if not rate:
+        return 0
+
+    store = caches[config['CACHE']]
+    key = f'ratelimit:{scope}:{user_id}'
+    now = time.time()
+    tokens, stamp = store.get(key, (burst, now))
+    tokens = min(burst, tokens + (now - stamp) * rate)
+
+    if tokens < 1:
+        wait = (1 - tokens) / rate
+        metrics['rejected'] += 1
+        metrics['rejected_by_scope'][scope] = metrics['rejected_by_scope'].get(scope, 0) + 1
+        return wait
+
+    # Once full again the entry can expire: a missing bucket reads as full
+    store.set(key, (tokens - 1, now), timeout=math.ceil(burst / rate) + 1)
+    metrics['allowed'] += 1
+    return 0
@@ -0,0 +1,64 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # Optional: fall back to DRF's stdlib json
+    orjson = None
+
+ORJSON_OPTIONS = (
+    # DRF renders UTC datetimes as ...Z; dict keys may be ints (e.g. hour buckets)
+    orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS if orjson else 0
+)
+
+_drf_default = JSONEncoder().default
+
+
+# ----------------------------
+# Renderer
+# ----------------------------
+class FastJSONRenderer(JSONRenderer):
+    """
+    Drop-in JSONRenderer backed by orjson.
+
+    orjson encodes dicts, lists, strings, numbers and datetimes in C;
+    Decimal, lazy strings, UUIDs and the rest go through DRF's encoder, so
+    the bytes match JSONRenderer's compact output. Indented output (the
+    browsable API, ?indent=) still goes through the stdlib path.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=_drf_default, option=ORJSON_OPTIONS)
+        # Same strict-javascript-subset escaping as JSONRenderer
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+# ----------------------------
+# Parser
+# ----------------------------
+class FastJSONParser(JSONParser):
+    """JSONParser backed by orjson (UTF-8 bodies; other charsets use the stdlib path)"""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET).lower().replace('_', '-')
+        if orjson is None or encoding not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+        try:
+            # Like strict JSONParser, orjson rejects NaN and Infinity
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,176 @@
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncWeek
+from django.utils import timezone
+
+from .archive import paid_ride_sources
+from .models import DriverEarningsRollup, RideStatus, RideStatusRollup
+
+HOUR = DriverEarningsRollup.HOUR
+DAY = DriverEarningsRollup.DAY
+WEEK = DriverEarningsRollup.WEEK
+HOUR_OF_DAY = 'hour_of_day'
+GRANULARITIES = (HOUR, DAY, WEEK, HOUR_OF_DAY)
+
+
+# ----------------------------
+# Buckets
+# ----------------------------
+def bucket_start(moment, granularity):
+    """Start of the UTC hour/day/week (Monday) containing moment"""
+    hour = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if granularity == HOUR:
+        return hour
+    day = hour.replace(hour=0)
+    if granularity == DAY:
+        return day
+    return day - timedelta(days=day.weekday())
+
+
+def _bump(model, key, **deltas):
+    """Add deltas to the row identified by key, creating it on first use"""
+    changes = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**key).update(**changes):
+        return
+    model.objects.get_or_create(**key)
+    model.objects.filter(**key).update(**changes)
+
+
+def _bump_driver(driver_id, moment, **deltas):
+    for granularity in (HOUR, DAY, WEEK):
+        _bump(
+            DriverEarningsRollup,
+            {'driver_id': driver_id, 'granularity': granularity,
+             'bucket_start': bucket_start(moment, granularity)},
+            **deltas
+        )
+
+
+# ----------------------------
+# Incremental updates (call inside the lifecycle transaction)
+# ----------------------------
+def record_completion(ride, payment):
+    amount = Decimal(str(payment.amount))
+    _bump_driver(ride.driver_id, ride.completed_at, ride_count=1, total_amount=amount)
+    _bump(RideStatusRollup,
+          {'bucket_start': bucket_start(ride.completed_at, HOUR), 'status': RideStatus.COMPLETED},
+          ride_count=1)
+
+
+def record_cancellation(ride, cancelled_at=None):
+    cancelled_at = cancelled_at or timezone.now()
+    if ride.driver_id:
+        _bump_driver(ride.driver_id, cancelled_at, cancelled_count=1)
+    _bump(RideStatusRollup,
+          {'bucket_start': bucket_start(cancelled_at, HOUR), 'status': RideStatus.CANCELLED},
+          ride_count=1)
+
+
+def add_status_count(start_at, ride_status, ride_count):
+    """Add ride_count rides to one hourly status bucket, e.g. after a bulk load"""
+    _bump(RideStatusRollup, {'bucket_start': start_at, 'status': ride_status}, ride_count=ride_count)
+
+
+def record_refund(payment):
+    """Take a refunded or failed payment back out of the buckets it was counted in"""
+    ride = payment.ride
+    _bump_driver(ride.driver_id, ride.completed_at,
+                 ride_count=-1, total_amount=-Decimal(str(payment.amount)))
+
+
+# ----------------------------
+# Queries
+# ----------------------------
+def earnings_series(driver_id, granularity, start, end):
+    """Non-empty buckets in [start, end); cost scales with buckets, not rides"""
+    source = HOUR if granularity == HOUR_OF_DAY else granularity
+    rows = DriverEarningsRollup.objects.filter(
+        driver_id=driver_id,
+        granularity=source,
+        bucket_start__gte=bucket_start(start, source),
+        bucket_start__lt=end,
+    ).order_by('bucket_start').values_list(
+        'bucket_start', 'ride_count', 'cancelled_count', 'total_amount'
+    )
+
+    if granularity != HOUR_OF_DAY:
+        return [
+            {
+                "bucket_start": start_at,
+                "total_rides": rides,
+                "cancelled_rides": cancelled,
+                "total_earnings": round(amount, 2),
+            }
+            for start_at, rides, cancelled, amount in rows
+        ]
+
+    by_hour = {}
+    for start_at, rides, cancelled, amount in rows:
+        slot = by_hour.setdefault(start_at.hour, [0, 0, Decimal('0')])
+        slot[0] += rides
+        slot[1] += cancelled
+        slot[2] += amount
+    return [
+        {
+            "hour": hour,
+            "total_rides": rides,
+            "cancelled_rides": cancelled,
+            "total_earnings": round(amount, 2),
+        }
+        for hour, (rides, cancelled, amount) in sorted(by_hour.items())
+    ]
+
+
+def status_series(start, end):
+    """Rides per hour by final status in [start, end)"""
+    rows = RideStatusRollup.objects.filter(
+        bucket_start__gte=bucket_start(start, HOUR),
+        bucket_start__lt=end,
+    ).order_by('bucket_start', 'status').values_list('bucket_start', 'status', 'ride_count')
+
+    series = []
+    for start_at, ride_status, count in rows:
+        if not series or series[-1]["bucket_start"] != start_at:
+            series.append({"bucket_start": start_at, "counts": {}})
+        series[-1]["counts"][RideStatus(ride_status).code] = count
+    return series
+
+
+# ----------------------------
+# Rebuild
+# ----------------------------
+TRUNCATE = {HOUR: TruncHour, DAY: TruncDay, WEEK: TruncWeek}
+
+
+def rebuild_earnings_rollups():
+    """
+    Recompute driver earnings buckets from live and archived payments.
+
+    Cancellation counts are only ever recorded live (rides carry no
+    cancellation time), so they are preserved across a rebuild.
+    """
+    buckets = {}
+    for queryset, driver, amount, completed_at in paid_ride_sources():
+        queryset = queryset.filter(**{f'{completed_at}__isnull': False})
+        for granularity, trunc in TRUNCATE.items():
+            rows = queryset.annotate(
+                bucket=trunc(completed_at, tzinfo=dt_timezone.utc)
+            ).values(driver, 'bucket').annotate(
+                ride_count=Count('pk'), total_amount=Sum(amount)
+            ).order_by()
+            for row in rows.iterator():
+                totals = buckets.setdefault((row[driver], granularity, row['bucket']), [0, Decimal('0')])
+                totals[0] += row['ride_count']
+                totals[1] += row['total_amount'] or 0
+
+    DriverEarningsRollup.objects.update(ride_count=0, total_amount=0)
+    for (driver_id, granularity, start_at), (ride_count, total_amount) in buckets.items():
+        DriverEarningsRollup.objects.update_or_create(
+            driver_id=driver_id,
+            granularity=granularity,
+            bucket_start=start_at,
+            defaults={'ride_count': ride_count, 'total_amount': total_amount},
+        )
+    return len(buckets)
@@ -0,0 +1,311 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from math import cos, radians
+
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    DriverEarnings, DriverEarningsRollup, DriverProfile, PassengerProfile, Payment, Ride, RideStatus,
+    RideStatusRollup, User,
+)
+from . import fares
+from .rollups import DAY, HOUR, WEEK, add_status_count, bucket_start
+
+# (name, centre lat, centre lng, spread km, share of the fleet)
+CITIES = [
+    ('San Francisco', 37.7749, -122.4194, 6.0, 0.30),
+    ('New York', 40.7128, -74.0060, 9.0, 0.35),
+    ('Chicago', 41.8781, -87.6298, 8.0, 0.20),
+    ('Austin', 30.2672, -97.7431, 7.0, 0.15),
+]
+CAR_MODELS = ['Toyota Prius', 'Toyota Camry', 'Honda Civic', 'Honda Accord', 'Tesla Model 3',
+              'Hyundai Ioniq', 'Kia Niro', 'Ford Fusion', 'Nissan Leaf', 'Chevrolet Bolt']
+# Share of seeded rides per final status
+STATUS_WEIGHTS = [
+    (RideStatus.COMPLETED, 0.85),
+    (RideStatus.CANCELLED, 0.12),
+    (RideStatus.REQUESTED, 0.03),
+]
+KM_PER_DEGREE = 111.32
+
+
+# ----------------------------
+# Geography
+# ----------------------------
+def _offset(rng, lat, lng, km):
+    """A point roughly km away from (lat, lng) in a random direction"""
+    north = rng.gauss(0, km)
+    east = rng.gauss(0, km)
+    return (
+        round(lat + north / KM_PER_DEGREE, 6),
+        round(lng + east / (KM_PER_DEGREE * cos(radians(lat))), 6),
+    )
+
+
+def _pick_city(rng):
+    return rng.choices(CITIES, weights=[city[4] for city in CITIES])[0]
+
+
+def _trip(rng, city):
+    """Pickup clustered around the centre; trip length log-normal (median ~5 km)"""
+    _, lat, lng, spread, _ = city
+    pickup = _offset(rng, lat, lng, spread)
+    dropoff = _offset(rng, *pickup, rng.lognormvariate(1.3, 0.6) / 1.25)
+    return pickup, dropoff
+
+
+# ----------------------------
+# Bulk helpers
+# ----------------------------
+def _insert_as_given(model, objs, chunk_size):
+    """
+    Insert objs one multi-row INSERT per chunk, keeping the values they
+    carry and setting their primary keys.
+
+    What bulk_create does, but as a raw insert (as loaddata saves): no
+    pre_save, so auto_now_add fields keep the seeded timestamps rather
+    than now(), without a second UPDATE pass. Needs a backend that returns
+    rows from bulk inserts (PostgreSQL, SQLite 3.35+).
+    """
+    manager = model.objects
+    connection = connections[manager.db]
+    fields = [field for field in model._meta.local_concrete_fields if field is not model._meta.auto_field]
+    returning = model._meta.db_returning_fields
+    batch_size = max(1, min(chunk_size, connection.ops.bulk_batch_size(fields, objs)))
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        rows = manager._insert(batch, fields=fields, returning_fields=returning, raw=True, using=manager.db)
+        for obj, row in zip(batch, rows):
+            for field, value in zip(returning, row):
+                setattr(obj, field.attname, value)
+            obj._state.adding = False
+            obj._state.db = manager.db
+    return objs
+
+
+def _chunks(count, size):
+    start = 0
+    while start < count:
+        yield start, min(size, count - start)
+        start += size
+
+
+def _create_users(prefix, count, password_hash, chunk_size, **flags):
+    """
+    bulk_create count users in chunks and yield each saved chunk. The
+    caller's profile inserts run inside the same per-chunk transaction.
+    """
+    now = timezone.now()
+    for start, size in _chunks(count, chunk_size):
+        users = [
+            User(
+                username=f'{prefix}{start + n}',
+                email=f'{prefix}{start + n}@example.com',
+                password=password_hash,
+                date_joined=now,
+                **flags
+            )
+            for n in range(size)
+        ]
+        with transaction.atomic():
+            yield User.objects.bulk_create(users)
+
+
+# ----------------------------
+# Seeding
+# ----------------------------
+def seed_drivers(count, password_hash, rng, chunk_size=5000, prefix='seed_'):
+    """Create drivers spread across CITIES; return {city name: [driver profile ids]}"""
+    by_city = {}
+    users_chunks = _create_users(
+        f'{prefix}driver_', count, password_hash, chunk_size, is_driver=True, is_passenger=False
+    )
+    for users in users_chunks:
+        profiles = []
+        cities = []
+        for user in users:
+            city = _pick_city(rng)
+            lat, lng = _offset(rng, city[1], city[2], city[3])
+            profiles.append(DriverProfile(
+                user=user,
+                car_model=rng.choice(CAR_MODELS),
+                car_plate=f'{rng.randrange(10)}{rng.choice("ABCDEFGHJKLMNPRSTUVWXYZ")}'
+                          f'{rng.choice("ABCDEFGHJKLMNPRSTUVWXYZ")}{rng.randrange(1000, 10000)}',
+                latitude=lat,
+                longitude=lng,
+                is_available=rng.random() < 0.6,
+            ))
+            cities.append(city[0])
+        for profile, city in zip(DriverProfile.objects.bulk_create(profiles), cities):
+            by_city.setdefault(city, []).append(profile.id)
+    return by_city
+
+
+def seed_passengers(count, password_hash, chunk_size=5000, prefix='seed_'):
+    """Create passengers; return their profile ids"""
+    ids = []
+    users_chunks = _create_users(
+        f'{prefix}passenger_', count, password_hash, chunk_size, is_driver=False, is_passenger=True
+    )
+    for users in users_chunks:
+        profiles = PassengerProfile.objects.bulk_create([
+            PassengerProfile(user=user, phone_number=f'555{user.id:07d}'[-10:]) for user in users
+        ])
+        ids.extend(profile.id for profile in profiles)
+    return ids
+
+
+def seed_rides(count, passenger_ids, drivers_by_city, rng, days=90, chunk_size=5000):
+    """
+    Create finished (and a few still-requested) rides over the last `days`,
+    with a payment per completed ride. Return the number created.
+
+    Request times follow a daily demand curve; fares come from the same
+    tariff as complete_ride, priced at request time. The drivers must be
+    freshly seeded: their earnings summaries and rollups are written here
+    in bulk rather than per ride.
+    """
+    now = timezone.now()
+    statuses = [status for status, _ in STATUS_WEIGHTS]
+    status_weights = [weight for _, weight in STATUS_WEIGHTS]
+    cities = [city for city in CITIES if drivers_by_city.get(city[0])]
+    # Busy mornings and evenings, quiet small hours
+    hour_weights = [1, 1, 1, 1, 1, 2, 4, 8, 9, 6, 5, 5, 6, 5, 5, 6, 8, 10, 10, 8, 7, 6, 4, 2]
+    status_counts = {}
+    driver_buckets = {}
+    tariff = fares.get_tariff()
+
+    for _, size in _chunks(count, chunk_size):
+        rides = []
+        for _ in range(size):
+            city = rng.choices(cities, weights=[city[4] for city in cities])[0]
+            (pickup_lat, pickup_lng), (dropoff_lat, dropoff_lng) = _trip(rng, city)
+            day = now - timedelta(days=rng.randrange(days))
+            requested_at = day.replace(
+                hour=rng.choices(range(24), weights=hour_weights)[0],
+                minute=rng.randrange(60), second=rng.randrange(60),
+            )
+            if requested_at > now:
+                requested_at -= timedelta(days=1)
+
+            ride_status = rng.choices(statuses, weights=status_weights)[0]
+            ride = Ride(
+                passenger_id=rng.choice(passenger_ids),
+                pickup_location=f'{pickup_lat}, {pickup_lng}',
+                pickup_lat=pickup_lat,
+                pickup_lng=pickup_lng,
+                dropoff_location=f'{dropoff_lat}, {dropoff_lng}',
+                dropoff_lat=dropoff_lat,
+                dropoff_lng=dropoff_lng,
+                status=ride_status,
+                requested_at=requested_at,
+            )
+            if ride_status == RideStatus.COMPLETED:
+                quote = tariff.quote(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, requested_at)
+                distance = quote.distance_km
+                ride.driver_id = rng.choice(drivers_by_city[city[0]])
+                # ~25 km/h in town plus pickup time
+                ride.completed_at = requested_at + timedelta(minutes=5 + distance * 2.4)
+                ride.fare = Decimal(str(quote.fare))
+                finished_at = ride.completed_at
+            elif ride_status == RideStatus.CANCELLED:
+                if rng.random() < 0.5:
+                    ride.driver_id = rng.choice(drivers_by_city[city[0]])
+                finished_at = requested_at
+            else:
+                ride.requested_at = now - timedelta(minutes=rng.randrange(1, 10))
+                finished_at = None
+            if finished_at is not None:
+                key = (bucket_start(finished_at, HOUR), ride_status)
+                status_counts[key] = status_counts.get(key, 0) + 1
+            if finished_at is not None and ride.driver_id:
+                for granularity in (HOUR, DAY, WEEK):
+                    key = (ride.driver_id, granularity, bucket_start(finished_at, granularity))
+                    totals = driver_buckets.setdefault(key, [0, 0, Decimal('0')])
+                    if ride_status == RideStatus.COMPLETED:
+                        totals[0] += 1
+                        totals[2] += ride.fare
+                    else:
+                        totals[1] += 1
+            rides.append(ride)
+
+        with transaction.atomic():
+            _insert_as_given(Ride, rides, chunk_size)
+            _insert_as_given(Payment, [
+                Payment(
+                    ride=ride,
+                    amount=ride.fare,
+                    payment_status="completed",
+                    created_at=ride.completed_at,
+                    paid_at=ride.completed_at,
+                )
+                for ride in rides if ride.status == RideStatus.COMPLETED
+            ], chunk_size)
+
+    driver_ids = [driver_id for ids in drivers_by_city.values() for driver_id in ids]
+    with transaction.atomic():
+        _write_driver_summaries(driver_ids, driver_buckets, chunk_size)
+        _write_status_rollups(status_counts, chunk_size)
+    return count
+
+
+def _write_driver_summaries(driver_ids, driver_buckets, chunk_size):
+    totals = {}
+    for (driver_id, granularity, _), (rides, _, amount) in driver_buckets.items():
+        if granularity == WEEK:
+            driver_total = totals.setdefault(driver_id, [0, Decimal('0')])
+            driver_total[0] += rides
+            driver_total[1] += amount
+    DriverEarnings.objects.bulk_create([
+        DriverEarnings(driver_id=driver_id, ride_count=ride_count, total_amount=total_amount)
+        for driver_id in driver_ids
+        for ride_count, total_amount in [totals.get(driver_id, (0, 0))]
+    ], batch_size=chunk_size)
+    DriverEarningsRollup.objects.bulk_create([
+        DriverEarningsRollup(
+            driver_id=driver_id, granularity=granularity, bucket_start=start_at,
+            ride_count=rides, cancelled_count=cancelled, total_amount=amount,
+        )
+        for (driver_id, granularity, start_at), (rides, cancelled, amount) in driver_buckets.items()
+    ], batch_size=chunk_size)
+
+
+def _write_status_rollups(status_counts, chunk_size):
+    """Insert new hourly status buckets in bulk; add to any that already exist"""
+    existing = set()
+    if status_counts:
+        existing = set(RideStatusRollup.objects.filter(
+            bucket_start__gte=min(start_at for start_at, _ in status_counts),
+        ).values_list('bucket_start', 'status'))
+    RideStatusRollup.objects.bulk_create([
+        RideStatusRollup(bucket_start=start_at, status=ride_status, ride_count=ride_count)
+        for (start_at, ride_status), ride_count in status_counts.items()
+        if (start_at, ride_status) not in existing
+    ], batch_size=chunk_size)
+    for start_at, ride_status in existing & status_counts.keys():
+        add_status_count(start_at, ride_status, status_counts[start_at, ride_status])
+
+
+def seeded_usernames_exist(prefix='seed_'):
+    """Whether a previous run already used this prefix (usernames would collide)"""
+    return User.objects.filter(
+        Q(username__startswith=f'{prefix}driver_') | Q(username__startswith=f'{prefix}passenger_')
+    ).exists()
+
+
+def seed(drivers, passengers, rides, password='password123', days=90, chunk_size=5000,
+         random_seed=None, prefix='seed_'):
+    """Seed a fleet, riders and ride history; return (drivers, passengers, rides) created"""
+    rng = random.Random(random_seed)
+    # One PBKDF2 run for every seeded account instead of one per user
+    password_hash = make_password(password)
+    drivers_by_city = seed_drivers(drivers, password_hash, rng, chunk_size, prefix)
+    passenger_ids = seed_passengers(passengers, password_hash, chunk_size, prefix)
+    if not (passenger_ids and drivers_by_city):
+        rides = 0
+    created = seed_rides(rides, passenger_ids, drivers_by_city, rng, days, chunk_size)
+    return drivers, passengers, created
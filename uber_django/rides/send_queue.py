@@ -0,0 +1,150 @@
+import asyncio
+from collections import OrderedDict
+from itertools import count
+
+from django.conf import settings
+
+
+# ----------------------------
+# Policies
+# ----------------------------
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# "Try again later" - the client should reconnect and resync
+CLOSE_CODE_SLOW_CONSUMER = 1013
+
+DEFAULTS = {
+    'MAX_SIZE': 50,
+    'POLICY': COALESCE,
+}
+
+
+def get_config():
+    """Merge WS_SEND_QUEUE setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'WS_SEND_QUEUE', {}))
+    if config['POLICY'] not in POLICIES:
+        raise ValueError(f"WS_SEND_QUEUE POLICY must be one of: {', '.join(POLICIES)}")
+    return config
+
+
+# ----------------------------
+# Worker-wide metrics
+# ----------------------------
+metrics = {
+    'open_queues': 0,
+    'queued': 0,           # messages currently waiting across all queues
+    'max_queue_length': 0,
+    'sent': 0,
+    'dropped': 0,
+    'coalesced': 0,
+    'disconnected': 0,
+}
+
+
+def get_metrics():
+    """Snapshot of the send queue counters for this worker"""
+    return dict(metrics)
+
+
+# ----------------------------
+# Per-connection outbound queue
+# ----------------------------
+class OutboundQueue:
+    """
+    Bounded queue between a consumer's event handlers and its socket.
+
+    Handlers call put() and return immediately; a writer task drains the
+    queue into send(). When the queue is full the configured policy decides
+    what happens: drop the oldest message, coalesce onto a pending message
+    with the same key, or close the connection.
+    """
+
+    def __init__(self, send, close, max_size=None, policy=None):
+        config = get_config()
+        self.send = send
+        self.close = close
+        self.max_size = max_size or config['MAX_SIZE']
+        self.policy = policy or config['POLICY']
+        self.dropped = 0
+        self.coalesced = 0
+        self.closed = False
+        self._pending = OrderedDict()
+        self._keys = count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        metrics['open_queues'] += 1
+        self._task = asyncio.ensure_future(self._drain())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        metrics['open_queues'] -= 1
+        metrics['queued'] -= len(self._pending)
+        self._pending.clear()
+
+    async def put(self, text, key=None):
+        """Queue one text frame; key marks messages that supersede each other"""
+        if self.closed:
+            return
+
+        if key is not None and self.policy == COALESCE and key in self._pending:
+            # The newer message goes out after everything queued before it
+            self._pending[key] = text
+            self._pending.move_to_end(key)
+            self.coalesced += 1
+            metrics['coalesced'] += 1
+            return
+
+        if len(self._pending) >= self.max_size:
+            if self.policy == DISCONNECT:
+                self.closed = True
+                metrics['disconnected'] += 1
+                await self.close(code=CLOSE_CODE_SLOW_CONSUMER)
+                return
+            self._pending.popitem(last=False)
+            self.dropped += 1
+            metrics['dropped'] += 1
+            metrics['queued'] -= 1
+
+        if key is None or self.policy != COALESCE:
+            key = ('seq', next(self._keys))
+        self._pending[key] = text
+        metrics['queued'] += 1
+        metrics['max_queue_length'] = max(metrics['max_queue_length'], len(self._pending))
+        self._wakeup.set()
+
+    async def _drain(self):
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            _, text = self._pending.popitem(last=False)
+            metrics['queued'] -= 1
+            try:
+                await self.send(text_data=text)
+            except Exception as e:
+                # Nothing more can be sent: close rather than queue into a dead task
+                print(f"WebSocket send error: {str(e)}")
+                self.closed = True
+                try:
+                    await self.close()
+                except Exception:
+                    pass
+                return
+            metrics['sent'] += 1
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.core.exceptions import ValidationError
-from .models import User, DriverProfile, PassengerProfile, Ride, Payment
+from .models import User, DriverProfile, PassengerProfile, Ride, RideStatus, Payment
 
 
 # ----------------------------
@@ -27,6 +27,19 @@ def validate_non_empty_string(value):
     return value.strip()
 
 
+class RideStatusField(serializers.Field):
+    """Expose the stored RideStatus integer as its lowercase API code"""
+
+    def to_representation(self, value):
+        return RideStatus(value).code
+
+    def to_internal_value(self, data):
+        try:
+            return RideStatus.from_code(data)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+
 # ----------------------------
 # User serializer
 # ----------------------------
@@ -99,6 +112,7 @@ class RideSerializer(serializers.ModelSerializer):
     passenger = PassengerProfileSerializer(read_only=True)
     driver = DriverProfileSerializer(read_only=True)
     payment = serializers.SerializerMethodField(read_only=True)
+    status = RideStatusField(read_only=True)
     
     # Write-only fields for creation
     pickup_lat = serializers.FloatField(write_only=True, required=True, validators=[validate_latitude])
@@ -160,6 +174,50 @@ class RideSerializer(serializers.ModelSerializer):
         return ride
 
 
+# ----------------------------
+# Fare quotes
+# ----------------------------
+class FareQuoteSerializer(serializers.Serializer):
+    """
+    trips: up to 500 of {"pickup_lat", "pickup_lng", "dropoff_lat", "dropoff_lng"}
+    or the compact [pickup_lat, pickup_lng, dropoff_lat, dropoff_lng].
+
+    Trips are checked in one pass rather than through a nested serializer
+    per trip, which would cost more than pricing them.
+    """
+    TRIP_FIELDS = ('pickup_lat', 'pickup_lng', 'dropoff_lat', 'dropoff_lng')
+
+    trips = serializers.ListField(allow_empty=False, max_length=500)
+    # Price as of this moment (time-of-day multipliers); defaults to now
+    at = serializers.DateTimeField(required=False)
+
+    def validate_trips(self, trips):
+        validated = []
+        for index, trip in enumerate(trips):
+            try:
+                if isinstance(trip, dict):
+                    trip = [trip[name] for name in self.TRIP_FIELDS]
+                if isinstance(trip, (str, bytes)) or len(trip) != 4:
+                    raise ValueError
+                plat, plng, dlat, dlng = (float(value) for value in trip)
+            except (KeyError, TypeError, ValueError):
+                raise serializers.ValidationError(
+                    f"Trip {index}: expected {', '.join(self.TRIP_FIELDS)} as numbers"
+                )
+            if not (-90 <= plat <= 90 and -90 <= dlat <= 90 and -180 <= plng <= 180 and -180 <= dlng <= 180):
+                raise serializers.ValidationError(f"Trip {index}: coordinates out of range")
+            validated.append((plat, plng, dlat, dlng))
+        return validated
+
+
+class RideEstimateSerializer(serializers.Serializer):
+    """Query parameters of the pre-trip estimate"""
+    pickup_lat = serializers.FloatField(validators=[validate_latitude])
+    pickup_lng = serializers.FloatField(validators=[validate_longitude])
+    dropoff_lat = serializers.FloatField(validators=[validate_latitude])
+    dropoff_lng = serializers.FloatField(validators=[validate_longitude])
+
+
 # ----------------------------
 # Payment serializer
 # ----------------------------
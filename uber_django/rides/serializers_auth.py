@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import User, DriverProfile, PassengerProfile
+from .models import User, DriverProfile, DriverEarnings, PassengerProfile
 
 class PassengerRegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -40,9 +40,11 @@ class DriverRegisterSerializer(serializers.ModelSerializer):
             is_driver=True,
             is_passenger=False
         )
-        DriverProfile.objects.create(
+        driver_profile = DriverProfile.objects.create(
             user=user, 
             car_model=car_model,
             car_plate=car_plate
         )
+        # Completions only ever UPDATE this row
+        DriverEarnings.objects.create(driver=driver_profile)
         return user
\ No newline at end of file
@@ -0,0 +1,332 @@
+import random
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from typing import NamedTuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .earnings import reverse_earnings
+from .models import Payment
+
+DEFAULTS = {
+    # Dotted path to a PaymentGateway subclass
+    'GATEWAY': 'rides.settlement.FakeGateway',
+    'GATEWAY_OPTIONS': {},
+    # Run a worker thread in each serving process, started with the ASGI/WSGI
+    # application so payments left pending by a restart or a dead worker's
+    # lease are picked up; turn off when `manage.py settle_payments` runs
+    # separately
+    'WORKER': True,
+    # Pending payments charged per gateway call
+    'BATCH_SIZE': 50,
+    # Idle worker checks for due retries this often
+    'POLL_SECONDS': 1.0,
+    # A claimed batch is retried after this long if its worker died mid-charge
+    'LEASE_SECONDS': 60,
+    # Attempts before a payment is marked failed
+    'MAX_ATTEMPTS': 5,
+    # Retry n waits BACKOFF_SECONDS * 2 ** (n - 1), capped, with jitter
+    'BACKOFF_SECONDS': 2.0,
+    'MAX_BACKOFF_SECONDS': 300.0,
+}
+
+
+def get_config():
+    """Merge PAYMENT_SETTLEMENT setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PAYMENT_SETTLEMENT', {}))
+    return config
+
+
+# ----------------------------
+# Worker-wide metrics
+# ----------------------------
+metrics = {
+    'batches': 0,
+    'charged': 0,
+    'declined': 0,
+    'retried': 0,
+    'failed': 0,            # out of attempts
+    'gateway_errors': 0,    # whole batch raised
+    'charged_after_refund': 0,  # refunded while the charge was in flight
+    'refund_errors': 0,     # ... and the gateway refund of it failed
+}
+
+
+def get_metrics():
+    """Snapshot of the settlement counters for this worker"""
+    return dict(metrics)
+
+
+# ----------------------------
+# Gateway interface
+# ----------------------------
+class Charge(NamedTuple):
+    payment_id: int
+    ride_id: int
+    amount: Decimal
+    # Same on every attempt, so a charge the gateway already took is not taken twice
+    idempotency_key: str
+
+
+SUCCEEDED = 'succeeded'
+DECLINED = 'declined'     # final: the card was refused
+RETRY = 'retry'           # transient: try again later
+
+
+class ChargeResult(NamedTuple):
+    payment_id: int
+    outcome: str
+    reference: str = ''
+    error: str = ''
+
+
+class PaymentGateway:
+    """
+    Charges a batch of payments. Return one ChargeResult per charge, in
+    any order; charges missing from the result are retried. Raising
+    retries the whole batch.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def charge(self, charges):
+        raise NotImplementedError
+
+    def refund(self, reference, amount):
+        """Give back a charge already taken; raise if it could not be"""
+        raise NotImplementedError
+
+
+class FakeGateway(PaymentGateway):
+    """
+    Local stand-in that takes every charge, except those listed in
+    DECLINE (payment ids, declined) or FAIL (payment id -> number of
+    transient failures before it goes through).
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.charged = {}       # idempotency_key -> reference
+        self.refunded = {}      # reference -> amount
+        self.failures = dict(options.get('FAIL', {}))
+        self.lock = threading.Lock()
+
+    def charge(self, charges):
+        results = []
+        with self.lock:
+            for charge in charges:
+                if charge.payment_id in self.options.get('DECLINE', ()):
+                    results.append(ChargeResult(charge.payment_id, DECLINED, error='Card declined'))
+                elif self.failures.get(charge.payment_id, 0) > 0:
+                    self.failures[charge.payment_id] -= 1
+                    results.append(ChargeResult(charge.payment_id, RETRY, error='Gateway timeout'))
+                else:
+                    reference = self.charged.setdefault(charge.idempotency_key, f'fake_{len(self.charged) + 1}')
+                    results.append(ChargeResult(charge.payment_id, SUCCEEDED, reference=reference))
+        return results
+
+    def refund(self, reference, amount):
+        with self.lock:
+            self.refunded[reference] = amount
+
+
+_gateway = (None, None)
+
+
+def get_gateway():
+    """The configured gateway, built once per GATEWAY/GATEWAY_OPTIONS"""
+    global _gateway
+    config = get_config()
+    key = repr((config['GATEWAY'], sorted(config['GATEWAY_OPTIONS'].items())))
+    if _gateway[0] != key:
+        _gateway = (key, import_string(config['GATEWAY'])(**config['GATEWAY_OPTIONS']))
+    return _gateway[1]
+
+
+# ----------------------------
+# Settlement
+# ----------------------------
+def create_pending(ride, amount):
+    """Pending payment for a completed ride, due now; call inside the completion transaction"""
+    payment = Payment.objects.create(
+        ride=ride,
+        amount=amount,
+        payment_status="pending",
+        next_attempt_at=timezone.now(),
+    )
+    transaction.on_commit(wake)
+    return payment
+
+
+def backoff(attempts, config=None):
+    """Seconds before retry number `attempts`, with up to 25% jitter"""
+    config = config or get_config()
+    delay = min(config['MAX_BACKOFF_SECONDS'], config['BACKOFF_SECONDS'] * 2 ** (attempts - 1))
+    return delay * random.uniform(0.75, 1.0)
+
+
+def _claim(config, now):
+    """
+    Take up to BATCH_SIZE due payments and push their due time past the
+    lease, so other workers skip them. Databases with SKIP LOCKED never
+    hand one row to two workers; elsewhere the idempotency key keeps a
+    duplicate charge harmless.
+    """
+    with transaction.atomic():
+        due = Payment.objects.filter(payment_status="pending", next_attempt_at__lte=now)
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        payments = list(
+            due.select_related('ride').order_by('next_attempt_at')[:config['BATCH_SIZE']]
+        )
+        Payment.objects.filter(pk__in=[p.pk for p in payments]).update(
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + timedelta(seconds=config['LEASE_SECONDS']),
+        )
+    for payment in payments:
+        payment.attempts += 1
+    return payments
+
+
+def settle_due(now=None):
+    """Charge one batch of due pending payments; returns how many were claimed"""
+    config = get_config()
+    now = now or timezone.now()
+    payments = _claim(config, now)
+    if not payments:
+        return 0
+
+    metrics['batches'] += 1
+    charges = [
+        Charge(p.pk, p.ride_id, Decimal(str(p.amount)), f'payment-{p.pk}')
+        for p in payments
+    ]
+    error = 'No result from gateway'
+    try:
+        results = {r.payment_id: r for r in get_gateway().charge(charges)}
+    except Exception as e:
+        metrics['gateway_errors'] += 1
+        print(f"Payment gateway error: {str(e)}")
+        results, error = {}, str(e) or type(e).__name__
+
+    for payment in payments:
+        result = results.get(payment.pk) or ChargeResult(payment.pk, RETRY, error=error)
+        _apply(payment, result, config)
+    return len(payments)
+
+
+def _apply(payment, result, config):
+    now = timezone.now()
+    if result.outcome == SUCCEEDED:
+        counter = 'charged'
+        changes = {'payment_status': "completed", 'paid_at': now, 'gateway_reference': result.reference,
+                   'last_error': '', 'next_attempt_at': None}
+    elif result.outcome == RETRY and payment.attempts < config['MAX_ATTEMPTS']:
+        counter = 'retried'
+        changes = {'next_attempt_at': now + timedelta(seconds=backoff(payment.attempts, config)),
+                   'last_error': result.error[:255]}
+    else:
+        counter = 'declined' if result.outcome == DECLINED else 'failed'
+        changes = {'payment_status': "failed", 'last_error': result.error[:255], 'next_attempt_at': None}
+
+    # Only a payment still pending changes; a refund that raced the charge wins
+    with transaction.atomic():
+        updated = Payment.objects.filter(pk=payment.pk, payment_status="pending").update(**changes)
+        if updated and changes.get('payment_status') == "failed":
+            # Never collected: the driver is not credited for it
+            reverse_earnings(payment)
+    if not updated:
+        if result.outcome == SUCCEEDED:
+            _refund_late_charge(payment, result.reference)
+        return
+    metrics[counter] += 1
+    for field, value in changes.items():
+        setattr(payment, field, value)
+    if payment.payment_status != "pending":
+        _push(payment)
+
+
+def _refund_late_charge(payment, reference):
+    """The card was charged for a payment refunded meanwhile: keep the reference and give it back"""
+    metrics['charged_after_refund'] += 1
+    Payment.objects.filter(pk=payment.pk).update(gateway_reference=reference)
+    print(f"Payment {payment.pk} charged after refund ({reference}); refunding at the gateway")
+    try:
+        get_gateway().refund(reference, Decimal(str(payment.amount)))
+    except Exception as e:
+        metrics['refund_errors'] += 1
+        Payment.objects.filter(pk=payment.pk).update(last_error=f"Refund failed: {str(e)}"[:255])
+        print(f"Gateway refund error for payment {payment.pk}: {str(e)}")
+
+
+def _push(payment):
+    data = {
+        'status': 'completed',
+        'payment': {
+            'id': payment.pk,
+            'amount': str(payment.amount),
+            'payment_status': payment.payment_status,
+            'paid_at': payment.paid_at.isoformat() if payment.paid_at else None,
+        },
+    }
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f'ride_{payment.ride_id}', {'type': 'ride_update', 'event': 'payment_settled', 'ride': data}
+        )
+    except Exception as e:
+        print(f"WebSocket error: {str(e)}")  # Log but don't fail
+
+
+# ----------------------------
+# Background worker
+# ----------------------------
+_wake = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_worker():
+    """
+    Start this process's worker if enabled. Called where the ASGI/WSGI
+    application is built rather than in AppConfig.ready(), so management
+    commands and the test runner never get a thread polling the database.
+    """
+    wake()
+
+
+def wake():
+    """Start this process's worker if enabled, and have it look for due payments now"""
+    global _worker
+    if not get_config()['WORKER']:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=run, name='payment-settlement', daemon=True)
+            _worker.start()
+    _wake.set()
+
+
+def run(stop=None):
+    """Settle batches until stop is set; sleeps POLL_SECONDS (or until woken) when idle"""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        _wake.clear()
+        close_old_connections()
+        try:
+            claimed = settle_due()
+        except Exception as e:
+            print(f"Payment settlement error: {str(e)}")
+            claimed = 0
+        finally:
+            close_old_connections()
+        if claimed < get_config()['BATCH_SIZE']:
+            _wake.wait(get_config()['POLL_SECONDS'])
@@ -0,0 +1,248 @@
+import hmac
+import math
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'gotaxi_'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+REGISTRY = []
+
+DEFAULTS = {
+    # Scrapers allowed without a token, by REMOTE_ADDR
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+    # Or any client sending "Authorization: Bearer <TOKEN>"; None disables
+    'TOKEN': None,
+}
+
+
+def get_config():
+    """Merge METRICS setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'METRICS', {}))
+    return config
+
+
+# ----------------------------
+# Metric types
+# ----------------------------
+class Metric:
+    """
+    One metric family in this process, keyed by label values.
+
+    Updates take a lock per family and touch a dict entry, cheap enough
+    to leave on for every request. Each worker process keeps its own
+    registry; Prometheus sums across scrape targets.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """(suffix, {label: value}, number) for every series"""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', dict(zip(self.labelnames, key)), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (made cumulative on render), sum, count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            running = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                running += bucket_count
+                yield '_bucket', {**labels, 'le': _format_bound(bound)}, running
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+
+# ----------------------------
+# HTTP, DB and websocket metrics
+# ----------------------------
+HTTP_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    labels=('method', 'route', 'status'),
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Response body size on the wire by route',
+    labels=('route',), buckets=SIZE_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'http_db_queries', 'Database queries per request by route',
+    labels=('route',), buckets=QUERY_BUCKETS,
+)
+DB_TIME = Histogram(
+    'http_db_query_duration_seconds', 'Time in database queries per request by route',
+    labels=('route',),
+)
+WS_CONNECTIONS = Gauge(
+    'ws_connections', 'Open websocket connections by consumer', labels=('consumer',),
+)
+WS_MESSAGES = Counter(
+    'ws_messages_total', 'Websocket messages by consumer and direction',
+    labels=('consumer', 'direction'),
+)
+
+
+class QueryTimer:
+    """connection.execute_wrapper() hook counting queries and their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+def route_name(request):
+    """Bounded route label: the resolved URL name, never the raw path"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or 'unnamed'
+
+
+# ----------------------------
+# Exposition
+# ----------------------------
+def scrape_allowed(request):
+    """Whether request may read /metrics: an allowed address or the bearer token"""
+    config = get_config()
+    if request.META.get('REMOTE_ADDR') in config['ALLOWED_IPS']:
+        return True
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    scheme, _, token = header.partition(' ')
+    return bool(config['TOKEN']) and scheme == 'Bearer' and hmac.compare_digest(
+        token.encode(), str(config['TOKEN']).encode()
+    )
+
+
+def _module_collectors():
+    """get_metrics() counters the rides modules already keep, exported as gauges"""
+    from . import estimates, hashing, idempotency, offers, ratelimit, send_queue, settlement, tracing
+    return {
+        'ride_estimates': estimates.get_metrics,
+        'password_hashing': hashing.get_metrics,
+        'idempotency': idempotency.get_metrics,
+        'ride_offers': offers.get_metrics,
+        'rate_limit': ratelimit.get_metrics,
+        'payment_settlement': settlement.get_metrics,
+        'ws_send_queue': send_queue.get_metrics,
+        'tracing': tracing.get_metrics,
+    }
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(int(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _line(name, labels, value):
+    if labels:
+        inner = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f'{name}{{{inner}}} {_format_value(value)}'
+    return f'{name} {_format_value(value)}'
+
+
+def render():
+    """All metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for suffix, labels, value in metric.samples():
+            lines.append(_line(metric.name + suffix, labels, value))
+
+    for module, get_metrics in _module_collectors().items():
+        for key, value in get_metrics().items():
+            name = f'{PREFIX}{module}_{key}'
+            lines.append(f'# TYPE {name} gauge')
+            if isinstance(value, dict):
+                lines.extend(_line(name, {'key': k}, v) for k, v in value.items())
+            else:
+                lines.append(_line(name, {}, value))
+    return '\n'.join(lines) + '\n'
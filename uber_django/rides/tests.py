@@ -1,3 +1,1457 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import importlib
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ParseError, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import fares, hashing, middleware, offers, send_queue, settlement, telemetry, tracing, views
+from .archive import archive_finished_rides
+from .consumers import RideConsumer
+from .db import PrimaryReplicaRouter, has_recent_write, mark_recent_write, use_replica
+from .earnings import rebuild_driver_earnings, refund_payment
+from .fast_serializers import ride_rows, serialize_ride, serialize_ride_row
+from .rollups import bucket_start, rebuild_earnings_rollups
+from .models import (
+    User, ArchivedRide, DriverProfile, DriverEarnings, DriverEarningsRollup, PassengerProfile, Ride,
+    RideStatus, RideStatusRollup, Payment
+)
+from .renderers import FastJSONParser, FastJSONRenderer
+from .serializers import RideSerializer
+from .timer_wheel import TimerWheel
+from .transitions import IllegalTransition, apply_transition, set_driver_available
+from .fares import haversine
+
+
+# ----------------------------
+# Query count helper
+# ----------------------------
+class QueryCountMixin:
+    """Assert an endpoint issues the same number of queries however much history exists"""
+
+    def assertConstantQueries(self, perform, grow, prepare=None, rounds=3, warmup=0):
+        counts = []
+        for _ in range(warmup):
+            if prepare:
+                prepare()
+            perform()
+        for _ in range(rounds):
+            if prepare:
+                prepare()
+            with CaptureQueriesContext(connection) as ctx:
+                perform()
+            counts.append(len(ctx))
+            grow()
+        self.assertEqual(
+            len(set(counts)), 1,
+            f"Query count grows with history: {counts}\n" +
+            "\n".join(q['sql'] for q in ctx.captured_queries)
+        )
+        return counts[0]
+
+
+# ----------------------------
+# Ride endpoint query counts
+# ----------------------------
+class RideQueryCountTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.passenger_user = User.objects.create(username='passenger', is_passenger=True)
+        self.passenger = PassengerProfile.objects.create(user=self.passenger_user, phone_number='')
+        self.driver_user = User.objects.create(username='driver', is_driver=True, is_passenger=False)
+        self.driver = DriverProfile.objects.create(
+            user=self.driver_user, car_model='Prius', car_plate='AB-123',
+            latitude=40.0, longitude=-74.0, is_available=False
+        )
+        DriverEarnings.objects.create(driver=self.driver)
+
+    def login(self, user):
+        # Fresh instance so cached profile lookups don't leak between rounds
+        self.client.force_authenticate(User.objects.get(pk=user.pk))
+
+    def make_ride(self, status=RideStatus.COMPLETED, with_payment=True):
+        ride = Ride.objects.create(
+            passenger=self.passenger, driver=self.driver,
+            pickup_location='A', pickup_lat=40.0, pickup_lng=-74.0,
+            dropoff_location='B', dropoff_lat=40.1, dropoff_lng=-74.1,
+            status=status, fare=12.5 if with_payment else None
+        )
+        if with_payment:
+            Payment.objects.create(ride=ride, amount=12.5, payment_status='completed')
+        return ride
+
+    def grow_history(self):
+        for _ in range(3):
+            self.make_ride()
+
+    def test_list_passenger(self):
+        self.grow_history()
+        self.assertConstantQueries(
+            lambda: self.assertEqual(self.client.get('/api/rides/').status_code, 200),
+            self.grow_history,
+            prepare=lambda: self.login(self.passenger_user)
+        )
+
+    def test_list_driver(self):
+        self.grow_history()
+        self.assertConstantQueries(
+            lambda: self.assertEqual(self.client.get('/api/rides/').status_code, 200),
+            self.grow_history,
+            prepare=lambda: self.login(self.driver_user)
+        )
+
+    def test_retrieve(self):
+        ride = self.make_ride()
+        self.assertConstantQueries(
+            lambda: self.assertEqual(self.client.get(f'/api/rides/{ride.id}/').status_code, 200),
+            self.grow_history,
+            prepare=lambda: self.login(self.passenger_user)
+        )
+
+    def assertLifecycleConstant(self, action, status, user=None, warmup=0):
+        rides = []
+
+        def prepare():
+            rides.append(self.make_ride(status=status, with_payment=False))
+            self.login(user or self.driver_user)
+
+        def perform():
+            response = self.client.post(f'/api/rides/{rides[-1].id}/{action}/')
+            self.assertEqual(response.status_code, 200, response.content)
+
+        self.assertConstantQueries(perform, self.grow_history, prepare=prepare, warmup=warmup)
+
+    def test_accept_ride(self):
+        self.assertLifecycleConstant('accept_ride', RideStatus.ASSIGNED)
+
+    def test_start_ride(self):
+        self.assertLifecycleConstant('start_ride', RideStatus.ACCEPTED)
+
+    def test_complete_ride(self):
+        # The first completion in an hour creates that hour's rollup rows
+        self.assertLifecycleConstant('complete_ride', RideStatus.IN_PROGRESS, warmup=1)
+
+    def test_cancel_ride(self):
+        self.assertLifecycleConstant('cancel_ride', RideStatus.ASSIGNED, user=self.passenger_user, warmup=1)
+
+
+# ----------------------------
+# Ride history pagination
+# ----------------------------
+class RideCursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create(username='passenger', is_passenger=True)
+        passenger = PassengerProfile.objects.create(user=user, phone_number='')
+        self.rides = Ride.objects.bulk_create([
+            Ride(passenger=passenger, pickup_location='A', dropoff_location='B')
+            for _ in range(7)
+        ])
+        # Force ties on requested_at so the id tie-breaker is exercised
+        Ride.objects.update(requested_at=Ride.objects.first().requested_at)
+        self.client.force_authenticate(user)
+
+    def test_walks_every_ride_once_newest_first(self):
+        seen = []
+        url = '/api/rides/?page_size=3'
+        while url:
+            body = self.client.get(url).json()
+            seen.extend(ride['id'] for ride in body['data'])
+            url = body['pagination']['next']
+        self.assertEqual(seen, sorted((r.id for r in Ride.objects.all()), reverse=True))
+
+    def test_page_size_is_bounded(self):
+        body = self.client.get('/api/rides/?page_size=100000').json()
+        self.assertEqual(body['pagination']['page_size'], 100)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/rides/?cursor=garbage').status_code, 404)
+
+
+# ----------------------------
+# Ride status
+# ----------------------------
+class RideStatusTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create(username='passenger', is_passenger=True)
+        passenger = PassengerProfile.objects.create(user=user, phone_number='')
+        for ride_status in (RideStatus.REQUESTED, RideStatus.COMPLETED, RideStatus.COMPLETED):
+            Ride.objects.create(passenger=passenger, pickup_location='A', dropoff_location='B', status=ride_status)
+        self.client.force_authenticate(user)
+
+    def test_filter_accepts_any_case_and_returns_api_codes(self):
+        for value in ('completed', 'COMPLETED'):
+            rides = self.client.get(f'/api/rides/?status={value}').json()['data']
+            self.assertEqual([r['status'] for r in rides], ['completed', 'completed'])
+
+    def test_unknown_status_rejected(self):
+        self.assertEqual(self.client.get('/api/rides/?status=picked_up').status_code, 400)
+
+
+# ----------------------------
+# Driver earnings summary
+# ----------------------------
+class CompletedRideMixin:
+    def setUp(self):
+        self.client = APIClient()
+        passenger_user = User.objects.create(username='passenger', is_passenger=True)
+        self.passenger = PassengerProfile.objects.create(user=passenger_user, phone_number='')
+        self.driver_user = User.objects.create(username='driver', is_driver=True, is_passenger=False)
+        self.driver = DriverProfile.objects.create(user=self.driver_user, car_model='Prius', car_plate='AB-123')
+        self.client.force_authenticate(self.driver_user)
+
+    def complete_ride(self):
+        ride = Ride.objects.create(
+            passenger=self.passenger, driver=self.driver, status=RideStatus.IN_PROGRESS,
+            pickup_location='A', pickup_lat=40.0, pickup_lng=-74.0,
+            dropoff_location='B', dropoff_lat=40.1, dropoff_lng=-74.1,
+        )
+        response = self.client.post(f'/api/rides/{ride.id}/complete_ride/')
+        self.assertEqual(response.status_code, 200)
+        # What the settlement worker would do next
+        settlement.settle_due()
+        return Payment.objects.get(ride=ride)
+
+    def earnings(self):
+        return self.client.get('/api/rides/earnings/').json()['data']
+
+
+class DriverEarningsTests(CompletedRideMixin, TestCase):
+
+    def test_completion_and_refund_update_summary(self):
+        self.assertEqual(self.earnings()['total_rides'], 0)
+        first = self.complete_ride()
+        self.complete_ride()
+        data = self.earnings()
+        self.assertEqual(data['total_rides'], 2)
+        self.assertAlmostEqual(data['total_earnings'], float(first.amount) * 2)
+
+        refund_payment(first)
+        data = self.earnings()
+        self.assertEqual(data['total_rides'], 1)
+        self.assertAlmostEqual(data['total_earnings'], float(first.amount))
+
+    def test_single_query(self):
+        self.complete_ride()
+        self.client.force_authenticate(User.objects.get(pk=self.driver_user.pk))
+        with self.assertNumQueries(1):
+            self.client.get('/api/rides/earnings/')
+
+    def test_rebuild_matches_incremental(self):
+        self.complete_ride()
+        self.complete_ride()
+        before = self.earnings()
+        DriverEarnings.objects.all().delete()
+        rebuild_driver_earnings()
+        self.assertEqual(self.earnings(), before)
+
+
+# ----------------------------
+# Earnings rollups
+# ----------------------------
+class EarningsRollupTests(CompletedRideMixin, TestCase):
+    def series(self, granularity):
+        return self.client.get(f'/api/rides/earnings/?granularity={granularity}').json()['data']['buckets']
+
+    def test_completions_land_in_every_granularity(self):
+        payment = self.complete_ride()
+        self.complete_ride()
+        for granularity in ('hour', 'day', 'week', 'hour_of_day'):
+            buckets = self.series(granularity)
+            self.assertEqual(len(buckets), 1)
+            self.assertEqual(buckets[0]['total_rides'], 2)
+            self.assertAlmostEqual(buckets[0]['total_earnings'], float(payment.amount) * 2)
+
+    def test_refund_and_rebuild(self):
+        payment = self.complete_ride()
+        self.complete_ride()
+        refund_payment(payment)
+        before = self.series('day')
+        self.assertEqual(before[0]['total_rides'], 1)
+        DriverEarningsRollup.objects.update(ride_count=0, total_amount=0)
+        rebuild_earnings_rollups()
+        self.assertEqual(self.series('day'), before)
+
+    def test_migration_backfills_rides_finished_before_rollups(self):
+        self.complete_ride()
+        self.complete_ride()
+        cancelled = Ride.objects.create(
+            passenger=self.passenger, driver=self.driver, status=RideStatus.CANCELLED,
+            pickup_location='A', dropoff_location='B',
+        )
+        earnings = list(DriverEarningsRollup.objects.values_list(
+            'granularity', 'bucket_start', 'ride_count', 'total_amount').order_by('granularity'))
+        completed = list(RideStatusRollup.objects.values_list('bucket_start', 'ride_count'))
+        # As on a database migrated to 0008 with rides already in it
+        DriverEarningsRollup.objects.all().delete()
+        RideStatusRollup.objects.all().delete()
+
+        migration = importlib.import_module('rides.migrations.0011_backfill_rollups')
+        migration.backfill_rollups(django_apps, None)
+
+        self.assertEqual(list(DriverEarningsRollup.objects.filter(ride_count__gt=0).values_list(
+            'granularity', 'bucket_start', 'ride_count', 'total_amount').order_by('granularity')), earnings)
+        self.assertEqual(list(RideStatusRollup.objects.filter(status=RideStatus.COMPLETED).values_list(
+            'bucket_start', 'ride_count')), completed)
+        self.assertEqual(RideStatusRollup.objects.get(status=RideStatus.CANCELLED).bucket_start,
+                         bucket_start(cancelled.requested_at, 'hour'))
+        self.assertEqual(sum(DriverEarningsRollup.objects.values_list('cancelled_count', flat=True)), 3)
+
+    def test_invalid_granularity(self):
+        response = self.client.get('/api/rides/earnings/?granularity=month')
+        self.assertEqual(response.status_code, 400)
+
+
+# ----------------------------
+# Database routing
+# ----------------------------
+class DatabaseRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.replica = {**settings.DATABASES['default'], 'NAME': 'replica.sqlite3'}
+        self.router = PrimaryReplicaRouter()
+        self.user = User.objects.create(username='passenger', is_passenger=True)
+        PassengerProfile.objects.create(user=self.user, phone_number='')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_reads_use_primary_unless_opted_in(self):
+        with mock.patch.dict(settings.DATABASES, {'replica': self.replica}):
+            self.assertIsNone(self.router.db_for_read(Ride))
+            with use_replica():
+                self.assertEqual(self.router.db_for_read(Ride), 'replica')
+                self.assertEqual(self.router.db_for_write(Ride), 'default')
+        with use_replica():
+            self.assertIsNone(self.router.db_for_read(Ride))
+
+    def test_views_pick_alias_per_action_with_stickiness(self):
+        seen = []
+        original = PrimaryReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            alias = original(router, model, **hints)
+            if model is Ride:
+                seen.append(alias)
+            return None  # keep queries on the test database
+
+        with mock.patch.dict(settings.DATABASES, {'replica': self.replica}), \
+                mock.patch.object(PrimaryReplicaRouter, 'db_for_read', spy):
+            self.client.get('/api/rides/')
+            self.assertEqual(seen.pop(), 'replica')
+
+            self.client.post('/api/rides/', {
+                'pickup_location': 'A', 'pickup_lat': 40.0, 'pickup_lng': -74.0,
+                'dropoff_location': 'B', 'dropoff_lat': 40.1, 'dropoff_lng': -74.1,
+            }, format='json')
+            seen.clear()
+            self.client.get('/api/rides/')
+            self.assertEqual(seen.pop(), None)
+
+    @override_settings(DB_READ_YOUR_WRITES={'CACHE': 'idempotency', 'SECONDS': 5})
+    def test_recent_writes_kept_in_configured_cache(self):
+        caches['idempotency'].clear()
+        mark_recent_write(self.user.id)
+        self.assertTrue(has_recent_write(self.user.id))
+        self.assertIsNone(cache.get(f'db:recent_write:{self.user.id}'))
+        self.assertFalse(has_recent_write(self.user.id + 1))
+
+    def test_sqlite_connection_setup_enables_wal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            settings_dict = connections.create_connection('default').settings_dict.copy()
+            settings_dict['NAME'] = os.path.join(tmp, 'replica.sqlite3')
+            wrapper = DatabaseWrapper(settings_dict, alias='wal_check')
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            finally:
+                wrapper.close()
+
+
+# ----------------------------
+# Ride archival
+# ----------------------------
+class RideArchiveTests(CompletedRideMixin, TestCase):
+    def age(self, ride_ids, days):
+        past = timezone.now() - timedelta(days=days)
+        Ride.objects.filter(id__in=ride_ids).update(requested_at=past, completed_at=past)
+
+    def test_archived_rides_read_back_unchanged(self):
+        old = [self.complete_ride().ride_id for _ in range(3)]
+        self.age(old, days=60)
+        recent = self.complete_ride().ride_id
+
+        before = self.client.get('/api/rides/').json()['data']
+        detail_before = self.client.get(f'/api/rides/{old[0]}/').json()
+
+        self.assertEqual(archive_finished_rides(older_than_days=30, batch_size=2), 3)
+        self.assertEqual(list(Ride.objects.values_list('id', flat=True)), [recent])
+        self.assertFalse(Payment.objects.filter(ride_id__in=old).exists())
+
+        self.assertEqual(self.client.get('/api/rides/').json()['data'], before)
+        self.assertEqual(self.client.get(f'/api/rides/{old[0]}/').json(), detail_before)
+
+    @override_settings(PAYMENT_SETTLEMENT={'WORKER': False})
+    def test_pending_payments_stay_until_settled(self):
+        ride = Ride.objects.create(
+            passenger=self.passenger, driver=self.driver, status=RideStatus.IN_PROGRESS,
+            pickup_location='A', pickup_lat=40.0, pickup_lng=-74.0,
+            dropoff_location='B', dropoff_lat=40.1, dropoff_lng=-74.1,
+        )
+        self.client.post(f'/api/rides/{ride.id}/complete_ride/')
+        cancelled = Ride.objects.create(
+            passenger=self.passenger, status=RideStatus.CANCELLED, pickup_location='A', dropoff_location='B',
+        )
+        self.age([ride.id, cancelled.id], days=60)
+
+        # Settlement has not claimed the payment yet
+        self.assertEqual(archive_finished_rides(older_than_days=30), 1)
+        self.assertEqual(Payment.objects.get(ride_id=ride.id).payment_status, "pending")
+        settlement.settle_due()
+        self.assertEqual(archive_finished_rides(older_than_days=30), 1)
+        self.assertEqual(ArchivedRide.objects.get(pk=ride.id).payment_status, "completed")
+
+    def test_non_numeric_id_is_not_found(self):
+        self.assertEqual(self.client.get('/api/rides/abc/').status_code, 404)
+
+    def test_rebuild_counts_archived_payments(self):
+        old = [self.complete_ride().ride_id for _ in range(2)]
+        self.age(old, days=60)
+        self.complete_ride()
+        before = self.earnings()
+        archive_finished_rides(older_than_days=30)
+        rebuild_driver_earnings()
+        self.assertEqual(self.earnings(), before)
+
+
+# ----------------------------
+# Bulk export
+# ----------------------------
+class RideExportTests(CompletedRideMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create(username='finance', is_staff=True, is_passenger=False)
+
+    def export(self, output):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get(f'/api/rides/export/?output={output}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_includes_hot_and_archived_rides(self):
+        archived = self.complete_ride()
+        Ride.objects.filter(id=archived.ride_id).update(completed_at=timezone.now() - timedelta(days=60))
+        archive_finished_rides(older_than_days=30)
+        live = self.complete_ride()
+
+        rows = [json.loads(line) for line in self.export('ndjson').splitlines()]
+        self.assertEqual(sorted(row['ride_id'] for row in rows), [archived.ride_id, live.ride_id])
+        for row in rows:
+            self.assertEqual(row['status'], 'completed')
+            self.assertEqual(row['payment_status'], 'completed')
+
+    def test_csv_has_header_and_one_line_per_ride(self):
+        self.complete_ride()
+        lines = list(csv.reader(io.StringIO(self.export('csv'))))
+        self.assertEqual(lines[0][0], 'ride_id')
+        self.assertEqual(len(lines), 2)
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get('/api/rides/export/').status_code, 403)
+
+
+# ----------------------------
+# Bulk seeding
+# ----------------------------
+class SeedDataTests(TestCase):
+    def test_seeds_consistent_dataset(self):
+        call_command('seed_data', drivers=5, passengers=8, rides=60, seed=7, stdout=io.StringIO())
+
+        self.assertEqual(DriverProfile.objects.count(), 5)
+        self.assertEqual(PassengerProfile.objects.count(), 8)
+        self.assertEqual(Ride.objects.count(), 60)
+        self.assertEqual(
+            Payment.objects.count(), Ride.objects.filter(status=RideStatus.COMPLETED).count()
+        )
+        self.assertIsNotNone(authenticate(username='seed_driver_0', password='password123'))
+
+        # Bulk-written summaries agree with a rebuild from payments
+        summaries = set(DriverEarnings.objects.values_list('driver_id', 'ride_count', 'total_amount'))
+        rebuild_driver_earnings()
+        self.assertEqual(
+            summaries, set(DriverEarnings.objects.values_list('driver_id', 'ride_count', 'total_amount'))
+        )
+
+    def test_keeps_historical_timestamps_without_patching_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command('seed_data', drivers=2, passengers=2, rides=30, days=30, seed=3, stdout=io.StringIO())
+        # Written in the insert, not patched up afterwards
+        self.assertFalse([q for q in queries if q['sql'].startswith('UPDATE "rides_ride"')
+                          or q['sql'].startswith('UPDATE "rides_payment"')])
+        self.assertTrue(Ride._meta.get_field('requested_at').auto_now_add)
+        self.assertTrue(Ride.objects.filter(requested_at__lt=timezone.now() - timedelta(days=1)).exists())
+        for payment in Payment.objects.select_related('ride'):
+            self.assertEqual(payment.created_at, payment.ride.completed_at)
+
+    def test_second_run_needs_new_prefix(self):
+        call_command('seed_data', drivers=1, passengers=1, rides=0, stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command('seed_data', drivers=1, passengers=1, rides=0, stdout=io.StringIO())
+        call_command('seed_data', drivers=1, passengers=1, rides=0, prefix='again_', stdout=io.StringIO())
+
+
+# ----------------------------
+# Profile response cache
+# ----------------------------
+class ProfileCacheTests(CompletedRideMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def get_profile(self):
+        response = self.client.get('/api/drivers/me/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']
+
+    def test_repeat_reads_skip_the_database(self):
+        first = self.get_profile()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_profile(), first)
+
+    def test_location_and_profile_writes_invalidate(self):
+        self.get_profile()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/rides/update_location/',
+                             {'latitude': 41.5, 'longitude': -73.5, 'is_available': False})
+        profile = self.get_profile()
+        self.assertEqual((profile['latitude'], profile['is_available']), (41.5, False))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/drivers/me/', {'car_model': 'Leaf'})
+        self.assertEqual(self.get_profile()['car_model'], 'Leaf')
+
+    @override_settings(PROFILE_CACHE={'CACHE': 'estimates', 'TTL_SECONDS': {'passenger': 0}})
+    def test_cache_alias_and_ttl_per_kind(self):
+        caches['estimates'].clear()
+        self.get_profile()
+        key = f'profile:driver:{self.driver_user.id}:0'
+        self.assertIsNotNone(caches['estimates'].get(key))
+        self.assertIsNone(cache.get(key))
+
+        # A zero TTL is not cached at all; the driver default is kept
+        self.client.force_authenticate(self.passenger.user)
+        self.client.get('/api/passengers/me/')
+        self.assertIsNone(caches['estimates'].get(f'profile:passenger:{self.passenger.user.id}:0'))
+
+    @override_settings(PAYMENT_SETTLEMENT={'WORKER': False})
+    def test_completion_invalidates_availability(self):
+        self.driver.is_available = False
+        self.driver.save()
+        self.assertFalse(self.get_profile()['is_available'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.complete_ride()
+        self.assertTrue(self.get_profile()['is_available'])
+
+
+# ----------------------------
+# Fast-path ride serializer
+# ----------------------------
+class FastRideSerializerTests(CompletedRideMixin, TestCase):
+    def assertSameBytes(self, ride_id, fast_data):
+        ride = Ride.objects.select_related('passenger__user', 'driver__user', 'payment').get(pk=ride_id)
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(fast_data), renderer.render(RideSerializer(ride).data))
+
+    def test_rows_and_instances_match_ride_serializer(self):
+        completed = self.complete_ride().ride
+        requested = Ride.objects.create(
+            passenger=self.passenger, pickup_location='A', pickup_lat=1, pickup_lng=2,
+            dropoff_location='B', dropoff_lat=3, dropoff_lng=4,
+        )
+        for ride in (completed, requested):
+            row = ride_rows(Ride.objects.filter(pk=ride.pk)).get()
+            self.assertSameBytes(ride.pk, serialize_ride_row(row))
+            self.assertSameBytes(ride.pk, serialize_ride(Ride.objects.get(pk=ride.pk)))
+
+    def test_unsaved_float_fare_matches(self):
+        # complete_ride assigns a float fare before serializing the response
+        ride = self.complete_ride().ride
+        ride.fare = 12.345
+        self.assertEqual(
+            JSONRenderer().render(serialize_ride(ride)), JSONRenderer().render(RideSerializer(ride).data)
+        )
+
+    def test_archived_rows_match_ride_serializer(self):
+        ride_id = self.complete_ride().ride_id
+        Ride.objects.filter(pk=ride_id).update(completed_at=timezone.now() - timedelta(days=60))
+        live = Ride.objects.select_related('passenger__user', 'driver__user', 'payment').get(pk=ride_id)
+        expected = JSONRenderer().render(RideSerializer(live).data)
+        archive_finished_rides(older_than_days=30)
+
+        row = ride_rows(ArchivedRide.objects.filter(pk=ride_id)).get()
+        self.assertEqual(JSONRenderer().render(serialize_ride_row(row)), expected)
+
+
+# ----------------------------
+# JSON renderer/parser and compression
+# ----------------------------
+class FastJSONTests(TestCase):
+    def test_renderer_matches_drf_bytes(self):
+        data = {
+            'fare': Decimal('12.50'),
+            'at': timezone.now(),
+            'day': timezone.now().date(),
+            'hours': {7: 3, 8: 1},
+            'text': 'Caf\u00e9 \u2028 line',
+            'rows': [1, 2.5, None, True, ('a', 'b')],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+
+    def test_parser(self):
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(b'{"lat": 40.5}')), {'lat': 40.5})
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(io.BytesIO(b'{"lat": NaN}'))
+
+
+class CompressionTests(CompletedRideMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for _ in range(20):
+            self.complete_ride()
+
+    def get_rides(self, accept_encoding):
+        return self.client.get('/api/rides/?page_size=20', HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def test_negotiates_brotli_and_gzip(self):
+        plain = self.get_rides('')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+        gzipped = self.get_rides('gzip, deflate')
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', gzipped['Vary'])
+        self.assertEqual(gzip.decompress(gzipped.content), plain.content)
+
+        preferred = self.get_rides('gzip;q=1.0, br;q=0.5')
+        self.assertEqual(preferred['Content-Encoding'], 'gzip')
+
+        if middleware.brotli is not None:
+            encoded = self.get_rides('gzip, br')
+            self.assertEqual(encoded['Content-Encoding'], 'br')
+            self.assertEqual(middleware.brotli.decompress(encoded.content), plain.content)
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get('/api/rides/earnings/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertLess(len(response.content), 1024)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+# ----------------------------
+# Password hashing pool
+# ----------------------------
+class PasswordHashingPoolTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='rider', password='s3cret-pass!')
+
+    def test_hashes_are_standard_pbkdf2(self):
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        self.assertTrue(PBKDF2PasswordHasher().verify('s3cret-pass!', self.user.password))
+        self.assertGreaterEqual(hashing.get_metrics()['completed'], 1)
+
+    def test_token_endpoint_uses_pool(self):
+        response = self.client.post('/api/token/', {'username': 'rider', 'password': 's3cret-pass!'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+        response = self.client.post('/api/token/', {'username': 'rider', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+
+    @mock.patch.dict(settings.PASSWORD_HASHING_POOL, {'QUEUE_TIMEOUT': 0})
+    def test_saturated_pool_returns_503(self):
+        _, slots = hashing._get_pool(hashing.get_config())
+        held = 0
+        while slots.acquire(blocking=False):
+            held += 1
+        try:
+            rejected = hashing.get_metrics()['rejected']
+            response = self.client.post('/api/token/', {'username': 'rider', 'password': 's3cret-pass!'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(hashing.get_metrics()['rejected'], rejected + 1)
+        finally:
+            for _ in range(held):
+                slots.release()
+
+
+# ----------------------------
+# Ride state machine
+# ----------------------------
+class RideTransitionTests(CompletedRideMixin, TestCase):
+    def make_ride(self, ride_status, driver=None):
+        return Ride.objects.create(
+            passenger=self.passenger, driver=driver or self.driver, status=ride_status,
+            pickup_location='A', dropoff_location='B',
+        )
+
+    def test_transition_is_one_conditional_update(self):
+        ride = self.make_ride(RideStatus.ASSIGNED)
+        with CaptureQueriesContext(connection) as ctx:
+            apply_transition(ride, 'accept', as_driver=self.driver)
+        self.assertEqual(len(ctx), 1)
+        sql = ctx.captured_queries[0]['sql']
+        self.assertTrue(sql.startswith('UPDATE'))
+        self.assertNotIn('pickup_location', sql)
+        self.assertEqual(Ride.objects.get(pk=ride.pk).status, RideStatus.ACCEPTED)
+
+    def test_second_accept_is_rejected(self):
+        ride = self.make_ride(RideStatus.ASSIGNED)
+        self.assertEqual(self.client.post(f'/api/rides/{ride.id}/accept_ride/').status_code, 200)
+        response = self.client.post(f'/api/rides/{ride.id}/accept_ride/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Current status: accepted', response.content.decode())
+
+    def test_stale_instance_cannot_skip_ahead(self):
+        ride = self.make_ride(RideStatus.ASSIGNED)
+        Ride.objects.filter(pk=ride.pk).update(status=RideStatus.CANCELLED)
+        with self.assertRaises(IllegalTransition):
+            apply_transition(ride, 'accept', as_driver=self.driver)
+        self.assertEqual(Ride.objects.get(pk=ride.pk).status, RideStatus.CANCELLED)
+
+    def test_other_driver_is_forbidden(self):
+        other_user = User.objects.create(username='other', is_driver=True, is_passenger=False)
+        other = DriverProfile.objects.create(user=other_user, car_model='Golf', car_plate='XY-987')
+        ride = self.make_ride(RideStatus.ACCEPTED, driver=other)
+        with self.assertRaises(PermissionDenied):
+            apply_transition(ride, 'start', as_driver=self.driver)
+        self.assertEqual(Ride.objects.get(pk=ride.pk).status, RideStatus.ACCEPTED)
+
+    def test_driver_is_claimed_once(self):
+        # The first claim takes the available driver; a second, racing one finds them taken
+        self.assertTrue(set_driver_available(self.driver, False))
+        self.assertFalse(set_driver_available(self.driver, False))
+        self.assertFalse(DriverProfile.objects.get(pk=self.driver.pk).is_available)
+        # Freed again, they can be claimed again
+        self.assertTrue(set_driver_available(self.driver, True))
+        self.assertTrue(set_driver_available(self.driver, False))
+
+
+# ----------------------------
+# Idempotency keys
+# ----------------------------
+class IdempotencyTests(CompletedRideMixin, TestCase):
+    ride_body = {
+        'pickup_location': 'A', 'pickup_lat': 40.0, 'pickup_lng': -74.0,
+        'dropoff_location': 'B', 'dropoff_lat': 40.1, 'dropoff_lng': -74.1,
+    }
+
+    def setUp(self):
+        super().setUp()
+        caches['idempotency'].clear()
+
+    def test_retried_create_makes_one_ride(self):
+        self.client.force_authenticate(self.passenger.user)
+        first = self.client.post('/api/rides/', self.ride_body, HTTP_IDEMPOTENCY_KEY='k1')
+        retry = self.client.post('/api/rides/', self.ride_body, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Ride.objects.filter(passenger=self.passenger).count(), 1)
+
+        self.client.post('/api/rides/', self.ride_body, HTTP_IDEMPOTENCY_KEY='k2')
+        self.assertEqual(Ride.objects.filter(passenger=self.passenger).count(), 2)
+
+    def test_key_reused_with_other_body(self):
+        self.client.force_authenticate(self.passenger.user)
+        self.client.post('/api/rides/', self.ride_body, HTTP_IDEMPOTENCY_KEY='k1')
+        response = self.client.post(
+            '/api/rides/', dict(self.ride_body, dropoff_location='C'), HTTP_IDEMPOTENCY_KEY='k1'
+        )
+        self.assertEqual(response.status_code, 422)
+
+    def test_retried_accept_replays(self):
+        ride = Ride.objects.create(
+            passenger=self.passenger, driver=self.driver, status=RideStatus.ASSIGNED,
+            pickup_location='A', dropoff_location='B',
+        )
+        url = f'/api/rides/{ride.id}/accept_ride/'
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='a1').status_code, 200)
+        # Without replay the second accept would be an illegal transition
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='a1').status_code, 200)
+        self.assertEqual(self.client.post(url).status_code, 400)
+
+    def test_retry_racing_lock_release_replays(self):
+        self.client.force_authenticate(self.passenger.user)
+        first = self.client.post('/api/rides/', self.ride_body, HTTP_IDEMPOTENCY_KEY='k1')
+        store = caches['idempotency']
+        real_get = store.get
+        # The retry's first lookup ran just before the first request stored its response
+        misses = [None]
+
+        def get(*args, **kwargs):
+            return misses.pop() if misses else real_get(*args, **kwargs)
+
+        with mock.patch.object(store, 'get', side_effect=get):
+            retry = self.client.post('/api/rides/', self.ride_body, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Ride.objects.filter(passenger=self.passenger).count(), 1)
+
+    def test_in_flight_key_conflicts(self):
+        self.client.force_authenticate(self.passenger.user)
+        user_id = self.passenger.user.pk
+        caches['idempotency'].add(f'idem:{user_id}:POST:/api/rides/:k1:lock', 'x')
+        response = self.client.post('/api/rides/', self.ride_body, HTTP_IDEMPOTENCY_KEY='k1')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Ride.objects.exists())
+
+
+# ----------------------------
+# Rate limits
+# ----------------------------
+@override_settings(RATE_LIMITS={'SCOPES': {'poll': {'RATE': 0.001, 'BURST': 2}}})
+class RateLimitTests(CompletedRideMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+        token = AccessToken.for_user(self.passenger.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_polling_over_burst_gets_429_without_queries(self):
+        self.assertEqual(self.client.get('/api/rides/').status_code, 200)
+        self.assertEqual(self.client.get('/api/rides/').status_code, 200)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/rides/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(ctx), 0)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_buckets_are_per_user_and_scope(self):
+        for _ in range(3):
+            self.client.get('/api/rides/')
+        # Other scopes keep their own bucket
+        self.assertNotEqual(self.client.post('/api/rides/', {}).status_code, 429)
+
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.driver_user)}')
+        self.assertEqual(other.get('/api/rides/').status_code, 200)
+
+    def test_requests_without_token_are_left_to_auth(self):
+        self.client.credentials()
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/rides/').status_code, 401)
+
+
+# ----------------------------
+# Offer expiry
+# ----------------------------
+class TimerWheelTests(TestCase):
+    def run_ticks(self, wheel, ticks):
+        for _ in range(ticks):
+            wheel.tick()
+
+    def test_fires_on_time_across_levels(self):
+        wheel = TimerWheel(tick_seconds=1, slots=4, levels=3)
+        fired = []
+        for delay in (1, 3, 4, 9, 17, 40):
+            wheel.schedule(delay, lambda d=delay: fired.append((d, wheel.now)))
+        self.run_ticks(wheel, 63)
+        self.assertEqual(fired, [(d, d) for d in (1, 3, 4, 9, 17, 40)])
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancel(self):
+        wheel = TimerWheel(tick_seconds=1, slots=4, levels=3)
+        fired = []
+        timer = wheel.schedule(20, fired.append, 'late')
+        wheel.schedule(2, fired.append, 'early')
+        self.assertTrue(wheel.cancel(timer))
+        self.assertFalse(wheel.cancel(timer))
+        self.run_ticks(wheel, 30)
+        self.assertEqual(fired, ['early'])
+
+    def test_rejects_delay_beyond_span(self):
+        with self.assertRaises(ValueError):
+            TimerWheel(tick_seconds=1, slots=4, levels=2).schedule(16, print)
+
+
+@override_settings(RIDE_OFFERS={'ACCEPT_SECONDS': 0})
+class OfferExpiryTests(CompletedRideMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        DriverProfile.objects.filter(pk=self.driver.pk).update(latitude=40.0, longitude=-74.0)
+        other_user = User.objects.create(username='other', is_driver=True, is_passenger=False)
+        self.other = DriverProfile.objects.create(
+            user=other_user, car_model='Golf', car_plate='XY-987', latitude=40.5, longitude=-74.5
+        )
+        self.ride = Ride.objects.create(
+            passenger=self.passenger, pickup_location='A', pickup_lat=40.0, pickup_lng=-74.0,
+            dropoff_location='B', dropoff_lat=40.1, dropoff_lng=-74.1,
+        )
+
+    def test_expired_offer_moves_to_next_driver(self):
+        self.assertEqual(offers.offer_ride(self.ride), self.driver)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(offers.expire_offer(self.ride.id, self.driver.id), self.other)
+
+        ride = Ride.objects.get(pk=self.ride.pk)
+        self.assertEqual((ride.status, ride.driver_id), (RideStatus.ASSIGNED, self.other.id))
+        self.assertTrue(DriverProfile.objects.get(pk=self.driver.pk).is_available)
+        self.assertFalse(DriverProfile.objects.get(pk=self.other.pk).is_available)
+
+        # Nobody left: back to requested
+        self.assertIsNone(offers.expire_offer(self.ride.id, self.other.id, (self.driver.id,)))
+        ride = Ride.objects.get(pk=self.ride.pk)
+        self.assertEqual((ride.status, ride.driver_id), (RideStatus.REQUESTED, None))
+
+    def test_lost_claim_moves_to_next_driver(self):
+        real_claim = offers.set_driver_available
+
+        def claimed_elsewhere(driver, available):
+            # Another request takes the nearest driver between the scan and the claim
+            if driver.pk == self.driver.pk and not available:
+                DriverProfile.objects.filter(pk=driver.pk).update(is_available=False)
+            return real_claim(driver, available)
+
+        lost = offers.metrics['claims_lost']
+        with mock.patch.object(offers, 'set_driver_available', claimed_elsewhere):
+            self.assertEqual(offers.offer_ride(self.ride), self.other)
+        ride = Ride.objects.get(pk=self.ride.pk)
+        self.assertEqual((ride.status, ride.driver_id), (RideStatus.ASSIGNED, self.other.id))
+        self.assertEqual(offers.get_metrics()['claims_lost'], lost + 1)
+
+    def test_accept_beats_expiry(self):
+        offers.offer_ride(self.ride)
+        self.assertEqual(self.client.post(f'/api/rides/{self.ride.id}/accept_ride/').status_code, 200)
+        self.assertIsNone(offers.expire_offer(self.ride.id, self.driver.id))
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).status, RideStatus.ACCEPTED)
+
+    @override_settings(RIDE_OFFERS={'ACCEPT_SECONDS': 5})
+    def test_assignment_schedules_deadline(self):
+        with mock.patch.object(offers, '_get_loop') as get_loop, self.captureOnCommitCallbacks(execute=True):
+            offers.offer_ride(self.ride)
+        get_loop.return_value.call_soon_threadsafe.assert_called_once_with(
+            offers._schedule, self.ride.id, self.driver.id, (), 5
+        )
+
+    def test_cancel_frees_driver_reassigned_by_expiry(self):
+        offers.offer_ride(self.ride)
+        self.client.force_authenticate(self.passenger.user)
+        real_apply = views.apply_transition
+
+        def expire_first(ride, name, *args, **kwargs):
+            # The offer expires between the view loading the ride and cancelling it
+            if name == 'cancel' and not expire_first.done:
+                expire_first.done = True
+                offers.expire_offer(ride.id, self.driver.id)
+            return real_apply(ride, name, *args, **kwargs)
+        expire_first.done = False
+
+        with mock.patch.object(views, 'apply_transition', expire_first):
+            response = self.client.post(f'/api/rides/{self.ride.id}/cancel_ride/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Ride.objects.get(pk=self.ride.pk).status, RideStatus.CANCELLED)
+        self.assertTrue(DriverProfile.objects.get(pk=self.driver.pk).is_available)
+        self.assertTrue(DriverProfile.objects.get(pk=self.other.pk).is_available)
+
+
+# ----------------------------
+# Metrics endpoint
+# ----------------------------
+class MetricsTests(CompletedRideMixin, TestCase):
+    def test_records_route_latency_queries_and_size(self):
+        self.complete_ride()
+        self.client.get('/api/rides/')
+        body = self.client.get('/metrics').content.decode()
+
+        self.assertIn('# TYPE gotaxi_http_request_duration_seconds histogram', body)
+        self.assertIn(
+            'gotaxi_http_request_duration_seconds_count{method="GET",route="ride-list",status="200"}', body
+        )
+        self.assertIn('gotaxi_http_db_queries_bucket{route="ride-complete-ride",le="+Inf"}', body)
+        self.assertIn('gotaxi_http_response_size_bytes_sum{route="ride-list"}', body)
+        self.assertIn('gotaxi_password_hashing_completed', body)
+
+    @override_settings(METRICS={'ALLOWED_IPS': ['10.0.0.5'], 'TOKEN': 's3cret'})
+    def test_scrape_needs_allowed_address_or_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = telemetry.Histogram('test_seconds', 'Test', labels=('route',), buckets=(0.1, 1.0))
+        try:
+            for value in (0.05, 0.5, 5.0):
+                histogram.observe(value, route='x')
+            lines = [telemetry._line(histogram.name + suffix, labels, value)
+                     for suffix, labels, value in histogram.samples()]
+        finally:
+            telemetry.REGISTRY.remove(histogram)
+        self.assertEqual(lines, [
+            'gotaxi_test_seconds_bucket{route="x",le="0.1"} 1',
+            'gotaxi_test_seconds_bucket{route="x",le="1.0"} 2',
+            'gotaxi_test_seconds_bucket{route="x",le="+Inf"} 3',
+            'gotaxi_test_seconds_sum{route="x"} 5.55',
+            'gotaxi_test_seconds_count{route="x"} 3',
+        ])
+
+
+# ----------------------------
+# Tracing
+# ----------------------------
+@override_settings(RIDE_OFFERS={'ACCEPT_SECONDS': 0})
+class TracingTests(CompletedRideMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        DriverProfile.objects.filter(pk=self.driver.pk).update(latitude=40.0, longitude=-74.0)
+        tracing.flush()
+
+    def exported(self, path):
+        tracing.flush()
+        with open(path) as f:
+            return [span for line in f for span in json.loads(line)]
+
+    def test_create_stages_exported_as_zipkin(self):
+        self.client.force_authenticate(self.passenger.user)
+        with tempfile.TemporaryDirectory() as tmp, override_settings(TRACING={
+            'SAMPLE_RATE': 1.0, 'EXPORT_PATH': os.path.join(tmp, 'spans.json'), 'FLUSH_SECONDS': 3600,
+        }):
+            response = self.client.post('/api/rides/', {
+                'pickup_location': 'A', 'pickup_lat': 40.0, 'pickup_lng': -74.0,
+                'dropoff_location': 'B', 'dropoff_lat': 40.1, 'dropoff_lng': -74.1,
+            })
+            self.assertEqual(response.status_code, 201)
+            spans = self.exported(os.path.join(tmp, 'spans.json'))
+
+        by_name = {span['name']: span for span in spans}
+        root = by_name['rides.create']
+        self.assertEqual(root['kind'], 'SERVER')
+        self.assertEqual(root['tags']['http.status_code'], '201')
+        self.assertNotIn('parentId', root)
+        for stage in ('validate', 'create_with_matching', 'insert', 'driver_scan', 'driver_claim',
+                      'assign', 'serialize', 'channel_send'):
+            self.assertIn(stage, by_name)
+            self.assertEqual(by_name[stage]['traceId'], root['traceId'])
+        self.assertEqual(by_name['insert']['parentId'], by_name['create_with_matching']['id'])
+
+    def test_unsampled_requests_record_nothing(self):
+        ride = Ride.objects.create(
+            passenger=self.passenger, driver=self.driver, status=RideStatus.ASSIGNED,
+            pickup_location='A', dropoff_location='B',
+        )
+        spans = tracing.get_metrics()['spans']
+        with override_settings(TRACING={'SAMPLE_RATE': 0.0}):
+            self.client.post(f'/api/rides/{ride.id}/accept_ride/')
+        self.assertEqual(tracing.get_metrics()['spans'], spans)
+
+    def test_errors_are_tagged(self):
+        ride = Ride.objects.create(
+            passenger=self.passenger, driver=self.driver, status=RideStatus.COMPLETED,
+            pickup_location='A', dropoff_location='B',
+        )
+        with tempfile.TemporaryDirectory() as tmp, override_settings(TRACING={
+            'SAMPLE_RATE': 1.0, 'EXPORT_PATH': os.path.join(tmp, 'spans.json'), 'FLUSH_SECONDS': 3600,
+        }):
+            self.assertEqual(self.client.post(f'/api/rides/{ride.id}/start_ride/').status_code, 400)
+            spans = {span['name']: span for span in self.exported(os.path.join(tmp, 'spans.json'))}
+        self.assertEqual(spans['transition']['tags']['error'], 'IllegalTransition')
+        self.assertEqual(spans['rides.start']['tags']['error'], 'IllegalTransition')
+        self.assertEqual(spans['rides.start']['tags']['http.status_code'], '400')
+
+
+# ----------------------------
+# Fare engine
+# ----------------------------
+class FareEngineTests(CompletedRideMixin, TestCase):
+    trips = [(40.0, -74.0, 40.1, -74.1), (37.77, -122.42, 37.62, -122.38), (41.88, -87.63, 41.88, -87.63)]
+
+    def test_default_tariff_matches_legacy_formula(self):
+        for trip in self.trips:
+            legacy = round(5.0 + haversine(*trip) * 1.5, 2)
+            self.assertEqual(fares.quote(*trip).fare, legacy)
+
+    @override_settings(FARE_TARIFF={
+        'PER_MINUTE': 0.5, 'MINIMUM': 8.0,
+        'TIME_OF_DAY': [{'FROM': 22, 'TO': 2, 'MULTIPLIER': 1.5}],
+        'ZONES': [{'NAME': 'sfo', 'LAT': 37.62, 'LNG': -122.38, 'RADIUS_KM': 3, 'MULTIPLIER': 1.25}],
+    })
+    def test_multipliers_minimum_and_batch(self):
+        tariff = fares.get_tariff()
+        self.assertEqual([h for h, m in enumerate(tariff.hour_multipliers) if m == 1.5], [0, 1, 22, 23])
+
+        night = timezone.make_aware(datetime(2024, 1, 1, 23, 30))
+        airport = fares.quote(*self.trips[1], at=night)
+        self.assertAlmostEqual(airport.multiplier, 1.5 * 1.25)
+        expected = (5.0 + 1.5 * airport.distance_km + 0.5 * airport.duration_min) * 1.875
+        self.assertEqual(airport.fare, round(expected, 2))
+        self.assertEqual(fares.quote(*self.trips[2], at=night).fare, 8.0)
+
+        self.assertEqual(fares.quote_batch(self.trips, at=night), [fares.quote(*t, at=night) for t in self.trips])
+
+    def test_quote_endpoint(self):
+        response = self.client.post('/api/rides/quote/', {'trips': [
+            {'pickup_lat': 40.0, 'pickup_lng': -74.0, 'dropoff_lat': 40.1, 'dropoff_lng': -74.1},
+            [37.77, -122.42, 37.62, -122.38],
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        quotes = response.json()['data']['quotes']
+        self.assertEqual([q['fare'] for q in quotes], [fares.quote(*t).fare for t in self.trips[:2]])
+
+        for bad in ([], [[40.0, -74.0, 40.1]], [{'pickup_lat': 91, 'pickup_lng': 0, 'dropoff_lat': 0, 'dropoff_lng': 0}]):
+            response = self.client.post('/api/rides/quote/', {'trips': bad}, format='json')
+            self.assertEqual(response.status_code, 400, bad)
+
+    def test_completion_charges_quoted_fare(self):
+        payment = self.complete_ride()
+        self.assertEqual(float(payment.amount), fares.quote(40.0, -74.0, 40.1, -74.1).fare)
+
+    def test_completion_prices_at_request_time(self):
+        hour = timezone.localtime().hour
+        night = timezone.make_aware(datetime(2024, 1, 1, (hour + 12) % 24, 30))
+        ride = Ride.objects.create(
+            passenger=self.passenger, driver=self.driver, status=RideStatus.IN_PROGRESS,
+            pickup_location='A', pickup_lat=40.0, pickup_lng=-74.0,
+            dropoff_location='B', dropoff_lat=40.1, dropoff_lng=-74.1,
+        )
+        Ride.objects.filter(pk=ride.pk).update(requested_at=night)
+        # Surge only in the hour the ride was requested, not now
+        band = {'FROM': night.hour, 'TO': night.hour + 1, 'MULTIPLIER': 2.0}
+        with self.settings(FARE_TARIFF={'TIME_OF_DAY': [band]}):
+            self.client.post(f'/api/rides/{ride.id}/complete_ride/')
+            expected = fares.quote(40.0, -74.0, 40.1, -74.1, at=night)
+        self.assertEqual(expected.multiplier, 2.0)
+        self.assertEqual(float(Payment.objects.get(ride=ride).amount), expected.fare)
+
+
+# ----------------------------
+# Pre-trip estimates
+# ----------------------------
+class EstimateCacheTests(CompletedRideMixin, TestCase):
+    url = '/api/rides/estimate/?pickup_lat=40.001&pickup_lng=-74.001&dropoff_lat=40.1&dropoff_lng=-74.1'
+
+    def setUp(self):
+        super().setUp()
+        caches['estimates'].clear()
+        self.client.force_authenticate(self.passenger.user)
+
+    def move_driver(self, **changes):
+        self.client.force_authenticate(self.driver_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/rides/update_location/', changes)
+        self.assertEqual(response.status_code, 200)
+        self.client.force_authenticate(self.passenger.user)
+
+    def get_estimate(self, url=None):
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']
+
+    def test_estimate_is_cached_per_cell(self):
+        self.move_driver(latitude=40.008, longitude=-74.005)
+        first = self.get_estimate()
+        self.assertEqual(first['nearby_drivers'], 1)
+        self.assertIsNotNone(first['eta_min'])
+        self.assertEqual(first['fare'], fares.quote(40.005, -74.005, 40.105, -74.095).fare)
+
+        # Another point in the same pickup and dropoff cells
+        with self.assertNumQueries(0):
+            same_cells = self.get_estimate(self.url.replace('40.001', '40.009'))
+        self.assertEqual(same_cells, first)
+
+    def test_material_supply_changes_invalidate(self):
+        self.move_driver(latitude=40.008, longitude=-74.005)
+        self.get_estimate()
+
+        # Moving within the cell keeps the cached estimate
+        self.move_driver(latitude=40.002, longitude=-74.005)
+        with self.assertNumQueries(0):
+            self.get_estimate()
+
+        # Going offline, or driving out of the neighbourhood, does not
+        self.move_driver(is_available=False)
+        self.assertEqual(self.get_estimate()['nearby_drivers'], 0)
+        self.move_driver(is_available=True)
+        self.assertEqual(self.get_estimate()['nearby_drivers'], 1)
+        self.move_driver(latitude=41.0, longitude=-74.005)
+        self.assertIsNone(self.get_estimate()['eta_min'])
+
+    def test_matching_invalidates(self):
+        self.move_driver(latitude=40.008, longitude=-74.005)
+        self.assertEqual(self.get_estimate()['nearby_drivers'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            set_driver_available(self.driver, False)
+        self.assertEqual(self.get_estimate()['nearby_drivers'], 0)
+
+    def test_invalid_coordinates(self):
+        response = self.client.get('/api/rides/estimate/?pickup_lat=95&pickup_lng=0&dropoff_lat=0')
+        self.assertEqual(response.status_code, 400)
+
+
+# ----------------------------
+# Payment settlement
+# ----------------------------
+@override_settings(PAYMENT_SETTLEMENT={'WORKER': False, 'BACKOFF_SECONDS': 10, 'MAX_ATTEMPTS': 3})
+class PaymentSettlementTests(CompletedRideMixin, TestCase):
+    def make_ride(self):
+        return Ride.objects.create(
+            passenger=self.passenger, driver=self.driver, status=RideStatus.IN_PROGRESS,
+            pickup_location='A', pickup_lat=40.0, pickup_lng=-74.0,
+            dropoff_location='B', dropoff_lat=40.1, dropoff_lng=-74.1,
+        )
+
+    def completed_payment(self):
+        """Complete a ride through the API, leaving its payment pending"""
+        ride = self.make_ride()
+        self.assertEqual(self.client.post(f'/api/rides/{ride.id}/complete_ride/').status_code, 200)
+        return Payment.objects.get(ride=ride)
+
+    def test_completion_leaves_payment_pending_until_settled(self):
+        ride = self.make_ride()
+        with mock.patch.object(settlement, 'wake') as wake, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/rides/{ride.id}/complete_ride/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['payment']['payment_status'], 'pending')
+        wake.assert_called_once_with()
+
+        with mock.patch.object(settlement, '_push') as push:
+            self.assertEqual(settlement.settle_due(), 1)
+        payment = Payment.objects.get(ride=ride)
+        self.assertEqual((payment.payment_status, payment.attempts), ('completed', 1))
+        self.assertIsNotNone(payment.paid_at)
+        self.assertTrue(payment.gateway_reference)
+        push.assert_called_once()
+        self.assertEqual(settlement.settle_due(), 0)
+
+    def test_transient_failures_back_off_then_fail(self):
+        payment = self.completed_payment()
+        with self.settings(PAYMENT_SETTLEMENT={
+            'WORKER': False, 'BACKOFF_SECONDS': 10, 'MAX_ATTEMPTS': 3, 'GATEWAY_OPTIONS': {'FAIL': {payment.pk: 5}},
+        }), mock.patch.object(settlement, '_push') as push:
+            now = timezone.now()
+            self.assertEqual(settlement.settle_due(now), 1)
+            payment.refresh_from_db()
+            self.assertEqual((payment.payment_status, payment.attempts), ('pending', 1))
+            self.assertGreaterEqual(payment.next_attempt_at, now + timedelta(seconds=7.5))
+            self.assertEqual(payment.last_error, 'Gateway timeout')
+
+            # Not due yet, then due twice more until out of attempts
+            self.assertEqual(settlement.settle_due(now), 0)
+            self.assertEqual(settlement.settle_due(now + timedelta(seconds=10)), 1)
+            self.assertEqual(settlement.settle_due(now + timedelta(minutes=5)), 1)
+        payment.refresh_from_db()
+        self.assertEqual((payment.payment_status, payment.attempts), ('failed', 3))
+        push.assert_called_once()
+
+    def test_decline_fails_immediately_and_batches_the_rest(self):
+        declined = self.completed_payment()
+        others = []
+        for index in range(3):
+            ride = Ride.objects.create(
+                passenger=self.passenger, driver=self.driver, status=RideStatus.COMPLETED,
+                pickup_location='A', dropoff_location='B',
+            )
+            others.append(settlement.create_pending(ride, Decimal('7.00')))
+
+        with self.settings(PAYMENT_SETTLEMENT={
+            'WORKER': False, 'BATCH_SIZE': 10, 'GATEWAY_OPTIONS': {'DECLINE': [declined.pk]},
+        }), mock.patch.object(settlement, '_push'), \
+                mock.patch.object(settlement.FakeGateway, 'charge', autospec=True,
+                                  side_effect=settlement.FakeGateway.charge) as charge:
+            self.assertEqual(settlement.settle_due(), 4)
+        charge.assert_called_once()
+
+        statuses = dict(Payment.objects.values_list('pk', 'payment_status'))
+        self.assertEqual(statuses[declined.pk], 'failed')
+        self.assertEqual({statuses[p.pk] for p in others}, {'completed'})
+
+    def test_gateway_error_retries_whole_batch(self):
+        payment = self.completed_payment()
+        with mock.patch.object(settlement.FakeGateway, 'charge', side_effect=ConnectionError('timeout')):
+            self.assertEqual(settlement.settle_due(), 1)
+        payment.refresh_from_db()
+        self.assertEqual((payment.payment_status, payment.last_error), ('pending', 'timeout'))
+
+    def test_refund_before_settlement_wins(self):
+        payment = self.completed_payment()
+        refund_payment(payment)
+        self.assertEqual(settlement.settle_due(), 0)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).payment_status, 'refunded')
+
+    def test_charge_landing_after_refund_is_refunded_at_gateway(self):
+        payment = self.completed_payment()
+        gateway = settlement.get_gateway()
+        real_charge = gateway.charge
+
+        def refund_mid_charge(charges):
+            refund_payment(Payment.objects.get(pk=payment.pk))
+            return real_charge(charges)
+
+        with mock.patch.object(gateway, 'charge', side_effect=refund_mid_charge), \
+                mock.patch.object(settlement, '_push') as push:
+            self.assertEqual(settlement.settle_due(), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.payment_status, 'refunded')
+        self.assertIn(payment.gateway_reference, gateway.refunded)
+        self.assertGreaterEqual(settlement.get_metrics()['charged_after_refund'], 1)
+        push.assert_not_called()
+
+    def test_final_failure_reverses_earnings(self):
+        payment = self.completed_payment()
+        self.assertEqual(self.earnings()['total_rides'], 1)
+        with self.settings(PAYMENT_SETTLEMENT={'WORKER': False, 'GATEWAY_OPTIONS': {'DECLINE': [payment.pk]}}), \
+                mock.patch.object(settlement, '_push'):
+            settlement.settle_due()
+        self.assertEqual(Payment.objects.get(pk=payment.pk).payment_status, 'failed')
+        before = self.earnings()
+        self.assertEqual((before['total_rides'], before['total_earnings']), (0, 0))
+
+        # A rebuild agrees, and a failed payment cannot be refunded again
+        rebuild_driver_earnings()
+        self.assertEqual(self.earnings(), before)
+        refund_payment(Payment.objects.get(pk=payment.pk))
+        self.assertEqual(self.earnings(), before)
+
+
+# ----------------------------
+# Websocket send queue
+# ----------------------------
+class OutboundQueueTests(TestCase):
+    def make_queue(self, policy, max_size=2):
+        self.sent = []
+        self.closed_with = []
+
+        async def send(text_data):
+            self.sent.append(text_data)
+
+        async def close(code):
+            self.closed_with.append(code)
+
+        return send_queue.OutboundQueue(send, close, max_size=max_size, policy=policy)
+
+    def put_all(self, queue, *items):
+        async def put():
+            for text, key in items:
+                await queue.put(text, key=key)
+        async_to_sync(put)()
+
+    def test_drop_oldest(self):
+        queue = self.make_queue(send_queue.DROP_OLDEST)
+        before = send_queue.get_metrics()
+        self.put_all(queue, ('a', None), ('b', 'k'), ('c', 'k'))
+        self.assertEqual(list(queue._pending.values()), ['b', 'c'])
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(send_queue.get_metrics()['dropped'] - before['dropped'], 1)
+
+    def test_coalesce_replaces_same_key_only(self):
+        queue = self.make_queue(send_queue.COALESCE, max_size=10)
+        before = send_queue.get_metrics()
+        self.put_all(queue, ('a1', 'a'), ('b1', 'b'), ('a2', 'a'), ('n1', None), ('n2', None))
+        self.assertEqual(list(queue._pending.values()), ['b1', 'a2', 'n1', 'n2'])
+        self.assertEqual(queue.coalesced, 1)
+        after = send_queue.get_metrics()
+        self.assertEqual(after['coalesced'] - before['coalesced'], 1)
+        self.assertEqual(after['queued'] - before['queued'], 4)
+
+    def test_disconnect_closes_slow_consumer(self):
+        queue = self.make_queue(send_queue.DISCONNECT)
+        before = send_queue.get_metrics()
+        self.put_all(queue, ('a', None), ('b', None), ('c', None), ('d', None))
+        self.assertTrue(queue.closed)
+        self.assertEqual(self.closed_with, [send_queue.CLOSE_CODE_SLOW_CONSUMER])
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(send_queue.get_metrics()['disconnected'] - before['disconnected'], 1)
+
+    def test_drains_in_order(self):
+        queue = self.make_queue(send_queue.COALESCE, max_size=10)
+
+        async def run():
+            queue.start()
+            for text in ('a', 'b', 'c'):
+                await queue.put(text)
+            for _ in range(10):
+                await asyncio.sleep(0)
+            await queue.stop()
+        before = send_queue.get_metrics()
+        async_to_sync(run)()
+        self.assertEqual(self.sent, ['a', 'b', 'c'])
+        after = send_queue.get_metrics()
+        self.assertEqual(after['sent'] - before['sent'], 3)
+        self.assertEqual((after['queued'], after['open_queues']), (before['queued'], before['open_queues']))
+
+    def test_send_error_closes_connection(self):
+        queue = self.make_queue(send_queue.COALESCE, max_size=10)
+        closed = []
+
+        async def send(text_data):
+            raise ConnectionResetError("gone")
+
+        async def close(code=None):
+            closed.append(code)
+        queue.send, queue.close = send, close
+
+        async def run():
+            queue.start()
+            await queue.put('a')
+            for _ in range(10):
+                await asyncio.sleep(0)
+            done = queue._task.done()
+            await queue.stop()
+            return done
+        self.assertTrue(async_to_sync(run)())
+        self.assertTrue(queue.closed)
+        self.assertEqual(closed, [None])
+
+    def test_ride_consumer_keeps_different_events(self):
+        consumer = RideConsumer()
+        consumer.outbox = queue = self.make_queue(send_queue.COALESCE, max_size=10)
+
+        async def run():
+            for event, data in (('ride_accepted', {'status': 'accepted'}),
+                                ('ride_completed', {'status': 'completed', 'amount': 9.5}),
+                                ('payment_settled', {'status': 'completed', 'payment': {}}),
+                                ('ride_accepted', {'status': 'accepted', 'again': True})):
+                await consumer.ride_update({'type': 'ride_update', 'event': event, 'ride': data})
+        async_to_sync(run)()
+        events = [json.loads(text)['ride'] for text in queue._pending.values()]
+        # Delivered in the order they were last queued
+        self.assertEqual([e['status'] for e in events], ['completed', 'completed', 'accepted'])
+        self.assertEqual(events[0]['amount'], 9.5)
+        self.assertTrue(events[2]['again'])
+
+    def test_ride_consumer_never_coalesces_untyped_messages(self):
+        consumer = RideConsumer()
+        consumer.outbox = queue = self.make_queue(send_queue.COALESCE, max_size=10)
+
+        async def run():
+            for i in range(3):
+                await consumer.ride_update({'type': 'ride_update', 'ride': {'seq': i}})
+        async_to_sync(run)()
+        self.assertEqual([json.loads(text)['ride']['seq'] for text in queue._pending.values()], [0, 1, 2])
@@ -0,0 +1,131 @@
+import asyncio
+import math
+import time
+
+
+class Timer:
+    """Handle returned by TimerWheel.schedule(); pass it to cancel()"""
+    __slots__ = ('expires', 'callback', 'args', 'slot')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        # The set this timer currently sits in; None once fired or cancelled
+        self.slot = None
+
+    @property
+    def active(self):
+        return self.slot is not None
+
+
+# ----------------------------
+# Wheel
+# ----------------------------
+class TimerWheel:
+    """
+    Hierarchical timing wheel: O(1) schedule and cancel for many timers.
+
+    Level 0 has one slot per tick; each level above covers SLOTS times
+    the span of the one below. A timer goes into the lowest level whose
+    span covers its delay and is cascaded down a level each time the
+    wheel reaches its slot, so firing never scans pending timers. Delays
+    are rounded up to whole ticks and a timer never fires early.
+
+    tick() advances one tick and runs due callbacks synchronously; run()
+    drives it from the event loop clock.
+    """
+
+    def __init__(self, tick_seconds=0.25, slots=64, levels=4):
+        self.tick_seconds = tick_seconds
+        self.slots = slots
+        self.levels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.now = 0
+        self.pending = 0
+        self._task = None
+
+    def __len__(self):
+        return self.pending
+
+    @property
+    def max_delay(self):
+        return self.tick_seconds * (self.slots ** len(self.levels) - 1)
+
+    def schedule(self, delay, callback, *args):
+        """Call callback(*args) after delay seconds"""
+        if delay > self.max_delay:
+            raise ValueError(f"Delay {delay}s exceeds the wheel span of {self.max_delay}s")
+        ticks = max(1, math.ceil(delay / self.tick_seconds))
+        timer = Timer(self.now + ticks, callback, args)
+        self._insert(timer)
+        self.pending += 1
+        return timer
+
+    def cancel(self, timer):
+        """Drop a pending timer; no-op if it already fired or was cancelled"""
+        if timer.slot is None:
+            return False
+        timer.slot.discard(timer)
+        timer.slot = None
+        self.pending -= 1
+        return True
+
+    def _insert(self, timer):
+        delta = timer.expires - self.now
+        span = self.slots
+        for level in self.levels:
+            if delta < span:
+                slot = level[(timer.expires // (span // self.slots)) % self.slots]
+                slot.add(timer)
+                timer.slot = slot
+                return
+            span *= self.slots
+
+    def tick(self):
+        """Advance one tick and fire everything due; returns the number fired"""
+        self.now += 1
+        # Cascade higher levels whose slot boundary we just crossed
+        span = self.slots
+        for level in self.levels[1:]:
+            if self.now % span:
+                break
+            slot = level[(self.now // span) % self.slots]
+            timers = list(slot)
+            slot.clear()
+            for timer in timers:
+                self._insert(timer)
+            span *= self.slots
+
+        slot = self.levels[0][self.now % self.slots]
+        due = list(slot)
+        slot.clear()
+        for timer in due:
+            timer.slot = None
+            self.pending -= 1
+            timer.callback(*timer.args)
+        return len(due)
+
+    # ----------------------------
+    # Event loop driver
+    # ----------------------------
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run(self):
+        """Tick in step with the clock, catching up after a slow callback"""
+        started = time.monotonic()
+        while True:
+            target = started + (self.now + 1) * self.tick_seconds
+            await asyncio.sleep(max(0.0, target - time.monotonic()))
+            while started + (self.now + 1) * self.tick_seconds <= time.monotonic():
+                self.tick()
@@ -0,0 +1,242 @@
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied as DjangoPermissionDenied
+from django.http import Http404
+
+DEFAULTS = {
+    # Fraction of requests traced; the rest pay one random() call
+    'SAMPLE_RATE': 0.01,
+    # Finished spans kept in memory until exported; oldest dropped beyond this
+    'BUFFER_SIZE': 4096,
+    # Seconds between exports
+    'FLUSH_SECONDS': 5.0,
+    # Append each batch as one Zipkin v2 JSON array per line
+    'EXPORT_PATH': None,
+    # Or POST batches to a Zipkin-compatible collector, e.g.
+    # http://localhost:9411/api/v2/spans (Zipkin, Jaeger, OTel collector)
+    'EXPORT_URL': None,
+    'SERVICE_NAME': 'gotaxi-api',
+}
+
+
+def get_config():
+    """Merge TRACING setting over the defaults"""
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'TRACING', {}))
+    return config
+
+
+# ----------------------------
+# Worker-wide metrics
+# ----------------------------
+metrics = {
+    'sampled_traces': 0,
+    'spans': 0,
+    'dropped': 0,           # buffer full before export
+    'exported': 0,
+    'export_errors': 0,
+}
+
+
+def get_metrics():
+    """Snapshot of the tracing counters for this worker"""
+    snapshot = dict(metrics)
+    snapshot['buffered'] = len(_buffer)
+    return snapshot
+
+
+# ----------------------------
+# Spans
+# ----------------------------
+_current = contextvars.ContextVar('rides_current_span', default=None)
+
+
+def _new_id(bits=64):
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'tags', 'timestamp', '_started', 'duration')
+
+    def __init__(self, trace_id, parent_id, name, kind=None, tags=None):
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.tags = {key: str(value) for key, value in (tags or {}).items()}
+        self.timestamp = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def tag(self, key, value):
+        self.tags[key] = str(value)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+
+    def to_zipkin(self, service_name):
+        """Zipkin v2 JSON span (microsecond timestamps)"""
+        span = {
+            'traceId': self.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': int(self.timestamp * 1_000_000),
+            'duration': max(1, int(self.duration * 1_000_000)),
+            'localEndpoint': {'serviceName': service_name},
+        }
+        if self.parent_id:
+            span['parentId'] = self.parent_id
+        if self.kind:
+            span['kind'] = self.kind
+        if self.tags:
+            span['tags'] = self.tags
+        return span
+
+
+@contextmanager
+def _run(span):
+    token = _current.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.tag('error', type(e).__name__)
+        raise
+    finally:
+        span.finish()
+        _current.reset(token)
+        _record(span)
+
+
+@contextmanager
+def trace(name, **tags):
+    """
+    Root span for one request, sampled at SAMPLE_RATE.
+
+    Yields the span, or None when not sampled; span() calls inside an
+    unsampled trace cost a context variable lookup and nothing else.
+    Nested inside another trace it is an ordinary child span.
+    """
+    parent = _current.get()
+    if parent is not None:
+        with _run(Span(parent.trace_id, parent.span_id, name, tags=tags)) as child:
+            yield child
+        return
+    if random.random() >= get_config()['SAMPLE_RATE']:
+        yield None
+        return
+    metrics['sampled_traces'] += 1
+    with _run(Span(_new_id(128), None, name, kind='SERVER', tags=tags)) as root:
+        yield root
+
+
+@contextmanager
+def span(name, **tags):
+    """Child span of the current one; no-op outside a sampled trace"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _run(Span(parent.trace_id, parent.span_id, name, tags=tags)) as child:
+        yield child
+
+
+def traced(name):
+    """Run a view method under a root trace, tagging method, path and status"""
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            with trace(name, **{'http.method': request.method, 'http.path': request.path}) as root:
+                try:
+                    response = view_method(self, request, *args, **kwargs)
+                except Exception as e:
+                    # The exception handler turns it into the response after the span ends
+                    if root is not None:
+                        root.tag('http.status_code', _status_of(e))
+                    raise
+                if root is not None:
+                    root.tag('http.status_code', response.status_code)
+                return response
+        return wrapper
+    return decorator
+
+
+def _status_of(exc):
+    """The status DRF's exception handler answers exc with"""
+    if isinstance(exc, Http404):
+        return 404
+    if isinstance(exc, DjangoPermissionDenied):
+        return 403
+    return getattr(exc, 'status_code', 500)
+
+
+# ----------------------------
+# Buffer and export
+# ----------------------------
+_buffer = deque()
+_buffer_lock = threading.Lock()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def _record(span):
+    config = get_config()
+    with _buffer_lock:
+        if len(_buffer) >= config['BUFFER_SIZE']:
+            _buffer.popleft()
+            metrics['dropped'] += 1
+        _buffer.append(span)
+    metrics['spans'] += 1
+    if config['EXPORT_PATH'] or config['EXPORT_URL']:
+        _ensure_exporter()
+
+
+def _ensure_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = threading.Thread(target=_export_loop, name='span-exporter', daemon=True)
+            _exporter.start()
+
+
+def _export_loop():
+    while True:
+        time.sleep(get_config()['FLUSH_SECONDS'])
+        flush()
+
+
+def flush():
+    """Export everything buffered now; returns the number of spans exported"""
+    with _buffer_lock:
+        spans = list(_buffer)
+        _buffer.clear()
+    if not spans:
+        return 0
+
+    config = get_config()
+    body = json.dumps([span.to_zipkin(config['SERVICE_NAME']) for span in spans])
+    try:
+        if config['EXPORT_PATH']:
+            with open(config['EXPORT_PATH'], 'a') as f:
+                f.write(body + os.linesep)
+        if config['EXPORT_URL']:
+            request = urllib.request.Request(
+                config['EXPORT_URL'], data=body.encode(), headers={'Content-Type': 'application/json'}
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+    except Exception as e:
+        metrics['export_errors'] += 1
+        print(f"Span export error: {str(e)}")
+        return 0
+    metrics['exported'] += len(spans)
+    return len(spans)
@@ -0,0 +1,119 @@
+from typing import NamedTuple
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied, ValidationError
+
+from . import estimates
+from .models import ACTIVE_RIDE_STATUSES, DriverProfile, Ride, RideStatus
+
+
+class Transition(NamedTuple):
+    sources: tuple
+    target: RideStatus
+    # Only the ride's own driver may apply it
+    driver_only: bool
+    # Shown when the ride is not in a source status
+    error: str
+
+
+# ----------------------------
+# Transition table
+# ----------------------------
+TRANSITIONS = {
+    'assign': Transition(
+        (RideStatus.REQUESTED,), RideStatus.ASSIGNED, False,
+        "Ride cannot be assigned. Current status: {status}",
+    ),
+    'accept': Transition(
+        (RideStatus.ASSIGNED,), RideStatus.ACCEPTED, True,
+        "Ride cannot be accepted. Current status: {status}",
+    ),
+    'start': Transition(
+        (RideStatus.ACCEPTED,), RideStatus.IN_PROGRESS, True,
+        "Ride must be accepted first. Current status: {status}",
+    ),
+    'complete': Transition(
+        (RideStatus.IN_PROGRESS,), RideStatus.COMPLETED, True,
+        "Ride must be in progress. Current status: {status}",
+    ),
+    # Offer deadline passed: back to requested for the next driver
+    'expire': Transition(
+        (RideStatus.ASSIGNED,), RideStatus.REQUESTED, True,
+        "Offer is no longer pending. Current status: {status}",
+    ),
+    'cancel': Transition(
+        (RideStatus.REQUESTED,) + ACTIVE_RIDE_STATUSES, RideStatus.CANCELLED, False,
+        "Cannot cancel ride with status: {status}",
+    ),
+}
+
+
+class IllegalTransition(ValidationError):
+    """The ride was not in a status the transition starts from"""
+
+
+class RideReassigned(APIException):
+    """The ride's driver changed since it was loaded (if_driver_id no longer holds)"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Ride was reassigned; reload it and try again"
+    default_code = 'ride_reassigned'
+
+
+# Sentinel: no condition on the ride's current driver
+ANY_DRIVER = object()
+
+
+# ----------------------------
+# Engine
+# ----------------------------
+def apply_transition(ride, name, as_driver=None, if_driver_id=ANY_DRIVER, **changes):
+    """
+    Move ride along TRANSITIONS[name] with one conditional UPDATE.
+
+    Only status and the given columns are written, and only if the row is
+    still in a source status (and, for driver-only transitions, still
+    assigned to as_driver), so concurrent taps cannot both succeed. The
+    in-memory ride is updated to match and returned. Nothing matched means
+    the transition is illegal: the current row is read once to say why.
+
+    if_driver_id additionally requires the row to still have that driver
+    (None for none), for callers that act on the driver they loaded.
+    """
+    rule = TRANSITIONS[name]
+    values = {'status': rule.target, **changes}
+    rides = Ride.objects.filter(pk=ride.pk, status__in=rule.sources)
+    if rule.driver_only:
+        rides = rides.filter(driver=as_driver)
+    if if_driver_id is not ANY_DRIVER:
+        rides = rides.filter(driver_id=if_driver_id)
+
+    if not rides.update(**values):
+        _raise_illegal(ride.pk, rule, as_driver, if_driver_id)
+
+    for field, value in values.items():
+        setattr(ride, field, value)
+    return ride
+
+
+def _raise_illegal(ride_id, rule, driver, if_driver_id=ANY_DRIVER):
+    current = Ride.objects.filter(pk=ride_id).values_list('status', 'driver_id').first()
+    if current is None:
+        raise NotFound("Ride not found")
+    ride_status, driver_id = current
+    if rule.driver_only and (driver is None or driver_id != driver.pk):
+        raise PermissionDenied("This ride is not assigned to you")
+    if ride_status in rule.sources and if_driver_id is not ANY_DRIVER and driver_id != if_driver_id:
+        raise RideReassigned()
+    raise IllegalTransition(rule.error.format(status=RideStatus(ride_status).code))
+
+
+def set_driver_available(driver, available):
+    """Write only is_available; returns False if it already had that value"""
+    updated = DriverProfile.objects.filter(pk=driver.pk).exclude(is_available=available).update(
+        is_available=available
+    )
+    driver.is_available = available
+    if updated:
+        location = (driver.latitude, driver.longitude)
+        estimates.driver_changed((*location, not available), (*location, available))
+    return bool(updated)
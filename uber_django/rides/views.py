@@ -2,47 +2,85 @@ from rest_framework import viewsets, permissions, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError, PermissionDenied, NotFound
-from math import radians, cos, sin, asin, sqrt
 from django.utils import timezone
-from django.db import models
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.db import models, transaction
 from django.core.paginator import Paginator
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
-from .models import Ride, DriverProfile, PassengerProfile, Payment, User
+from .models import (
+    Ride, RideStatus, ArchivedRide, DriverProfile, PassengerProfile, User
+)
 from .serializers import (
     RideSerializer, DriverLocationSerializer, DriverProfileSerializer,
-    PassengerProfileSerializer, PaymentSerializer
+    PassengerProfileSerializer, PaymentSerializer, FareQuoteSerializer, RideEstimateSerializer
 )
 from .serializers_auth import PassengerRegisterSerializer, DriverRegisterSerializer
+from .fast_serializers import ride_rows, ride_row_position, serialize_ride, serialize_ride_row
+from .pagination import RideCursorPagination
+from .transitions import RideReassigned, apply_transition, set_driver_available
+from .earnings import record_completed_ride, get_earnings_summary
+from . import rollups
+from .db import ReplicaReadMixin
+from . import export as ride_export
+from . import profile_cache
+from . import offers
+from . import fares
+from .fares import haversine  # noqa: F401 - kept importable from here
+from . import estimates
+from . import settlement
+from . import telemetry
+from .tracing import span, traced
+from .idempotency import idempotent
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
 
 # ----------------------------
 # Helpers
 # ----------------------------
-def haversine(lat1, lon1, lat2, lon2):
-    """Calculate distance (km) between two lat/long points."""
-    R = 6371
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    return R * c
-
-
 def send_websocket_update(ride_id, message_type, data):
     """Send WebSocket update to ride group"""
     try:
         channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'ride_{ride_id}',
-            {'type': 'ride_update', 'ride': data}
-        )
+        with span('channel_send', group=f'ride_{ride_id}'):
+            async_to_sync(channel_layer.group_send)(
+                f'ride_{ride_id}',
+                {'type': 'ride_update', 'event': message_type, 'ride': data}
+            )
     except Exception as e:
         print(f"WebSocket error: {str(e)}")  # Log but don't fail
 
 
+def parse_time_range(request, default_days=30):
+    """Read ?from=&to= (ISO date or datetime, UTC if naive); default to the last 30 days"""
+    def parse(name):
+        value = request.query_params.get(name)
+        if not value:
+            return None
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValidationError(f"Invalid '{name}'. Use an ISO date or datetime")
+            moment = datetime.combine(day, time.min)
+        if timezone.is_naive(moment):
+            moment = moment.replace(tzinfo=dt_timezone.utc)
+        return moment
+
+    try:
+        end = parse('to') or timezone.now()
+        start = parse('from') or end - timedelta(days=default_days)
+    except ValueError:
+        raise ValidationError("Invalid 'from'/'to'. Use an ISO date or datetime")
+    if start >= end:
+        raise ValidationError("'from' must be before 'to'")
+    return start, end
+
+
 def get_standardized_response(success=True, message="", data=None, status_code=200):
     """Return standardized response format"""
     return {
@@ -56,17 +94,26 @@ def get_standardized_response(success=True, message="", data=None, status_code=2
 # ----------------------------
 # RideViewSet
 # ----------------------------
-class RideViewSet(viewsets.ModelViewSet):
+class RideViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     authentication_classes = [JWTAuthentication]
-    queryset = Ride.objects.all()
+    replica_actions = ('list', 'retrieve', 'earnings', 'stats')
+    # Everything RideSerializer touches, fetched in the same query
+    queryset = Ride.objects.select_related('passenger__user', 'driver__user', 'payment')
     serializer_class = RideSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = None  # We'll handle manually
+    pagination_class = RideCursorPagination
 
     def get_queryset(self):
+        """Live (hot table) rides for this user"""
+        return self.filter_rides(self.queryset.all())
+
+    def get_archive_queryset(self):
+        """Same filters over rides moved to the archive"""
+        return self.filter_rides(ArchivedRide.objects.select_related('passenger__user', 'driver__user'))
+
+    def filter_rides(self, queryset):
         """Filter rides based on user role and query params"""
         user = self.request.user
-        queryset = Ride.objects.all()
 
         # Passengers see only their rides
         if hasattr(user, 'passenger_profile'):
@@ -78,15 +125,19 @@ class RideViewSet(viewsets.ModelViewSet):
         # Filter by status if provided
         status_filter = self.request.query_params.get('status')
         if status_filter:
-            valid_statuses = ['requested', 'assigned', 'accepted', 'on_the_way', 'in_progress', 'completed', 'cancelled']
-            if status_filter not in valid_statuses:
+            try:
+                ride_status = RideStatus.from_code(status_filter)
+            except ValueError:
+                valid_statuses = [s.code for s in RideStatus]
                 raise ValidationError(f"Invalid status. Must be one of: {', '.join(valid_statuses)}")
-            queryset = queryset.filter(status=status_filter)
+            queryset = queryset.filter(status=ride_status)
 
-        # Sort by newest first
-        queryset = queryset.order_by('-requested_at')
+        # Sort by newest first (id breaks ties for a stable cursor)
+        queryset = queryset.order_by('-requested_at', '-id')
         return queryset
 
+    @traced('rides.create')
+    @idempotent
     def create(self, request, *args, **kwargs):
         """Create ride - return 201"""
 
@@ -96,8 +147,9 @@ class RideViewSet(viewsets.ModelViewSet):
         print(f" Has passenger_profile: {hasattr(request.user, 'passenger_profile')}")
         if hasattr(request.user, 'passenger_profile'):
             print(f"Profile ID: {request.user.passenger_profile}")
-        serializer = self.get_serializer(data=request.data, context={'request': request})
-        serializer.is_valid(raise_exception=True)
+        with span('validate'):
+            serializer = self.get_serializer(data=request.data, context={'request': request})
+            serializer.is_valid(raise_exception=True)
         
         # Check user is passenger
         if not hasattr(request.user, 'passenger_profile'):
@@ -111,7 +163,8 @@ class RideViewSet(viewsets.ModelViewSet):
             )
 
         # Perform create with driver matching
-        ride = self._perform_create_with_matching(serializer)
+        with span('create_with_matching'):
+            ride = self._perform_create_with_matching(serializer)
 
         #if ride.driver:
             #from channels.layers import get_channel_layer
@@ -130,86 +183,112 @@ class RideViewSet(viewsets.ModelViewSet):
             get_standardized_response(
             success=True,
             message="Ride created successfully",
-            data=RideSerializer(ride).data,
+            data=self._serialize(ride),
             status_code=201
             ),
             status=status.HTTP_201_CREATED
         )
 
     def list(self, request, *args, **kwargs):
-        """List rides - rerturn 200"""
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(
-            get_standardized_response(
-                success=True,
-                message="Rides retrieved successfully",
-                data=serializer.data,
-                status_code=200
-            )
+        """List rides, one cursor page at a time - return 200"""
+        page = self.paginator.paginate_querysets(
+            [ride_rows(self.get_queryset()), ride_rows(self.get_archive_queryset())],
+            request, view=self, position=ride_row_position
+        )
+        response_data = get_standardized_response(
+            success=True,
+            message="Rides retrieved successfully",
+            data=[serialize_ride_row(row) for row in page],
+            status_code=200
         )
+        response_data['pagination'] = self.paginator.get_pagination_data()
+        return Response(response_data)
     
     
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a ride from the hot table, falling back to the archive"""
+        try:
+            kwargs['pk'] = int(kwargs['pk'])
+        except (TypeError, ValueError):
+            raise Http404
+        for queryset in (self.get_queryset(), self.get_archive_queryset()):
+            row = ride_rows(queryset.filter(pk=kwargs['pk'])).first()
+            if row is not None:
+                return Response(serialize_ride_row(row))
+        raise Http404
+
+    def _serialize(self, ride):
+        with span('serialize'):
+            return serialize_ride(ride)
+
     def _perform_create_with_matching(self, serializer):
         """Create ride and auto-match nearest driver"""
-        ride = serializer.save()
-        
-        # Find nearest available driver
-        nearest_driver = self._find_nearest_driver(
-            ride.pickup_lat,
-            ride.pickup_lng
-        )
-        
-        if nearest_driver:
-            # Assign driver
-            ride.driver = nearest_driver
-            nearest_driver.is_available = False
-            nearest_driver.save()
-            ride.status = "assigned"
-            ride.save()
-            
-            print(f" Sending to driver_{nearest_driver.id}")
-            # Broadcast to the specific driver via WebSocket
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"driver_{nearest_driver.id}",  # Only assigned driver
-                {
-                    "type": "ride_update",
-                    "ride": RideSerializer(ride).data,
-                    }
-            )
-            print(f" Sent to driver_{nearest_driver.id}")
-        else:
-            # No driver available, keep in requested state
-            send_websocket_update(
-                ride.id,
-                'no_driver',
-                {'status': 'requested', 'message': 'No drivers available'}
-            )
-        return ride
+        with span('insert'):
+            ride = serializer.save()
 
+        # Offer to the nearest available driver; re-offered if they don't accept in time
+        offers.offer_ride(ride)
+        return ride
 
-    def _find_nearest_driver(self, pickup_lat, pickup_lng):
-        """Find nearest available driver using Haversine"""
-        available_drivers = DriverProfile.objects.filter(
-            is_available=True,
-            latitude__isnull=False,
-            longitude__isnull=False
+    @action(detail=False, methods=['post'])
+    def quote(self, request):
+        """Price up to 500 pickup/dropoff pairs in one call - return 200"""
+        serializer = FareQuoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quotes = fares.quote_batch(
+            serializer.validated_data['trips'], at=serializer.validated_data.get('at')
+        )
+        return Response(
+            get_standardized_response(
+                success=True,
+                message="Fares quoted",
+                data={
+                    'quotes': [
+                        {
+                            'distance_km': round(q.distance_km, 2),
+                            'duration_min': round(q.duration_min, 1),
+                            'multiplier': round(q.multiplier, 3),
+                            'fare': q.fare,
+                        }
+                        for q in quotes
+                    ],
+                },
+                status_code=200
+            ),
+            status=status.HTTP_200_OK
         )
 
-        if not available_drivers.exists():
-            return None
+    @action(detail=False, methods=['get'])
+    def estimate(self, request):
+        """
+        Nearest-car ETA and fare before booking - return 200.
+
+        Answers are shared per pickup and dropoff grid cell for a few
+        seconds (see estimates), so browsing the map mostly costs two cache
+        reads. JSON is cached encoded; the browsable API renders as usual.
+        """
+        serializer = RideEstimateSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        point = serializer.validated_data
+        trip = (point['pickup_lat'], point['pickup_lng'], point['dropoff_lat'], point['dropoff_lng'])
+
+        def payload(data):
+            return get_standardized_response(
+                success=True,
+                message="Estimate retrieved",
+                data=data,
+                status_code=200
+            )
 
-        nearest_driver = None
-        min_distance = float('inf')
+        renderer = request.accepted_renderer
+        if renderer.format != 'json':
+            return Response(payload(estimates.estimate(*trip)), status=status.HTTP_200_OK)
 
-        for driver in available_drivers:
-            distance = haversine(pickup_lat, pickup_lng, driver.latitude, driver.longitude)
-            if distance < min_distance:
-                min_distance = distance
-                nearest_driver = driver
+        def render(data):
+            return renderer.render(payload(data), renderer.media_type, self.get_renderer_context())
 
-        return nearest_driver
+        body = estimates.fetch(*trip, render)
+        return HttpResponse(body, content_type=renderer.media_type, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['post'])
     def update_location(self, request):
@@ -232,7 +311,10 @@ class RideViewSet(viewsets.ModelViewSet):
             partial=True
         )
         serializer.is_valid(raise_exception=True)
+        before = estimates.supply_of(driver_profile)
         serializer.save()
+        profile_cache.invalidate(request.user.id)
+        estimates.driver_changed(before, estimates.supply_of(driver_profile))
 
         return Response(
             get_standardized_response(
@@ -245,9 +327,12 @@ class RideViewSet(viewsets.ModelViewSet):
         )
 
     @action(detail=True, methods=['post'])
+    @traced('rides.accept')
+    @idempotent
     def accept_ride(self, request, pk=None):
         """Driver accepts ride - return 200"""
-        ride = self.get_object()
+        with span('load'):
+            ride = self.get_object()
 
         # Verify driver
         try:
@@ -255,17 +340,9 @@ class RideViewSet(viewsets.ModelViewSet):
         except:
             raise PermissionDenied("Only drivers can accept rides")
 
-        # Validate ride state
-        if ride.status != "assigned":
-            raise ValidationError(
-                f"Ride cannot be accepted. Current status: {ride.status}"
-            )
-
-        if ride.driver != driver_profile:
-            raise PermissionDenied("This ride is not assigned to you")
-
-        ride.status = "accepted"
-        ride.save()
+        with span('transition'):
+            apply_transition(ride, 'accept', as_driver=driver_profile)
+        offers.cancel_offer(ride.id)
 
         send_websocket_update(
             ride.id,
@@ -277,32 +354,27 @@ class RideViewSet(viewsets.ModelViewSet):
             get_standardized_response(
                 success=True,
                 message="Ride accepted successfully",
-                data=RideSerializer(ride).data,
+                data=self._serialize(ride),
                 status_code=200
             ),
             status=status.HTTP_200_OK
         )
 
     @action(detail=True, methods=['post'])
+    @traced('rides.start')
+    @idempotent
     def start_ride(self, request, pk=None):
         """Driver starts ride - return 200"""
-        ride = self.get_object()
+        with span('load'):
+            ride = self.get_object()
 
         try:
             driver_profile = request.user.driver_profile
         except:
             raise PermissionDenied("Only drivers can start rides")
 
-        if ride.driver != driver_profile:
-            raise PermissionDenied("This ride is not assigned to you")
-
-        if ride.status != "accepted":
-            raise ValidationError(
-                f"Ride must be accepted first. Current status: {ride.status}"
-            )
-
-        ride.status = "in_progress"
-        ride.save()
+        with span('transition'):
+            apply_transition(ride, 'start', as_driver=driver_profile)
 
         send_websocket_update(
             ride.id,
@@ -314,56 +386,50 @@ class RideViewSet(viewsets.ModelViewSet):
             get_standardized_response(
                 success=True,
                 message="Ride started successfully",
-                data=RideSerializer(ride).data,
+                data=self._serialize(ride),
                 status_code=200
             ),
             status=status.HTTP_200_OK
         )
 
     @action(detail=True, methods=['post'])
+    @traced('rides.complete')
+    @idempotent
     def complete_ride(self, request, pk=None):
         """Driver completes ride, calculate fare - return 200"""
-        ride = self.get_object()
+        with span('load'):
+            ride = self.get_object()
 
         try:
             driver_profile = request.user.driver_profile
         except:
             raise PermissionDenied("Only drivers can complete rides")
 
-        if ride.driver != driver_profile:
-            raise PermissionDenied("This ride is not assigned to you")
-
-        if ride.status != "in_progress":
-            raise ValidationError(
-                f"Ride must be in progress. Current status: {ride.status}"
-            )
-
         # Calculate fare
-        distance = haversine(
+        # Priced as of the request, like the quote and estimate the passenger saw
+        quote = fares.quote(
             ride.pickup_lat,
             ride.pickup_lng,
             ride.dropoff_lat,
-            ride.dropoff_lng
-        )
-        amount = round(5.0 + (distance * 1.5), 2)
-
-        # Update ride
-        ride.status = "completed"
-        ride.completed_at = timezone.now()
-        ride.fare = amount
-        ride.save()
-
-        # Create payment
-        payment = Payment.objects.create(
-            ride=ride,
-            amount=amount,
-            payment_status="completed",
-            paid_at=timezone.now()
+            ride.dropoff_lng,
+            at=ride.requested_at
         )
+        distance, amount = quote.distance_km, quote.fare
+
+        with span('settle'), transaction.atomic():
+            # Update ride
+            apply_transition(
+                ride, 'complete', as_driver=driver_profile, completed_at=timezone.now(), fare=amount
+            )
+
+            # Charged later by the settlement worker, which pushes the outcome
+            payment = settlement.create_pending(ride, amount)
+            record_completed_ride(payment)
+            rollups.record_completion(ride, payment)
 
-        # Free up driver
-        driver_profile.is_available = True
-        driver_profile.save()
+            # Free up driver
+            set_driver_available(driver_profile, True)
+            profile_cache.invalidate(driver_profile.user_id)
 
         send_websocket_update(
             ride.id,
@@ -375,7 +441,7 @@ class RideViewSet(viewsets.ModelViewSet):
             }
         )
 
-        response_data = RideSerializer(ride).data
+        response_data = self._serialize(ride)
         response_data['payment'] = PaymentSerializer(payment).data
 
         return Response(
@@ -389,37 +455,46 @@ class RideViewSet(viewsets.ModelViewSet):
         )
 
     @action(detail=True, methods=['post'])
+    @traced('rides.cancel')
+    @idempotent
     def cancel_ride(self, request, pk=None):
         """Cancel ride - return 200"""
-        ride = self.get_object()
         user = request.user
+        for attempt in range(3):
+            with span('load'):
+                ride = self.get_object()
+
+            # Check authorization
+            is_passenger = hasattr(user, 'passenger_profile') and ride.passenger == user.passenger_profile
+            is_driver = hasattr(user, 'driver_profile') and ride.driver == user.driver_profile
+
+            if not (is_passenger or is_driver):
+                raise PermissionDenied("You are not authorized to cancel this ride")
+
+            # Only cancel the ride as loaded: an offer expiry may have handed
+            # it to another driver since, and that is the driver to free
+            try:
+                with span('transition'), transaction.atomic():
+                    apply_transition(ride, 'cancel', if_driver_id=ride.driver_id)
+                    offers.cancel_offer(ride.id)
+                    rollups.record_cancellation(ride)
+
+                    # Free up driver if assigned
+                    if ride.driver:
+                        set_driver_available(ride.driver, True)
+                        profile_cache.invalidate(ride.driver.user_id)
+                break
+            except RideReassigned:
+                if attempt == 2:
+                    raise
 
-        # Check authorization
-        is_passenger = hasattr(user, 'passenger_profile') and ride.passenger == user.passenger_profile
-        is_driver = hasattr(user, 'driver_profile') and ride.driver == user.driver_profile
-
-        if not (is_passenger or is_driver):
-            raise PermissionDenied("You are not authorized to cancel this ride")
-
-        if ride.status in ["completed", "cancelled"]:
-            raise ValidationError(
-                f"Cannot cancel ride with status: {ride.status}"
-            )
-
-        ride.status = "cancelled"
-        ride.save()
-
-        # Free up driver if assigned
         if ride.driver:
-            ride.driver.is_available = True
-            ride.driver.save()
-
             channel_layer = get_channel_layer()
             async_to_sync(channel_layer.group_send)(
                 f"driver_{ride.driver.id}",
                 {
                     "type": "ride_update",
-                    "ride": RideSerializer(ride).data
+                    "ride": serialize_ride(ride)
                 }
             )
 
@@ -433,7 +508,7 @@ class RideViewSet(viewsets.ModelViewSet):
             get_standardized_response(
                 success=True,
                 message="Ride cancelled successfully",
-                data=RideSerializer(ride).data,
+                data=serialize_ride(ride),
                 status_code=200
             ),
             status=status.HTTP_200_OK
@@ -441,26 +516,21 @@ class RideViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def earnings(self, request):
-        """Get driver earnings - return 200"""
-        try:
-            driver_profile = request.user.driver_profile
-        except:
-            raise PermissionDenied("Only drivers can view earnings")
-
-        completed_rides = Ride.objects.filter(
-            driver=driver_profile,
-            status="completed"
-        )
+        """Get driver earnings totals, or ?granularity=hour|day|week|hour_of_day buckets - return 200"""
+        if request.query_params.get('granularity'):
+            return self._earnings_series(request)
 
-        total_earnings = Payment.objects.filter(
-            ride__in=completed_rides
-        ).aggregate(total=models.Sum('amount'))['total'] or 0
+        summary = get_earnings_summary(request.user)
+        if summary is None:
+            raise PermissionDenied("Only drivers can view earnings")
 
+        total_rides = summary['ride_count']
+        total_earnings = summary['total_amount']
         earnings_data = {
-            "total_rides": completed_rides.count(),
+            "total_rides": total_rides,
             "total_earnings": round(total_earnings, 2),
             "average_per_ride": round(
-                total_earnings / completed_rides.count() if completed_rides.count() > 0 else 0,
+                total_earnings / total_rides if total_rides > 0 else 0,
                 2
             )
         }
@@ -476,12 +546,112 @@ class RideViewSet(viewsets.ModelViewSet):
         )
 
 
+    def _earnings_series(self, request):
+        try:
+            driver_profile = request.user.driver_profile
+        except DriverProfile.DoesNotExist:
+            raise PermissionDenied("Only drivers can view earnings")
+
+        granularity = request.query_params['granularity']
+        if granularity not in rollups.GRANULARITIES:
+            raise ValidationError(f"Invalid granularity. Must be one of: {', '.join(rollups.GRANULARITIES)}")
+        start, end = parse_time_range(request)
+
+        return Response(
+            get_standardized_response(
+                success=True,
+                message="Earnings retrieved successfully",
+                data={
+                    "granularity": granularity,
+                    "from": start,
+                    "to": end,
+                    "buckets": rollups.earnings_series(driver_profile.id, granularity, start, end),
+                },
+                status_code=200
+            ),
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Rides per hour by final status (staff only) - return 200"""
+        if not request.user.is_staff:
+            raise PermissionDenied("Only staff can view ride stats")
+        start, end = parse_time_range(request)
+
+        return Response(
+            get_standardized_response(
+                success=True,
+                message="Ride stats retrieved successfully",
+                data={
+                    "from": start,
+                    "to": end,
+                    "buckets": rollups.status_series(start, end),
+                },
+                status_code=200
+            ),
+            status=status.HTTP_200_OK
+        )
+
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream rides joined with payments as ?output=ndjson|csv (staff only)"""
+        if not request.user.is_staff:
+            raise PermissionDenied("Only staff can export rides")
+        export_format = request.query_params.get('output', 'ndjson')
+        if export_format not in ride_export.EXPORT_FORMATS:
+            raise ValidationError(f"Invalid output. Must be one of: {', '.join(ride_export.EXPORT_FORMATS)}")
+        start, end = parse_time_range(request)
+
+        blocks = ride_export.buffered(ride_export.export_lines(export_format, start, end))
+        if isinstance(request._request, ASGIRequest):
+            blocks = ride_export.async_blocks(blocks)
+        response = StreamingHttpResponse(blocks, content_type=ride_export.CONTENT_TYPES[export_format])
+        filename = f"rides_{start:%Y%m%d}_{end:%Y%m%d}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 # ----------------------------
 # Profile endpoints
 # ----------------------------
-class PassengerProfileView(generics.RetrieveUpdateAPIView):
+class CachedProfileMixin:
+    """
+    Serve GET from an encoded per-user cache (see profile_cache).
+
+    Only JSON responses are cached; the browsable API renders as usual.
+    """
+    profile_kind = None
+    retrieved_message = ""
+
+    def retrieve(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if renderer.format != 'json':
+            return Response(self.get_profile_payload(), status=status.HTTP_200_OK)
+
+        def render():
+            return renderer.render(self.get_profile_payload(), renderer.media_type, self.get_renderer_context())
+
+        body = profile_cache.fetch(self.profile_kind, request.user.id, render)
+        return HttpResponse(body, content_type=renderer.media_type, status=status.HTTP_200_OK)
+
+    def get_profile_payload(self):
+        serializer = self.get_serializer(self.get_object())
+        return get_standardized_response(
+            success=True,
+            message=self.retrieved_message,
+            data=serializer.data,
+            status_code=200
+        )
+
+
+class PassengerProfileView(CachedProfileMixin, ReplicaReadMixin, generics.RetrieveUpdateAPIView):
     """GET/PUT /api/passengers/me/ - return 200"""
     authentication_classes = [JWTAuthentication]
+    replica_actions = ('get',)
+    profile_kind = profile_cache.PASSENGER
+    retrieved_message = "Passenger profile retrieved"
     serializer_class = PassengerProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -491,25 +661,13 @@ class PassengerProfileView(generics.RetrieveUpdateAPIView):
         except PassengerProfile.DoesNotExist:
             raise NotFound("Passenger profile not found")
 
-    def retrieve(self, request, *args, **kwargs):
-        profile = self.get_object()
-        serializer = self.get_serializer(profile)
-        return Response(
-            get_standardized_response(
-                success=True,
-                message="Passenger profile retrieved",
-                data=serializer.data,
-                status_code=200
-            ),
-            status=status.HTTP_200_OK
-        )
-
     def update(self, request, *args, **kwargs):
         profile = self.get_object()
         serializer = self.get_serializer(profile, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        
+        profile_cache.invalidate(request.user.id)
+
         return Response(
             get_standardized_response(
                 success=True,
@@ -521,9 +679,12 @@ class PassengerProfileView(generics.RetrieveUpdateAPIView):
         )
 
 
-class DriverProfileView(generics.RetrieveUpdateAPIView):
+class DriverProfileView(CachedProfileMixin, ReplicaReadMixin, generics.RetrieveUpdateAPIView):
     """GET/PUT /api/drivers/me/ - return 200"""
     authentication_classes = [JWTAuthentication]
+    replica_actions = ('get',)
+    profile_kind = profile_cache.DRIVER
+    retrieved_message = "Driver profile retrieved"
     serializer_class = DriverProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -533,25 +694,15 @@ class DriverProfileView(generics.RetrieveUpdateAPIView):
         except DriverProfile.DoesNotExist:
             raise NotFound("Driver profile not found")
 
-    def retrieve(self, request, *args, **kwargs):
-        profile = self.get_object()
-        serializer = self.get_serializer(profile)
-        return Response(
-            get_standardized_response(
-                success=True,
-                message="Driver profile retrieved",
-                data=serializer.data,
-                status_code=200
-            ),
-            status=status.HTTP_200_OK
-        )
-
     def update(self, request, *args, **kwargs):
         profile = self.get_object()
         serializer = self.get_serializer(profile, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
+        before = estimates.supply_of(profile)
         serializer.save()
-        
+        profile_cache.invalidate(request.user.id)
+        estimates.driver_changed(before, estimates.supply_of(profile))
+
         return Response(
             get_standardized_response(
                 success=True,
@@ -607,4 +758,14 @@ class DriverRegisterView(generics.CreateAPIView):
                 status_code=201
             ),
             status=status.HTTP_201_CREATED
-        )
\ No newline at end of file
+        )
+
+
+# ----------------------------
+# Metrics
+# ----------------------------
+def metrics_view(request):
+    """GET /metrics - this worker's metrics in Prometheus text format; 403 unless allowed"""
+    if not telemetry.scrape_allowed(request):
+        return HttpResponse("Forbidden", status=403, content_type='text/plain')
+    return HttpResponse(telemetry.render(), content_type=telemetry.CONTENT_TYPE)
@@ -0,0 +1,491 @@
+"""
+GoTaxi HTTP ride lifecycle load generator
+
+Drives the REST API the way the apps do, over real keep-alive HTTP/1.1
+connections (one per simulated user, plus one for a driver's location
+stream):
+
+  - registers and logs in passengers and drivers through /api/token/
+  - drivers stream update_location on an interval
+  - passengers create rides and poll them until completed
+  - the matched driver runs accept_ride, start_ride, complete_ride
+  - a ride nobody was matched to is cancelled and requested again
+
+Reports throughput and p50/p99 latency per endpoint and compares the run
+with stored baselines (tests/http_load_baseline.json); the exit code is 1
+if any endpoint regressed past the tolerance or no ride completed. Runs
+with other workload arguments than the baseline's are not compared, and
+p99 is only gated for endpoints with at least MIN_P99_SAMPLES requests.
+
+By default it starts daphne on a throwaway file-backed test database.
+With --url it targets an already running server instead (users are
+registered with a unique prefix and left in that database).
+
+Usage (from uber_django/):
+  python tests/http_load.py                     # the baseline's workload
+  python tests/http_load.py --drivers 10 --passengers 10 --rides-per-passenger 3
+  python tests/http_load.py --url http://127.0.0.1:8000
+  python tests/http_load.py --save-baseline      # record this run as the baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'uber_backend.settings')
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'http_load_baseline.json'
+PASSWORD = 'LoadTest123!'
+CENTER = (40.7128, -74.0060)
+# Requests made while provisioning, before the timed lifecycle run
+SETUP_ENDPOINTS = ('register', 'token', 'profile')
+# Only hit when matching found no driver; absence is not a regression
+OPTIONAL_ENDPOINTS = ('cancel',)
+# Arguments that shape the workload; a baseline only compares with runs that match it
+CONFIG_ARGS = ('drivers', 'passengers', 'rides_per_passenger', 'location_interval', 'poll_interval',
+               'retry_delay', 'max_attempts')
+# p99 of fewer samples than this is one or two outliers, not a tail
+MIN_P99_SAMPLES = 100
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def near(center, rng, km=3.0):
+    """Random point within roughly km of center"""
+    lat, lng = center
+    return lat + rng.uniform(-km, km) / 111.0, lng + rng.uniform(-km, km) / 85.0
+
+
+def setup_django():
+    """Configure Django and switch to a fresh file-backed test database"""
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    # daphne serves requests from several threads; an in-memory database
+    # would be shared-cache with table locks, a file gets WAL + busy_timeout
+    test_dir = tempfile.mkdtemp(prefix='http_load_')
+    connection.settings_dict['TEST']['NAME'] = os.path.join(test_dir, 'test.sqlite3')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    return old_name
+
+
+def teardown_django(old_name):
+    from django.db import connection
+    from django.test.utils import teardown_test_environment
+
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    teardown_test_environment()
+
+
+def start_daphne(port):
+    """Run daphne with the project ASGI app in a background thread"""
+    from daphne.server import Server
+    from uber_backend.asgi import application
+
+    server = Server(
+        application,
+        endpoints=[f'tcp:port={port}:interface=127.0.0.1'],
+        signal_handlers=False,
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    return server
+
+
+# ----------------------------
+# HTTP client
+# ----------------------------
+class HTTPConnection:
+    """Minimal keep-alive HTTP/1.1 JSON client on asyncio streams"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None, token=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        headers = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Accept: application/json',
+            f'Content-Length: {len(payload)}',
+        ]
+        if body is not None:
+            headers.append('Content-Type: application/json')
+        if token:
+            headers.append(f'Authorization: Bearer {token}')
+        data = ('\r\n'.join(headers) + '\r\n\r\n').encode() + payload
+
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self.writer.write(data)
+                await self.writer.drain()
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # Server closed an idle keep-alive connection; retry once on a new one
+                await self.close()
+                if attempt:
+                    raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self.reader.read()
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, body
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.reader = self.writer = None
+
+
+# ----------------------------
+# Load run
+# ----------------------------
+class Stats:
+    def __init__(self):
+        self.latencies = {}     # endpoint -> [seconds] for every response
+        self.statuses = {}      # endpoint -> {status: count}
+        self.failures = 0       # transport errors
+        self.rides_completed = 0
+        self.no_driver = 0
+
+    def record(self, endpoint, status, elapsed):
+        self.latencies.setdefault(endpoint, []).append(elapsed)
+        counts = self.statuses.setdefault(endpoint, {})
+        counts[status] = counts.get(status, 0) + 1
+
+
+class User:
+    def __init__(self, host, port, stats, username):
+        self.http = HTTPConnection(host, port)
+        # A keep-alive connection carries one request at a time: location
+        # updates run alongside the ride steps, so they get their own
+        self.location_http = HTTPConnection(host, port)
+        self.stats = stats
+        self.username = username
+        self.token = None
+
+    async def call(self, endpoint, method, path, body=None, http=None):
+        started = time.perf_counter()
+        try:
+            status, raw = await (http or self.http).request(method, path, body, self.token)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self.stats.failures += 1
+            self.stats.record(endpoint, 'error', time.perf_counter() - started)
+            print(f"{endpoint}: {type(e).__name__}: {e}")
+            return None, {}
+        self.stats.record(endpoint, status, time.perf_counter() - started)
+        try:
+            return status, json.loads(raw) if raw else {}
+        except ValueError:
+            return status, {}
+
+    async def register_and_login(self, kind, extra):
+        await self.call('register', 'POST', f'/api/register/{kind}/', {
+            'username': self.username, 'email': f'{self.username}@load.test', 'password': PASSWORD, **extra,
+        })
+        status, body = await self.call('token', 'POST', '/api/token/', {
+            'username': self.username, 'password': PASSWORD,
+        })
+        if status != 200:
+            raise RuntimeError(f"Login failed for {self.username}: {status} {body}")
+        self.token = body['access']
+
+
+async def drive_locations(driver, rng, args, stop):
+    while not stop.is_set():
+        lat, lng = near(CENTER, rng)
+        await driver.call('location', 'POST', '/api/rides/update_location/', {'latitude': lat, 'longitude': lng},
+                          http=driver.location_http)
+        try:
+            await asyncio.wait_for(stop.wait(), args.location_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def drive_rides(driver, inbox):
+    """Run every ride handed to this driver through accept, start, complete"""
+    while True:
+        ride_id, done = await inbox.get()
+        for step in ('accept', 'start', 'complete'):
+            status, _ = await driver.call(step, 'POST', f'/api/rides/{ride_id}/{step}_ride/')
+            if status != 200:
+                break
+        done.set_result(status == 200)
+
+
+async def ride_as_passenger(passenger, rng, args, inboxes, stats):
+    for _ in range(args.rides_per_passenger):
+        for _ in range(args.max_attempts):
+            pickup, dropoff = near(CENTER, rng), near(CENTER, rng, km=10.0)
+            status, body = await passenger.call('create', 'POST', '/api/rides/', {
+                'pickup_location': 'Load pickup', 'pickup_lat': pickup[0], 'pickup_lng': pickup[1],
+                'dropoff_location': 'Load dropoff', 'dropoff_lat': dropoff[0], 'dropoff_lng': dropoff[1],
+            })
+            if status != 201:
+                await asyncio.sleep(args.retry_delay)
+                continue
+            ride = body['data']
+            driver = ride.get('driver') or {}
+            if driver.get('id') not in inboxes:
+                stats.no_driver += 1
+                await passenger.call('cancel', 'POST', f"/api/rides/{ride['id']}/cancel_ride/")
+                await asyncio.sleep(args.retry_delay)
+                continue
+
+            done = asyncio.get_running_loop().create_future()
+            await inboxes[driver['id']].put((ride['id'], done))
+            # Poll the ride like the app does until the driver finishes
+            while not done.done():
+                await passenger.call('poll', 'GET', f"/api/rides/{ride['id']}/")
+                try:
+                    await asyncio.wait_for(asyncio.shield(done), args.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if done.result():
+                stats.rides_completed += 1
+            break
+
+
+async def run(args, host, port):
+    stats = Stats()
+    rng = random.Random(args.seed)
+    prefix = f'lt{int(time.time())}_'
+    drivers = [User(host, port, stats, f'{prefix}driver_{i}') for i in range(args.drivers)]
+    passengers = [User(host, port, stats, f'{prefix}passenger_{i}') for i in range(args.passengers)]
+
+    print(f"Registering and logging in {len(drivers)} drivers and {len(passengers)} passengers...")
+    setup_started = time.perf_counter()
+    semaphore = asyncio.Semaphore(args.login_concurrency)
+
+    async def login(user, kind, extra):
+        async with semaphore:
+            await user.register_and_login(kind, extra)
+
+    await asyncio.gather(
+        *(login(d, 'driver', {'car_model': 'Load Test', 'car_plate': f'LT-{i}'}) for i, d in enumerate(drivers)),
+        *(login(p, 'passenger', {}) for p in passengers),
+    )
+
+    # Matched rides name the driver by profile id
+    inboxes = {}
+    for driver in drivers:
+        _, body = await driver.call('profile', 'GET', '/api/drivers/me/')
+        inboxes[body['data']['id']] = asyncio.Queue()
+    by_profile = dict(zip(inboxes, drivers))
+    setup_elapsed = time.perf_counter() - setup_started
+
+    print(f"Driving {args.passengers * args.rides_per_passenger} rides...")
+    stop = asyncio.Event()
+    started = time.perf_counter()
+    background = [asyncio.create_task(drive_locations(d, random.Random(rng.random()), args, stop)) for d in drivers]
+    # Let every driver report a position before the first request
+    await asyncio.sleep(min(1.0, args.location_interval))
+    background += [asyncio.create_task(drive_rides(by_profile[pid], inbox)) for pid, inbox in inboxes.items()]
+
+    await asyncio.gather(*(
+        ride_as_passenger(p, random.Random(rng.random()), args, inboxes, stats) for p in passengers
+    ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await asyncio.gather(*(http.close() for u in drivers + passengers for http in (u.http, u.location_http)))
+    return stats, setup_elapsed, elapsed
+
+
+# ----------------------------
+# Report and baselines
+# ----------------------------
+def summarize(stats, setup_elapsed, elapsed):
+    endpoints = {}
+    for name, latencies in stats.latencies.items():
+        window = setup_elapsed if name in SETUP_ENDPOINTS else elapsed
+        counts = stats.statuses[name]
+        total = sum(counts.values())
+        errors = sum(n for code, n in counts.items() if code == 'error' or code >= 500)
+        endpoints[name] = {
+            'requests': total,
+            'rps': round(total / window, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'error_rate': round(errors / total, 4),
+            'throttled': counts.get(429, 0),
+        }
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'rides_completed': stats.rides_completed,
+        'rides_per_s': round(stats.rides_completed / elapsed, 3),
+        'endpoints': endpoints,
+    }
+
+
+def print_report(summary, stats):
+    print("")
+    print("=== HTTP lifecycle load test ===")
+    print(f"{'endpoint':<10} {'requests':>8} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'5xx/err':>8} {'429':>5}")
+    for name, row in sorted(summary['endpoints'].items()):
+        print(f"{name:<10} {row['requests']:>8} {row['rps']:>8.1f} {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f} "
+              f"{row['error_rate']:>8.2%} {row['throttled']:>5}")
+    print(f"rides:      {summary['rides_completed']} completed in {summary['elapsed_s']}s "
+          f"({summary['rides_per_s']}/s), {stats.no_driver} requests found no driver")
+    for name in sorted(stats.statuses):
+        print(f"  {name}: {dict(sorted(stats.statuses[name].items(), key=str))}")
+
+
+def compare(summary, baseline, tolerance):
+    """List of regressions of summary against baseline"""
+    regressions = []
+    for name, base in baseline['endpoints'].items():
+        row = summary['endpoints'].get(name)
+        if row is None:
+            if name in OPTIONAL_ENDPOINTS:
+                continue
+            regressions.append(f"{name}: no requests made")
+            continue
+        metrics = ('p50_ms', 'p99_ms')
+        if min(row['requests'], base['requests']) < MIN_P99_SAMPLES:
+            metrics = ('p50_ms',)
+        for metric in metrics:
+            # Sub-millisecond noise is not a regression
+            limit = max(base[metric] * (1 + tolerance), base[metric] + 1.0)
+            if row[metric] > limit:
+                regressions.append(f"{name}: {metric} {row[metric]} > {limit:.2f} (baseline {base[metric]})")
+        if row['error_rate'] > base['error_rate'] + 0.01:
+            regressions.append(f"{name}: error rate {row['error_rate']:.2%} (baseline {base['error_rate']:.2%})")
+    floor = baseline['rides_per_s'] * (1 - tolerance)
+    if summary['rides_per_s'] < floor:
+        regressions.append(f"rides/s {summary['rides_per_s']} < {floor:.3f} (baseline {baseline['rides_per_s']})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP ride lifecycle load generator")
+    parser.add_argument('--url', help="target a running server instead of starting daphne")
+    parser.add_argument('--port', type=int, default=8766, help="port for the built-in daphne")
+    # Enough rides for a p99 per endpoint; more passengers rather than more
+    # rides each, which would mostly measure the create rate limit
+    parser.add_argument('--drivers', type=int, default=30)
+    parser.add_argument('--passengers', type=int, default=30)
+    parser.add_argument('--rides-per-passenger', type=int, default=5)
+    parser.add_argument('--location-interval', type=float, default=2.0,
+                        help="seconds between a driver's location updates")
+    parser.add_argument('--poll-interval', type=float, default=1.0,
+                        help="seconds between a passenger's ride polls")
+    parser.add_argument('--retry-delay', type=float, default=1.0)
+    parser.add_argument('--max-attempts', type=int, default=5,
+                        help="ride requests per ride before the passenger gives up")
+    parser.add_argument('--login-concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="allowed fractional slowdown before a run counts as a regression")
+    parser.add_argument('--save-baseline', action='store_true', help="write this run as the new baseline")
+    args = parser.parse_args()
+
+    old_name = None
+    if args.url:
+        target = urlsplit(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        old_name = setup_django()
+        start_daphne(args.port)
+        time.sleep(1)  # let the reactor bind
+        host, port = '127.0.0.1', args.port
+
+    try:
+        stats, setup_elapsed, elapsed = asyncio.run(run(args, host, port))
+    finally:
+        if old_name is not None:
+            teardown_django(old_name)
+
+    summary = summarize(stats, setup_elapsed, elapsed)
+    print_report(summary, stats)
+
+    summary['config'] = {name: getattr(args, name) for name in CONFIG_ARGS}
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(summary, indent=2) + '\n')
+        print(f"\nBaseline written to {args.baseline}")
+        sys.exit(0)
+
+    regressions = []
+    if summary['rides_completed'] == 0:
+        regressions.append("no ride completed")
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get('config') != summary['config']:
+            # Throughput and tails scale with the workload: comparing across
+            # configs reports regressions that are only a smaller run
+            print(f"\nNot comparing with {args.baseline.name}: it was recorded with {baseline.get('config')}, "
+                  f"this run used {summary['config']}. Rerun with the baseline's arguments, or "
+                  f"record a baseline for these with --save-baseline")
+        else:
+            regressions += compare(summary, baseline, args.tolerance)
+            print(f"\nCompared with {args.baseline.name} (tolerance {args.tolerance:.0%})")
+    else:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one")
+
+    if regressions:
+        print("REGRESSIONS:")
+        for line in regressions:
+            print(f"  - {line}")
+        sys.exit(1)
+    print("OK: no regressions")
+
+
+if __name__ == '__main__':
+    main()
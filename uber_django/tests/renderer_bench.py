@@ -0,0 +1,125 @@
+"""
+GoTaxi rides list rendering and compression benchmark
+
+Measures the /api/rides/ list payload (standardized envelope, one cursor
+page) with:
+
+  - render: DRF JSONRenderer vs rides.renderers.FastJSONRenderer
+  - compress: identity vs gzip vs brotli (if installed) at the configured
+    levels, reporting bytes on the wire and CPU per response
+  - end to end: GET /api/rides/ through the full middleware stack
+
+Runs against a throwaway test database.
+
+Usage (from uber_django/):
+  python tests/renderer_bench.py --rides 3000 --repeat 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'uber_backend.settings')
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+def setup_django():
+    """Configure Django and switch to a fresh test database"""
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    return old_name
+
+
+def teardown_django(old_name):
+    from django.db import connection
+    from django.test.utils import teardown_test_environment
+
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    teardown_test_environment()
+
+
+def timed(func, repeat):
+    """Median seconds per call over repeat calls"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+# ----------------------------
+# Benchmark
+# ----------------------------
+def run(args):
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.test import APIClient
+    from rides import middleware
+    from rides.models import PassengerProfile
+    from rides.renderers import FastJSONRenderer
+    from rides.seeding import seed
+
+    # Few passengers, many rides each, so every page is full
+    seed(args.drivers, args.passengers, args.rides, random_seed=1)
+    passenger = PassengerProfile.objects.select_related('user').order_by('id').first()
+    client = APIClient()
+    client.force_authenticate(passenger.user)
+
+    config = middleware.get_compression_config()
+    codings = ['gzip'] + (['br'] if middleware.brotli is not None else [])
+    print(f"brotli {'available' if middleware.brotli else 'not installed'}; "
+          f"MIN_SIZE={config['MIN_SIZE']} GZIP_LEVEL={config['GZIP_LEVEL']} "
+          f"BROTLI_QUALITY={config['BROTLI_QUALITY']}; median of {args.repeat} calls")
+
+    for page_size in args.page_sizes:
+        payload = client.get(f'/api/rides/?page_size={page_size}').data
+        body = FastJSONRenderer().render(payload)
+        assert body == JSONRenderer().render(payload), "renderers disagree"
+
+        drf = timed(lambda: JSONRenderer().render(payload), args.repeat)
+        fast = timed(lambda: FastJSONRenderer().render(payload), args.repeat)
+        print(f"\npage_size={page_size}: {len(payload['data'])} rides, {len(body)} bytes")
+        print(f"  render  drf {drf * 1000:7.3f}ms   orjson {fast * 1000:7.3f}ms   ({drf / fast:.1f}x)")
+
+        for coding in codings:
+            size = len(middleware.compress(body, coding, config))
+            cost = timed(lambda: middleware.compress(body, coding, config), args.repeat)
+            print(f"  {coding:<5}   {size:7d} bytes ({size / len(body):5.1%})   {cost * 1000:7.3f}ms")
+
+        for coding in [''] + codings:
+            url = f'/api/rides/?page_size={page_size}'
+            total = timed(lambda: client.get(url, HTTP_ACCEPT_ENCODING=coding), args.repeat)
+            wire = len(client.get(url, HTTP_ACCEPT_ENCODING=coding).content)
+            print(f"  GET {coding or 'identity':<9} {total * 1000:7.3f}ms  {wire:7d} bytes on the wire")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rides list render/compression benchmark")
+    parser.add_argument('--rides', type=int, default=3000)
+    parser.add_argument('--drivers', type=int, default=50)
+    parser.add_argument('--passengers', type=int, default=10)
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[20, 100])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        run(args)
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+GoTaxi ride serializer microbenchmark
+
+Compares RideSerializer with the fast read path in rides.fast_serializers
+on the same rides and checks the rendered JSON is byte-for-byte equal:
+
+  - drf:        RideSerializer(rides, many=True).data
+  - instances:  serialize_ride() over the same model instances
+  - rows:       serialize_ride_row() over values_list() rows
+
+Each variant is timed serialize-only (data already loaded) and end to end
+(query + serialize). Runs against a throwaway test database.
+
+Usage (from uber_django/):
+  python tests/serializer_bench.py --rides 5000 --page 20 --repeat 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'uber_backend.settings')
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+def setup_django():
+    """Configure Django and switch to a fresh test database"""
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    return old_name
+
+
+def teardown_django(old_name):
+    from django.db import connection
+    from django.test.utils import teardown_test_environment
+
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    teardown_test_environment()
+
+
+def timed(func, repeat):
+    """Median seconds per call over repeat calls"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+# ----------------------------
+# Benchmark
+# ----------------------------
+def run(args):
+    from rest_framework.renderers import JSONRenderer
+    from rides.fast_serializers import ride_rows, serialize_ride, serialize_ride_row
+    from rides.models import Ride
+    from rides.seeding import seed
+    from rides.serializers import RideSerializer
+
+    seed(args.drivers, args.passengers, args.rides, random_seed=1)
+    queryset = Ride.objects.select_related('passenger__user', 'driver__user', 'payment').order_by('-id')
+    page = slice(0, args.page)
+
+    instances = list(queryset[page])
+    rows = list(ride_rows(queryset)[page])
+
+    renderer = JSONRenderer()
+    expected = renderer.render(RideSerializer(instances, many=True).data)
+    assert renderer.render([serialize_ride(ride) for ride in instances]) == expected, "instances differ"
+    assert renderer.render([serialize_ride_row(row) for row in rows]) == expected, "rows differ"
+
+    variants = {
+        'drf': (
+            lambda: RideSerializer(instances, many=True).data,
+            lambda: RideSerializer(list(queryset[page]), many=True).data,
+        ),
+        'instances': (
+            lambda: [serialize_ride(ride) for ride in instances],
+            lambda: [serialize_ride(ride) for ride in queryset[page]],
+        ),
+        'rows': (
+            lambda: [serialize_ride_row(row) for row in rows],
+            lambda: [serialize_ride_row(row) for row in ride_rows(queryset)[page]],
+        ),
+    }
+
+    print(f"{args.page} rides per call, median of {args.repeat} calls; output identical to RideSerializer")
+    baseline = None
+    for name, (serialize_only, end_to_end) in variants.items():
+        cpu = timed(serialize_only, args.repeat)
+        total = timed(end_to_end, args.repeat)
+        baseline = baseline or (cpu, total)
+        print(
+            f"  {name:<10} serialize {cpu * 1000:8.3f}ms ({baseline[0] / cpu:5.1f}x)   "
+            f"query+serialize {total * 1000:8.3f}ms ({baseline[1] / total:5.1f}x)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ride serializer microbenchmark")
+    parser.add_argument('--rides', type=int, default=2000)
+    parser.add_argument('--drivers', type=int, default=200)
+    parser.add_argument('--passengers', type=int, default=500)
+    parser.add_argument('--page', type=int, default=20, help="Rides serialized per call (one list page)")
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        run(args)
+    finally:
+        teardown_django(old_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""
+GoTaxi WebSocket load test
+
+Opens many simulated passenger (ws/ride/<id>/) and driver (ws/driver/<id>/)
+sockets against uber_backend.asgi.application, pushes ride lifecycle events
+through the channel layer and reports:
+
+  - connection setup latency
+  - message fan-out latency percentiles
+  - memory per connection
+  - dropped messages
+
+Runs against a throwaway test database, never db.sqlite3.
+
+Usage (from uber_django/):
+  python tests/ws_load.py --passengers 2000 --drivers 2000
+  python tests/ws_load.py --mode socket --port 8765   # needs `pip install websockets`
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'uber_backend.settings')
+
+LIFECYCLE = ['assigned', 'accepted', 'in_progress', 'completed']
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def format_ms(values):
+    return (
+        f"p50={percentile(values, 50) * 1000:.2f}ms "
+        f"p90={percentile(values, 90) * 1000:.2f}ms "
+        f"p99={percentile(values, 99) * 1000:.2f}ms "
+        f"max={max(values, default=0) * 1000:.2f}ms"
+    )
+
+
+def setup_django():
+    """Configure Django and switch to a fresh test database"""
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    return old_name
+
+
+def teardown_django(old_name):
+    from django.db import connection
+    from django.test.utils import teardown_test_environment
+
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    teardown_test_environment()
+
+
+def provision(passenger_count, driver_count):
+    """Create users, profiles and one ride per passenger; return socket specs"""
+    from rest_framework_simplejwt.tokens import AccessToken
+    from rides.models import User, DriverProfile, PassengerProfile, Ride
+
+    drivers = []
+    for i in range(driver_count):
+        user = User(username=f'lt_driver_{i}', is_driver=True, is_passenger=False)
+        user.set_unusable_password()
+        drivers.append(user)
+    passengers = []
+    for i in range(passenger_count):
+        user = User(username=f'lt_passenger_{i}')
+        user.set_unusable_password()
+        passengers.append(user)
+    User.objects.bulk_create(drivers + passengers, batch_size=500)
+
+    driver_users = User.objects.filter(username__startswith='lt_driver_').order_by('id')
+    passenger_users = User.objects.filter(username__startswith='lt_passenger_').order_by('id')
+    DriverProfile.objects.bulk_create(
+        [DriverProfile(user=u, car_model='Load Test', car_plate=f'LT-{u.id}',
+                       latitude=0.0, longitude=0.0, is_available=False) for u in driver_users],
+        batch_size=500
+    )
+    PassengerProfile.objects.bulk_create(
+        [PassengerProfile(user=u, phone_number='') for u in passenger_users],
+        batch_size=500
+    )
+
+    driver_ids = list(DriverProfile.objects.order_by('id').values_list('id', flat=True))
+    passenger_profiles = list(PassengerProfile.objects.select_related('user').order_by('id'))
+    Ride.objects.bulk_create(
+        [Ride(passenger=p, driver_id=driver_ids[i % len(driver_ids)] if driver_ids else None,
+              pickup_location='A', dropoff_location='B',
+              pickup_lat=0.0, pickup_lng=0.0, dropoff_lat=0.01, dropoff_lng=0.01)
+         for i, p in enumerate(passenger_profiles)],
+        batch_size=500
+    )
+    rides = list(Ride.objects.order_by('id').values_list('id', 'driver_id', 'passenger__user_id'))
+    users = {u.id: u for u in passenger_users}
+
+    sockets = []
+    for ride_id, driver_id, user_id in rides:
+        token = str(AccessToken.for_user(users[user_id]))
+        sockets.append({
+            'role': 'passenger',
+            'path': f'/ws/ride/{ride_id}/?token={token}',
+            'group': f'ride_{ride_id}',
+        })
+    for driver_id in driver_ids:
+        sockets.append({
+            'role': 'driver',
+            'path': f'/ws/driver/{driver_id}/',
+            'group': f'driver_{driver_id}',
+        })
+    return sockets, rides
+
+
+# ----------------------------
+# Client transports
+# ----------------------------
+class InProcessClient:
+    """Socket driven through channels' WebsocketCommunicator"""
+
+    def __init__(self, application, path):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=10)
+        return connected
+
+    async def receive(self, timeout):
+        return await self.communicator.receive_from(timeout=timeout)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    """Socket over TCP to a local daphne server"""
+
+    def __init__(self, base_url, path):
+        self.url = base_url + path
+        self.connection = None
+
+    async def connect(self):
+        import websockets
+        self.connection = await websockets.connect(self.url, max_queue=None)
+        return True
+
+    async def receive(self, timeout):
+        return await asyncio.wait_for(self.connection.recv(), timeout)
+
+    async def close(self):
+        await self.connection.close()
+
+
+def start_daphne(application, port):
+    """Run daphne in a background thread; return the loop it serves on"""
+    from daphne.server import Server, twisted_loop
+
+    server = Server(
+        application,
+        endpoints=[f'tcp:port={port}:interface=127.0.0.1'],
+        signal_handlers=False,
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    return server, twisted_loop
+
+
+# ----------------------------
+# Load run
+# ----------------------------
+class Stats:
+    def __init__(self):
+        self.connect_latencies = []
+        self.failed_connects = 0
+        self.fanout_latencies = []
+        self.expected = 0
+        self.received = 0
+
+
+async def reader(client, expected, stats, deadline):
+    """Drain one socket, recording fan-out latency for each tagged message"""
+    got = 0
+    while got < expected:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        try:
+            raw = await client.receive(timeout=remaining)
+        except (asyncio.TimeoutError, TimeoutError):
+            break
+        message = json.loads(raw)
+        ride = message.get('ride') or {}
+        sent_at = ride.get('_lt_sent_at') if isinstance(ride, dict) else None
+        if sent_at is None:
+            # e.g. the current_ride push on driver connect
+            continue
+        stats.fanout_latencies.append(time.perf_counter() - sent_at)
+        got += 1
+    stats.received += got
+
+
+async def run(args, sockets, rides):
+    from channels.layers import get_channel_layer
+    from rides import send_queue
+    from uber_backend.asgi import application
+
+    channel_layer = get_channel_layer()
+    stats = Stats()
+
+    publish_loop = None
+    if args.mode == 'socket':
+        _, publish_loop = start_daphne(application, args.port)
+        base_url = f'ws://127.0.0.1:{args.port}'
+        await asyncio.sleep(1)  # let the reactor bind
+        make_client = lambda path: SocketClient(base_url, path)  # noqa: E731
+    else:
+        make_client = lambda path: InProcessClient(application, path)  # noqa: E731
+
+    async def publish(group, payload):
+        coro = channel_layer.group_send(group, {'type': 'ride_update', 'ride': payload})
+        if publish_loop is None:
+            await coro
+        else:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, publish_loop))
+
+    # --- Connect ---
+    print(f"Connecting {len(sockets)} sockets ({args.mode})...")
+    tracemalloc.start()
+    mem_before = tracemalloc.get_traced_memory()[0]
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+    clients = []
+
+    async def open_socket(spec):
+        client = make_client(spec['path'])
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await client.connect()
+            except Exception as e:
+                print(f"Connect error: {e}")
+                ok = False
+            elapsed = time.perf_counter() - started
+        if ok:
+            stats.connect_latencies.append(elapsed)
+            clients.append((spec, client))
+        else:
+            stats.failed_connects += 1
+
+    await asyncio.gather(*(open_socket(spec) for spec in sockets))
+    mem_after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # --- Drive lifecycle ---
+    # Each ride's events go to ride_<id> and driver_<id>; a driver serving
+    # several rides receives every one of them.
+    per_group = {}
+    for ride_id, driver_id, _ in rides:
+        per_group[f'ride_{ride_id}'] = per_group.get(f'ride_{ride_id}', 0) + len(LIFECYCLE)
+        if driver_id:
+            key = f'driver_{driver_id}'
+            per_group[key] = per_group.get(key, 0) + len(LIFECYCLE)
+
+    budget = len(LIFECYCLE) * args.step_interval + args.drain_timeout
+    deadline = time.perf_counter() + budget
+    readers = []
+    for spec, client in clients:
+        expected = per_group.get(spec['group'], 0)
+        stats.expected += expected
+        readers.append(asyncio.create_task(reader(client, expected, stats, deadline)))
+
+    print(f"Driving {len(rides)} rides through {', '.join(LIFECYCLE)}...")
+    publish_started = time.perf_counter()
+    for seq, ride_status in enumerate(LIFECYCLE):
+        sends = []
+        for ride_id, driver_id, _ in rides:
+            payload = {'id': ride_id, 'status': ride_status, 'seq': seq}
+            payload['_lt_sent_at'] = time.perf_counter()
+            sends.append(publish(f'ride_{ride_id}', payload))
+            if driver_id:
+                sends.append(publish(f'driver_{driver_id}', dict(payload)))
+        await asyncio.gather(*sends)
+        await asyncio.sleep(args.step_interval)
+    publish_elapsed = time.perf_counter() - publish_started
+
+    await asyncio.gather(*readers)
+    await asyncio.gather(*(client.close() for _, client in clients), return_exceptions=True)
+
+    # --- Report ---
+    connected = len(stats.connect_latencies)
+    print("")
+    print("=== WebSocket load test ===")
+    print(f"mode:               {args.mode}")
+    print(f"sockets:            {connected} connected, {stats.failed_connects} failed")
+    print(f"connect latency:    {format_ms(stats.connect_latencies)}")
+    if connected:
+        print(f"memory/connection:  {(mem_after - mem_before) / connected / 1024:.1f} KiB "
+              f"(python heap, client + server side)")
+    print(f"messages:           {stats.received}/{stats.expected} delivered, "
+          f"{stats.expected - stats.received} dropped")
+    print(f"fan-out latency:    {format_ms(stats.fanout_latencies)}")
+    print(f"publish rate:       {stats.expected / publish_elapsed:.0f} msg/s offered")
+    queue = send_queue.get_metrics()
+    print(f"send queues:        max length {queue['max_queue_length']}, "
+          f"{queue['dropped']} dropped, {queue['coalesced']} coalesced, "
+          f"{queue['disconnected']} disconnected")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket consumer load test")
+    parser.add_argument('--passengers', type=int, default=500)
+    parser.add_argument('--drivers', type=int, default=500)
+    parser.add_argument('--mode', choices=['inprocess', 'socket'], default='inprocess')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--connect-concurrency', type=int, default=200)
+    parser.add_argument('--step-interval', type=float, default=0.5,
+                        help="seconds between lifecycle steps")
+    parser.add_argument('--drain-timeout', type=float, default=10.0,
+                        help="seconds to wait for stragglers after the last step")
+    args = parser.parse_args()
+
+    old_name = setup_django()
+    try:
+        sockets, rides = provision(args.passengers, args.drivers)
+        stats = asyncio.run(run(args, sockets, rides))
+    finally:
+        teardown_django(old_name)
+    sys.exit(0 if stats.failed_connects == 0 else 1)
+
+
+if __name__ == '__main__':
+    main()
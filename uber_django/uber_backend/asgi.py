@@ -2,7 +2,7 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from rides import routing
+from rides import routing, settlement
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'uber_backend.settings')
 
@@ -13,4 +13,7 @@ application = ProtocolTypeRouter({
             routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
+
+# Settle payments left pending by an earlier process without waiting for a completion
+settlement.start_worker()
\ No newline at end of file
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -52,11 +53,32 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [],
+    # orjson-backed drop-ins for DRF's JSONRenderer/JSONParser (rides/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'rides.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rides.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Negotiated brotli/gzip for responses of at least MIN_SIZE bytes (brotli is
+# used only when the `brotli` package is installed)
+RESPONSE_COMPRESSION = {
+    'MIN_SIZE': 1024,
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
 }
 
 MIDDLEWARE = [
+    'rides.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'rides.middleware.CompressionMiddleware',
+    'rides.middleware.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -91,16 +113,190 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Bounded outbound queue per websocket connection (rides/send_queue.py)
+# POLICY: 'drop_oldest', 'coalesce' (keep latest state per ride) or 'disconnect'
+WS_SEND_QUEUE = {
+    'MAX_SIZE': 50,
+    'POLICY': 'coalesce',
+}
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Run on every new SQLite connection. WAL lets ride polls and earnings reads
+# proceed while location updates are being written.
+SQLITE_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL;"
+    "PRAGMA mmap_size=268435456;"   # 256 MB
+    "PRAGMA cache_size=-65536;"     # 64 MB
+    "PRAGMA busy_timeout=5000;"
+)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': "PRAGMA journal_mode=WAL;" + SQLITE_PRAGMAS,
+            # Take the write lock up front instead of failing on lock upgrade
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Optional read alias for list/retrieve/earnings/profile GETs (rides/db.py).
+# Point DB_REPLICA_NAME at a replica file, or at db.sqlite3 itself to give
+# reads their own read-only connection.
+DB_REPLICA_NAME = os.environ.get('DB_REPLICA_NAME')
+if DB_REPLICA_NAME:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{DB_REPLICA_NAME}?mode=ro',
+        'OPTIONS': {
+            'init_command': SQLITE_PRAGMAS,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+
+DATABASE_ROUTERS = ['rides.db.PrimaryReplicaRouter']
+
+# After a write, the user's reads stay on the primary for SECONDS (rides/db.py).
+# The mark is kept per user in CACHE, so it only follows the user to workers
+# sharing that cache: with LocMem, reads-your-writes holds within one process.
+# Point CACHE at a shared backend (Redis, Memcached) when running several
+DB_READ_YOUR_WRITES = {
+    'CACHE': 'default',
+    'SECONDS': 5,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Responses stored for Idempotency-Key replays (rides/idempotency.py);
+    # MAX_ENTRIES bounds memory, older entries are culled first
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'idempotency',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Pre-trip estimates per grid cell pair and cell supply versions
+    # (rides/estimates.py); entries live seconds, so culling rarely matters
+    'estimates': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'estimates',
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+        },
+    },
+}
+
+# Per-user token buckets (tokens per second, burst) checked before auth;
+# over-limit requests get a 429. Point CACHE at a shared cache to enforce
+# the limits across workers instead of per process
+RATE_LIMITS = {
+    'CACHE': 'default',
+    'SCOPES': {
+        'location': {'RATE': 1.0, 'BURST': 10},
+        'poll': {'RATE': 2.0, 'BURST': 20},
+        'create': {'RATE': 0.2, 'BURST': 5},
+    },
+}
+
+# Who may scrape /metrics (rides/telemetry.py): these addresses, or any client
+# sending "Authorization: Bearer $METRICS_TOKEN". Behind a reverse proxy on this
+# host every client looks local: empty ALLOWED_IPS there and rely on the token
+METRICS = {
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+# Sampled spans for ride creation and lifecycle actions (rides/tracing.py),
+# exported as Zipkin v2 JSON to a file and/or a collector URL
+TRACING = {
+    'SAMPLE_RATE': float(os.environ.get('TRACE_SAMPLE_RATE', '0.01')),
+    'BUFFER_SIZE': 4096,
+    'FLUSH_SECONDS': 5.0,
+    'EXPORT_PATH': os.environ.get('TRACE_EXPORT_PATH'),
+    'EXPORT_URL': os.environ.get('TRACE_EXPORT_URL'),
+    'SERVICE_NAME': 'gotaxi-api',
+}
+
+IDEMPOTENCY = {
+    'CACHE': 'idempotency',
+    'TTL': 24 * 60 * 60,
+    'LOCK_SECONDS': 30,
+}
+
+# /api/drivers/me/ and /api/passengers/me/ responses are cached per user for
+# TTL_SECONDS (rides/profile_cache.py); profile, location and availability
+# writes drop them sooner. 'default' is LocMem, so a write only drops the
+# copy in the worker that made it; other workers can show a driver's
+# availability and location up to the driver TTL late. Point CACHE at a
+# shared backend (Redis, Memcached) to invalidate everywhere
+PROFILE_CACHE = {
+    'CACHE': 'default',
+    'TTL_SECONDS': {'driver': 5, 'passenger': 300},
+}
+
+# Fare engine tariff (rides/fares.py). TIME_OF_DAY bands are local hours,
+# e.g. {'FROM': 7, 'TO': 10, 'MULTIPLIER': 1.3}; ZONES apply when pickup or
+# dropoff is within RADIUS_KM, e.g. an airport
+FARE_TARIFF = {
+    'BASE': 5.0,
+    'PER_KM': 1.5,
+    'PER_MINUTE': 0.0,
+    'MINIMUM': 0.0,
+    'AVERAGE_SPEED_KMH': 25.0,
+    'TIME_OF_DAY': [],
+    'ZONES': [],
+}
+
+# GET /api/rides/estimate/ answers are shared per pickup and dropoff grid cell
+# for TTL_SECONDS, or until available drivers near the pickup cell change.
+# The 'estimates' cache is LocMem, so a supply change only invalidates the
+# worker that wrote it; other workers serve their copy until TTL_SECONDS runs
+# out. Point CACHE at a shared backend (Redis, Memcached) to invalidate everywhere
+RIDE_ESTIMATES = {
+    'CACHE': 'estimates',
+    'CELL_DEGREES': 0.01,
+    'TTL_SECONDS': 5,
+}
+
+# An assigned driver has ACCEPT_SECONDS to accept before the ride goes to the
+# next nearest driver (rides/offers.py), up to MAX_OFFERS drivers per ride
+RIDE_OFFERS = {
+    'ACCEPT_SECONDS': 20,
+    'TICK_SECONDS': 0.25,
+    'MAX_OFFERS': 5,
+}
+
+# Completed rides get a pending payment, charged in batches by a background
+# worker (rides/settlement.py) with retries and backoff. Point GATEWAY at a
+# real PaymentGateway subclass. The worker thread starts with the ASGI/WSGI
+# application; set WORKER False when `manage.py settle_payments` runs as its
+# own process instead
+PAYMENT_SETTLEMENT = {
+    'GATEWAY': 'rides.settlement.FakeGateway',
+    'GATEWAY_OPTIONS': {},
+    'WORKER': True,
+    'BATCH_SIZE': 50,
+    'POLL_SECONDS': 1.0,
+    'LEASE_SECONDS': 60,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 2.0,
+    'MAX_BACKOFF_SECONDS': 300.0,
+}
+
+# `manage.py archive_rides` moves rides finished longer ago than this out of
+# the hot rides table
+RIDE_ARCHIVE_AFTER_DAYS = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -120,6 +316,23 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# PBKDF2 runs on a bounded process pool (rides/hashing.py) so login and
+# registration bursts cannot take every core from ride requests. The pooled
+# hasher replaces Django's PBKDF2PasswordHasher (same algorithm name)
+PASSWORD_HASHERS = [
+    'rides.hashing.PooledPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+PASSWORD_HASHING_POOL = {
+    'WORKERS': max(1, (os.cpu_count() or 2) // 2),
+    'MAX_PENDING': 32,
+    'QUEUE_TIMEOUT': 5.0,
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
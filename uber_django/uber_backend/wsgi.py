@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'uber_backend.settings')
 
 application = get_wsgi_application()
+
+from rides import settlement  # noqa: E402 (needs the app registry)
+
+# Settle payments left pending by an earlier process without waiting for a completion
+settlement.start_worker()